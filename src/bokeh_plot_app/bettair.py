@@ -0,0 +1,384 @@
+"""
+Command line interface of BettAir.
+
+    python bettair.py fetch 3057947 225719 ... -o stations.json
+    python bettair.py heatmap stations.json -o heatmap.npy --png heatmap.png --explain rules.npz --pollutants
+    python bettair.py query stations.json 51.5 -0.12
+    python bettair.py serve stations.json --port 8765
+    python bettair.py export heatmap.npy --format tiles -o tiles/
+    python bettair.py zones stations.json heatmap.npy -o zones.geojson
+    python bettair.py bench --size 1000 --stations 50
+    python bettair.py accuracy --samples 1000000
+    python bettair.py watch stations.json --interval 600 -o heatmap.npy --patch-dir patches/
+    BETTAIR_AUTHKEY=... python bettair.py coordinate stations.json --size 5000 --host 10.0.0.5 --port 50000 -o heatmap.npy
+    BETTAIR_AUTHKEY=... python bettair.py work 10.0.0.5:50000
+
+Importing this module only sets up the argument parser: NumPy, SciPy, skfuzzy, Bokeh and
+requests are imported by the subcommands that need them.
+"""
+import argparse
+import json
+import os
+import sys
+
+
+INTERPOLATIONS = ('idw', 'barycentric', 'rbf', 'kriging')
+"""Names of interpolation.INTERPOLATORS, repeated here so building the parser imports nothing."""
+
+
+def _load_map(path: str, size: int, interpolation: str = 'idw'):
+    # Station snapshots are written by the fetch subcommand
+    import numpy as np
+    from mapApi import Map, Station
+
+    with open(path) as file:
+        snapshot = json.load(file)
+    stations = [Station.from_values(**station) for station in snapshot['stations']]
+    map_obj = Map(np.array(stations), size=size)
+    if interpolation != 'idw':
+        map_obj.set_interpolation(interpolation)
+    return map_obj
+
+
+def fetch(args: argparse.Namespace) -> None:
+    from mapApi import MISSING, POLLUTANTS
+    from regions import build_stations
+
+    region = {'name': 'cli', 'location_ids': args.location_ids, 'seed': args.seed}
+    if args.config:
+        from regions import load_config
+        region = next(region for region in load_config(args.config) if region['name'] == args.region)
+    stations, skipped = build_stations(region)
+    snapshot = {
+        'stations': [{'location_id': station.location_id, 'latitude': station.latitude, 'longitude': station.longitude,
+                      'air_quality': float(station.data[0]), 'population_density': float(station.data[1]),
+                      'veg_cover': float(station.data[2]),
+                      'pollutants': {name: float(value) for name, value in zip(POLLUTANTS, station.pollutants) if value != MISSING}}
+                     for station in stations],
+        'skipped': skipped
+    }
+    with open(args.output, 'w') as file:
+        json.dump(snapshot, file, indent=2)
+    print(f"Wrote {len(stations)} stations to {args.output} ({len(skipped)} skipped)")
+
+
+def heatmap(args: argparse.Namespace) -> None:
+    import numpy as np
+    from heatmap_utils_api import compute_heatmap
+
+    map_obj = _load_map(args.stations, args.size, args.interpolation)
+    dtype = np.float32 if args.dtype == 'float32' else np.float64
+    explain = args.explain is not None
+
+    def compute() -> dict:
+        # The heatmap, and with --explain the uint8 rule firing and clip level rasters of the same pass
+        if not explain:
+            return {'heatmap': compute_heatmap(map_obj, dtype=dtype, pollutants=args.pollutants)}
+        result, rasters = compute_heatmap(map_obj, dtype=dtype, explain=True, pollutants=args.pollutants)
+        return {'heatmap': result, **rasters}
+
+    if args.no_cache:
+        arrays = compute()
+    else:
+        from heatmap_cache import HeatmapCache, fuzzy_config_fingerprint
+        from heatmap_utils_api import build_fuzzy_system, build_pollutant_system
+
+        cache = HeatmapCache()
+        grid_spec = {'size': args.size, 'dtype': args.dtype, 'interpolation': args.interpolation}
+        data, system = map_obj.data, build_fuzzy_system()['ctrl_sys']
+        if args.pollutants:
+            data, system = np.hstack([map_obj.data, map_obj.pollutants]), build_pollutant_system()['ctrl_sys']
+        key = HeatmapCache.make_key(map_obj.coordinates, data, grid_spec, fuzzy_config_fingerprint(system))
+        cached = cache.get(key)
+        if cached is not None and (not explain or len(cached[0]) > 1):
+            arrays = cached[0]
+        else:
+            arrays = compute()
+            cache.put(key, arrays)
+
+    result = arrays.pop('heatmap')
+    np.save(args.output, result)
+    print(f"Wrote {result.shape[0]}x{result.shape[1]} heatmap to {args.output}")
+    if explain:
+        np.savez_compressed(args.explain, **arrays)
+        print(f"Wrote {len(arrays)} explanation rasters to {args.explain}")
+    if args.png:
+        from png_renderer import render_rgba, write_png
+        write_png(args.png, render_rgba(result, cmap='hot', vmin=0, vmax=100))
+        print(f"Wrote {args.png}")
+
+
+def query(args: argparse.Namespace) -> None:
+    import numpy as np
+    from query_service import query_points
+
+    assert len(args.coordinates) % 2 == 0, "Expected latitude/longitude pairs"
+    map_obj = _load_map(args.stations, args.size, args.interpolation)
+    results = query_points(map_obj, np.array(args.coordinates, dtype=float).reshape(-1, 2))
+    print(json.dumps(results if len(results) > 1 else results[0], indent=2))
+
+
+def serve(args: argparse.Namespace) -> None:
+    from query_service import make_server
+
+    server = make_server(_load_map(args.stations, args.size, args.interpolation), host=args.host, port=args.port,
+                         max_batch_points=args.max_batch_points, max_batch_wait=args.max_batch_wait)
+    print(f"Serving need_for_action queries on http://{args.host}:{server.server_port}/query")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+        server.batcher.close()
+
+
+def export(args: argparse.Namespace) -> None:
+    import numpy as np
+
+    result = np.load(args.heatmap)
+    if args.format == 'html':
+        from bokeh_payload import compare_export_modes
+        for entry in compare_export_modes(result, args.output, low=args.vmin, high=args.vmax):
+            print(f"{entry['mode']:>9}: {entry['html_bytes'] / 1024:10.1f} KiB  {entry['path']}")
+        return
+
+    from png_renderer import render_rgba, write_png, export_tiles
+    rgba = render_rgba(result, cmap=args.cmap, vmin=args.vmin, vmax=args.vmax, pixels_per_cell=args.pixels_per_cell)
+    if args.format == 'png':
+        write_png(args.output, rgba)
+        print(f"Wrote {args.output}")
+    else:
+        paths = export_tiles(rgba, args.output, tile_size=args.tile_size)
+        print(f"Wrote {len(paths)} tiles to {args.output}")
+
+
+def zones(args: argparse.Namespace) -> None:
+    import numpy as np
+    from contours import export_geojson
+
+    result = np.load(args.heatmap)
+    map_obj = _load_map(args.stations, result.shape[0])  # Only the grid bounds are used
+    collection = export_geojson(result, map_obj, args.output, tolerance=args.tolerance, min_area=args.min_area)
+    print(f"Wrote {len(collection['features'])} zone polygons to {args.output} "
+          f"({os.path.getsize(args.output) / 1024:.1f} KiB, raster {result.nbytes / 1024:.0f} KiB)")
+
+
+def bench(args: argparse.Namespace) -> None:
+    import numpy as np
+    from mapApi import Map, Station
+    from precision import compare_precisions
+
+    rng = np.random.default_rng(args.seed)
+    stations = [Station.from_values(51.4 + 0.2 * rng.random(), -0.2 + 0.3 * rng.random(), rng.integers(0, 71),
+                                    rng.integers(0, 151), rng.integers(0, 101)) for _ in range(args.stations)]
+    report = compare_precisions(Map(np.array(stations), size=args.size), repeats=args.repeats)
+    for name, entry in report.items():
+        print(f"{name}: {entry['cells_per_second'] / 1e6:.2f} M cells/s, peak {entry['peak_bytes'] / 1024 ** 2:.0f} MiB, "
+              f"max error {entry['max_abs_error']:.2e}")
+
+
+def watch(args: argparse.Namespace) -> None:
+    import asyncio
+    import numpy as np
+    from pipeline import Pipeline, openaq_source, stub_source
+    from heatmap_diff import encode_patch, full_patch, patch_summary
+
+    with open(args.stations) as file:
+        stations = json.load(file)['stations']
+    if args.stub:
+        source = stub_source(stations, interval=args.interval)
+    else:
+        source = openaq_source([station['location_id'] for station in stations],
+                               {station['location_id']: (station['population_density'], station['veg_cover'])
+                                for station in stations}, poll_interval=args.interval)
+
+    async def write_latest(queue: asyncio.Queue) -> None:
+        written = None
+        while (result := await queue.get()) is not None:
+            # Replaced atomically, so readers never see a half-written heatmap
+            np.save(args.output + '.tmp.npy', result['heatmap'])
+            os.replace(args.output + '.tmp.npy', args.output)
+            message = f"v{result['version']}: {result['n_stations']} stations, {result['age']:.1f} s old -> {args.output}"
+            if args.patch_dir:
+                patch = result['patch']
+                if patch['base_version'] != written:  # Versions were dropped: start the chain over
+                    patch = full_patch(result['heatmap'], result['version'], args.block_size, result['bounds'])
+                path = os.path.join(args.patch_dir, f"{patch['version']:06d}.patch")
+                with open(path + '.tmp', 'wb') as file:
+                    file.write(encode_patch(patch))
+                os.replace(path + '.tmp', path)
+                written = patch['version']
+                summary = patch_summary(patch)
+                message += f", {summary['changed_blocks']}/{summary['total_blocks']} blocks -> {path}"
+            print(message)
+
+    if args.patch_dir:
+        os.makedirs(args.patch_dir, exist_ok=True)
+
+    async def run() -> None:
+        pipeline = Pipeline(source, size=args.size, debounce=args.debounce, block_size=args.block_size,
+                            tolerance=args.tolerance, pollutants=args.pollutants)
+        await asyncio.gather(pipeline.run(), write_latest(pipeline.subscribe()))
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+def accuracy(args: argparse.Namespace) -> None:
+    from accuracy import run_suite
+
+    tolerances = dict((name, float(value)) for name, value in (item.split('=') for item in args.tolerance))
+    report = run_suite(args.samples, seed=args.seed, max_workers=args.workers, tolerances=tolerances)
+    if args.report:
+        with open(args.report, 'w') as file:
+            json.dump(report, file, indent=2)
+    sys.exit(0 if report['passed'] else 1)
+
+
+def _authkey() -> bytes:
+    # There is no default: the coordinator runs what authenticated clients send it
+    authkey = os.environ.get('BETTAIR_AUTHKEY')
+    if not authkey:
+        sys.exit("error: set the BETTAIR_AUTHKEY environment variable to a secret shared by the coordinator and its workers")
+    return authkey.encode()
+
+
+def coordinate(args: argparse.Namespace) -> None:
+    from distributed import run_coordinator
+
+    authkey = _authkey()
+    result = run_coordinator(_load_map(args.stations, args.size, args.interpolation), args.output, authkey,
+                             address=(args.host, args.port), tile_size=args.tile_size, lease_timeout=args.lease_timeout,
+                             pollutants=args.pollutants)
+    print(f"Wrote {result.shape[0]}x{result.shape[1]} heatmap to {args.output}")
+
+
+def work(args: argparse.Namespace) -> None:
+    from distributed import run_worker
+
+    host, port = args.coordinator.rsplit(':', 1)
+    run_worker((host, int(port)), authkey=_authkey())
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='bettair', description="Fuzzy recommender for the placement of green areas.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_fetch = subparsers.add_parser('fetch', help="Fetch station data from OpenAQ into a snapshot file")
+    parser_fetch.add_argument('location_ids', nargs='*', type=int, help="OpenAQ location ids")
+    parser_fetch.add_argument('--config', help="Region config (see regions.json) to take the location ids from")
+    parser_fetch.add_argument('--region', help="Name of the region in --config")
+    parser_fetch.add_argument('--seed', type=int, help="Seed for the placeholder population density and vegetation cover")
+    parser_fetch.add_argument('-o', '--output', default='stations.json')
+    parser_fetch.set_defaults(handler=fetch)
+
+    parser_heatmap = subparsers.add_parser('heatmap', help="Compute the need for action heatmap of a station snapshot")
+    parser_heatmap.add_argument('stations', help="Station snapshot written by fetch")
+    parser_heatmap.add_argument('--size', type=int, default=100, help="Grid size")
+    parser_heatmap.add_argument('--interpolation', choices=INTERPOLATIONS, default='idw')
+    parser_heatmap.add_argument('--dtype', choices=('float64', 'float32'), default='float64')
+    parser_heatmap.add_argument('--pollutants', action='store_true',
+                                help="Also use the stations' PM10, NO2 and O3 readings as fuzzy inputs")
+    parser_heatmap.add_argument('--no-cache', action='store_true', help="Always recompute instead of using the heatmap cache")
+    parser_heatmap.add_argument('--png', help="Also render the heatmap to this PNG file")
+    parser_heatmap.add_argument('--explain', metavar='NPZ',
+                                help="Also write the per-cell rule firing strengths and clip levels (uint8) to this .npz file")
+    parser_heatmap.add_argument('-o', '--output', default='heatmap.npy')
+    parser_heatmap.set_defaults(handler=heatmap)
+
+    parser_query = subparsers.add_parser('query', help="Evaluate need for action, labels and recommendation at points")
+    parser_query.add_argument('stations', help="Station snapshot written by fetch")
+    parser_query.add_argument('coordinates', nargs='+', type=float, metavar='LAT LON')
+    parser_query.add_argument('--size', type=int, default=100, help="Grid size")
+    parser_query.add_argument('--interpolation', choices=INTERPOLATIONS, default='idw')
+    parser_query.set_defaults(handler=query)
+
+    parser_serve = subparsers.add_parser('serve', help="Serve point queries over HTTP")
+    parser_serve.add_argument('stations', help="Station snapshot written by fetch")
+    parser_serve.add_argument('--host', default='127.0.0.1')
+    parser_serve.add_argument('--port', type=int, default=8765)
+    parser_serve.add_argument('--size', type=int, default=100, help="Grid size")
+    parser_serve.add_argument('--interpolation', choices=INTERPOLATIONS, default='idw')
+    parser_serve.add_argument('--max-batch-points', type=int, default=4096)
+    parser_serve.add_argument('--max-batch-wait', type=float, default=0.002, help="Seconds")
+    parser_serve.set_defaults(handler=serve)
+
+    parser_export = subparsers.add_parser('export', help="Export a heatmap to PNG, PNG tiles or Bokeh HTML")
+    parser_export.add_argument('heatmap', help="Heatmap .npy file written by the heatmap subcommand")
+    parser_export.add_argument('--format', choices=('png', 'tiles', 'html'), default='png')
+    parser_export.add_argument('--cmap', choices=('inferno', 'hot'), default='hot')
+    parser_export.add_argument('--vmin', type=float)
+    parser_export.add_argument('--vmax', type=float)
+    parser_export.add_argument('--pixels-per-cell', type=int, default=1)
+    parser_export.add_argument('--tile-size', type=int, default=256)
+    parser_export.add_argument('-o', '--output', default='heatmap.png', help="File (png) or directory (tiles, html)")
+    parser_export.set_defaults(handler=export)
+
+    parser_zones = subparsers.add_parser('zones', help="Export the need for action zones of a heatmap as GeoJSON polygons")
+    parser_zones.add_argument('stations', help="Station snapshot the heatmap was computed from (for the grid bounds)")
+    parser_zones.add_argument('heatmap', help="Heatmap .npy file written by the heatmap subcommand")
+    parser_zones.add_argument('--tolerance', type=float, default=0.5, help="Simplification tolerance in cells")
+    parser_zones.add_argument('--min-area', type=float, default=4.0, help="Drop polygons and holes below this many cells")
+    parser_zones.add_argument('-o', '--output', default='zones.geojson')
+    parser_zones.set_defaults(handler=zones)
+
+    parser_bench = subparsers.add_parser('bench', help="Benchmark the heatmap pipeline in float64 and float32")
+    parser_bench.add_argument('--size', type=int, default=1000, help="Grid size")
+    parser_bench.add_argument('--stations', type=int, default=50, help="Number of synthetic stations")
+    parser_bench.add_argument('--repeats', type=int, default=3)
+    parser_bench.add_argument('--seed', type=int, default=0)
+    parser_bench.set_defaults(handler=bench)
+
+    parser_watch = subparsers.add_parser('watch', help="Keep a heatmap up to date with streaming station readings")
+    parser_watch.add_argument('stations', help="Station snapshot written by fetch")
+    parser_watch.add_argument('--size', type=int, default=100, help="Grid size")
+    parser_watch.add_argument('--debounce', type=float, default=1.0, help="Seconds of readings coalesced into one update")
+    parser_watch.add_argument('--interval', type=float, default=600.0,
+                              help="Seconds between polls of a location (between readings with --stub)")
+    parser_watch.add_argument('--stub', action='store_true', help="Random-walk readings instead of OpenAQ")
+    parser_watch.add_argument('--patch-dir', help="Also write every version as a block patch (see heatmap_diff) to this directory")
+    parser_watch.add_argument('--block-size', type=int, default=32, help="Rows and columns per patch block")
+    parser_watch.add_argument('--tolerance', type=float, default=0.0, help="Largest change of a cell left out of the patches")
+    parser_watch.add_argument('--pollutants', action='store_true',
+                              help="Also use the readings' PM10, NO2 and O3 as fuzzy inputs")
+    parser_watch.add_argument('-o', '--output', default='heatmap.npy')
+    parser_watch.set_defaults(handler=watch)
+
+    parser_accuracy = subparsers.add_parser('accuracy', help="Compare the fast engines to the skfuzzy and IDW references")
+    parser_accuracy.add_argument('--samples', type=int, default=1_000_000, help="Number of sampled inputs")
+    parser_accuracy.add_argument('--seed', type=int, default=0)
+    parser_accuracy.add_argument('--workers', type=int, help="Processes running the reference (default: number of CPUs)")
+    parser_accuracy.add_argument('--tolerance', action='append', default=[], metavar='ENGINE=MAX_ERROR',
+                                 help="Override the tolerance of an engine, e.g. batch=0.01")
+    parser_accuracy.add_argument('--report', help="Write the full report, with the worst inputs, to this JSON file")
+    parser_accuracy.set_defaults(handler=accuracy)
+
+    # The shared secret of coordinator and workers is read from the BETTAIR_AUTHKEY environment variable, which must be set
+    parser_coordinate = subparsers.add_parser('coordinate', help="Hand out heatmap tiles to distributed workers")
+    parser_coordinate.add_argument('stations', help="Station snapshot written by fetch")
+    parser_coordinate.add_argument('--size', type=int, default=100, help="Grid size")
+    parser_coordinate.add_argument('--interpolation', choices=INTERPOLATIONS, default='idw')
+    parser_coordinate.add_argument('--tile-size', type=int, default=256)
+    parser_coordinate.add_argument('--lease-timeout', type=float, default=30.0,
+                                   help="Seconds without heartbeat before a worker's tiles are handed out again")
+    parser_coordinate.add_argument('--host', default='127.0.0.1', help="Interface to listen on ('' for all)")
+    parser_coordinate.add_argument('--port', type=int, default=50000)
+    parser_coordinate.add_argument('--pollutants', action='store_true',
+                                   help="Also use the stations' PM10, NO2 and O3 readings as fuzzy inputs")
+    parser_coordinate.add_argument('-o', '--output', default='heatmap.npy')
+    parser_coordinate.set_defaults(handler=coordinate)
+
+    parser_work = subparsers.add_parser('work', help="Compute heatmap tiles for a coordinator")
+    parser_work.add_argument('coordinator', help="HOST:PORT of the coordinator")
+    parser_work.set_defaults(handler=work)
+    return parser
+
+
+def main(argv: list[str] = None) -> None:
+    args = build_parser().parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
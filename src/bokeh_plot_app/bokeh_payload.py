@@ -0,0 +1,267 @@
+import json
+import logging
+import os
+import time
+import numpy as np
+from bokeh.embed import file_html
+from bokeh.models import ColumnDataSource, CustomJS, CustomJSHover, HoverTool, LinearColorMapper
+from bokeh.plotting import figure
+from bokeh.resources import CDN
+from png_renderer import render_rgba, write_png
+from heatmap_utils_api import STRENGTH_LEVELS
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+EXPORT_MODES = ('float', 'rgba', 'quantized', 'lod')
+"""How the heatmap is embedded in the Bokeh document:
+'float' the raw float64 grid (the original behaviour), 'rgba' a pre-colormapped uint8 RGBA image,
+'quantized' a uint8 grid with a scale/offset, 'lod' a small RGBA overview plus PNG tiles loaded on zoom."""
+NAN_CODE = 255
+"""Quantized code reserved for cells without a value."""
+
+
+def quantize(heatmap: np.ndarray, low: float = None, high: float = None) -> tuple[np.ndarray, float, float]:
+    """
+    Quantizes a heatmap to uint8 codes 0-254, such that value ~= code * scale + offset.
+
+    Parameters:
+    - heatmap (np.ndarray): The heatmap to quantize.
+    - low, high (float): Value range covered by the codes (default: the range of the heatmap).
+
+    Returns:
+    - tuple[np.ndarray, float, float]: The codes (NaN cells get NAN_CODE), scale and offset.
+    """
+    finite = np.isfinite(heatmap)
+    low = float(np.min(heatmap[finite], initial=0.0)) if low is None else low
+    high = float(np.max(heatmap[finite], initial=1.0)) if high is None else high
+    scale = (high - low) / (NAN_CODE - 1) if high > low else 1.0
+    codes = np.clip(np.rint((np.nan_to_num(heatmap, nan=low) - low) / scale), 0, NAN_CODE - 1).astype(np.uint8)
+    codes[~finite] = NAN_CODE
+    return codes, scale, low
+
+
+def dequantize(codes: np.ndarray, scale: float, offset: float) -> np.ndarray:
+    """
+    Inverse of quantize, NAN_CODE cells become NaN.
+    """
+    values = codes * scale + offset
+    values[codes == NAN_CODE] = np.nan
+    return values
+
+
+def downsample(heatmap: np.ndarray, factor: int) -> np.ndarray:
+    """
+    Block-averages a heatmap by an integer factor, ignoring NaN cells. Edges that do not fill a
+    whole block are averaged over the cells they have.
+    """
+    if factor <= 1:
+        return heatmap
+    rows, cols = heatmap.shape
+    padded = np.full((-(-rows // factor) * factor, -(-cols // factor) * factor), np.nan)
+    padded[:rows, :cols] = heatmap
+    blocks = padded.reshape(padded.shape[0] // factor, factor, padded.shape[1] // factor, factor)
+    counts = np.isfinite(blocks).sum(axis=(1, 3))
+    sums = np.nansum(blocks, axis=(1, 3))
+    return np.divide(sums, counts, out=np.full(sums.shape, np.nan), where=counts > 0)
+
+
+def _rgba_image(heatmap: np.ndarray, low: float, high: float, alpha: float) -> np.ndarray:
+    # Bokeh draws row 0 of an image at the bottom, which matches the heatmap's latitude rows
+    rgba = render_rgba(heatmap, cmap='inferno', vmin=low, vmax=high, alpha=int(round(alpha * 255)), origin='upper')
+    return rgba.view(np.uint32).reshape(heatmap.shape)
+
+
+def add_heatmap(p, heatmap: np.ndarray, x: float, y: float, dw: float, dh: float, low: float, high: float,
+                mode: str = 'rgba', alpha: float = 0.6, overview_size: int = 256, tile_size: int = 256,
+                tile_directory: str = None, tile_url: str = 'tiles') -> list:
+    """
+    Adds the heatmap to a Bokeh plot in the given export mode.
+
+    Parameters:
+    - p (figure | GMap): The plot.
+    - heatmap (np.ndarray): The 'need_for_action' grid (rows follow y).
+    - x, y, dw, dh (float): Position and size of the heatmap in data coordinates.
+    - low, high (float): Value range mapped onto the Inferno palette.
+    - mode (str): One of EXPORT_MODES.
+    - alpha (float): Opacity of the heatmap.
+    - overview_size (int): 'lod' mode: maximum size of the embedded overview along one axis.
+    - tile_size (int): 'lod' mode: size of the full resolution tiles, in cells.
+    - tile_directory (str): 'lod' mode: directory the PNG tiles are written to.
+    - tile_url (str): 'lod' mode: URL of tile_directory, relative to the HTML file.
+
+    Returns:
+    - list: The renderers that were added.
+    """
+    assert mode in EXPORT_MODES, f"mode must be one of {EXPORT_MODES}, not {mode!r}"
+    if mode == 'float':
+        color_mapper = LinearColorMapper(palette="Inferno256", low=low, high=high)
+        return [p.image(image=[heatmap], x=x, y=y, dw=dw, dh=dh, color_mapper=color_mapper, level="image", alpha=alpha)]
+
+    if mode == 'quantized':
+        codes, scale, offset = quantize(heatmap, low, high)
+        # The mapper works on codes, so the palette spans exactly the codes of [low, high]
+        color_mapper = LinearColorMapper(palette="Inferno256", low=0, high=NAN_CODE - 1, high_color=(0, 0, 0, 0))
+        renderer = p.image(image=[codes], x=x, y=y, dw=dw, dh=dh, color_mapper=color_mapper, level="image", alpha=alpha)
+        renderer.tags = [{'scale': scale, 'offset': offset}]
+        return [renderer]
+
+    if mode == 'rgba':
+        return [p.image_rgba(image=[_rgba_image(heatmap, low, high, alpha)], x=x, y=y, dw=dw, dh=dh, level="image")]
+
+    # Level of detail: a small overview embedded in the document, full resolution tiles on zoom
+    factor = max(1, -(-max(heatmap.shape) // overview_size))
+    overview = p.image_rgba(image=[_rgba_image(downsample(heatmap, factor), low, high, alpha)],
+                            x=x, y=y, dw=dw, dh=dh, level="image")
+    if factor == 1:
+        return [overview]
+
+    assert tile_directory is not None, "The 'lod' mode needs a tile_directory for the full resolution tiles."
+    os.makedirs(tile_directory, exist_ok=True)
+    full_image = render_rgba(heatmap, cmap='inferno', vmin=low, vmax=high, alpha=int(round(alpha * 255)), origin='upper')
+    rows, cols = heatmap.shape
+    tiles = {'url': [], 'x': [], 'y': [], 'w': [], 'h': []}
+    for tile_row, bottom in enumerate(range(0, rows, tile_size)):
+        for tile_col, left in enumerate(range(0, cols, tile_size)):
+            # Tile rows count from the south, and each PNG is flipped to have its north edge on top
+            name = f"{tile_row}_{tile_col}.png"
+            write_png(os.path.join(tile_directory, name), full_image[bottom:bottom + tile_size, left:left + tile_size][::-1])
+            tiles['url'].append(f"{tile_url}/{name}")
+            tiles['x'].append(x + left / cols * dw)
+            tiles['y'].append(y + bottom / rows * dh)
+            tiles['w'].append(min(tile_size, cols - left) / cols * dw)
+            tiles['h'].append(min(tile_size, rows - bottom) / rows * dh)
+
+    tile_source = ColumnDataSource(data={key: [] for key in tiles})
+    tile_renderer = p.image_url(url='url', x='x', y='y', w='w', h='h', anchor='bottom_left', source=tile_source, level="image")
+    swap_tiles = CustomJS(args=dict(tiles=tiles, source=tile_source, x_range=p.x_range, y_range=p.y_range,
+                                    overview=overview, extent=[dw, dh]), code="""
+        // Once zoomed in, the overview gets too coarse: show the full resolution tiles in view instead
+        const zoomed = (x_range.end - x_range.start) * 1.5 < extent[0]
+                    || (y_range.end - y_range.start) * 1.5 < extent[1];
+        const data = {url: [], x: [], y: [], w: [], h: []};
+        if (zoomed) {
+            for (let i = 0; i < tiles.url.length; i++) {
+                if (tiles.x[i] + tiles.w[i] >= x_range.start && tiles.x[i] <= x_range.end &&
+                    tiles.y[i] + tiles.h[i] >= y_range.start && tiles.y[i] <= y_range.end) {
+                    for (const key in data) { data[key].push(tiles[key][i]); }
+                }
+            }
+        }
+        source.data = data;
+        overview.visible = !zoomed;
+    """)
+    for plot_range in (p.x_range, p.y_range):
+        plot_range.js_on_change('start', swap_tiles)
+        plot_range.js_on_change('end', swap_tiles)
+    return [overview, tile_renderer]
+
+
+def patch_image_source(source, patch: dict, column: str = 'image') -> None:
+    """
+    Sends the changed blocks of a heatmap_diff patch to the image of a 'float' mode renderer
+    (renderer.data_source), instead of replacing the whole image. In a Bokeh server document
+    only the blocks travel to the browser.
+    """
+    assert patch['base_version'] is not None or source.data[column][0].shape == tuple(patch['shape']), \
+        "A full patch of another shape needs a new image, not a patch"
+    block_size = patch['block_size']
+    source.patch({column: [((0, slice(block_row * block_size, (block_row + 1) * block_size),
+                             slice(block_column * block_size, (block_column + 1) * block_size)), block.ravel())
+                            for (block_row, block_column), block in zip(patch['blocks'], patch['values'])]})
+
+
+def add_recommendation_layer(p, codes: np.ndarray, texts: tuple[str, ...], x: float, y: float, dw: float, dh: float) -> list:
+    """
+    Adds the per-cell recommendations to a Bokeh plot: an invisible image of the uint8 codes, and a
+    hover tool showing the recommendation of the cell under the cursor. Only the codes and the few
+    distinct texts are embedded, instead of a text per cell.
+
+    Parameters:
+    - p (figure | GMap): The plot.
+    - codes (np.ndarray): Recommendation codes per cell (rows follow y), see recommendation_raster.
+    - texts (tuple[str, ...]): The texts the codes index, see recommendation_table.
+    - x, y, dw, dh (float): Position and size of the grid in data coordinates.
+
+    Returns:
+    - list: The renderers that were added.
+    """
+    color_mapper = LinearColorMapper(palette=['#00000000'], low=0, high=len(texts))
+    renderer = p.image(image=[codes], x=x, y=y, dw=dw, dh=dh, color_mapper=color_mapper, level="image", alpha=0)
+    formatter = CustomJSHover(args=dict(texts=[text.replace('<br>', '') for text in texts]), code="return texts[value]")
+    p.add_tools(HoverTool(tooltips=[("Recommendation", "@image{custom}")], formatters={'@image': formatter},
+                          renderers=[renderer]))
+    return [renderer]
+
+
+def add_explanation_layer(p, rasters: dict[str, np.ndarray], x: float, y: float, dw: float, dh: float) -> list:
+    """
+    Adds the per-cell explanation to a Bokeh plot: an invisible image holding the uint8 rasters of
+    compute_heatmap(explain=True) as one (rows, cols, n_rasters) array, and a hover tool showing the
+    firing strength of every rule and the clip level of every consequent term of the cell under the
+    cursor, like explain_cell.
+
+    Parameters:
+    - p (figure | GMap): The plot.
+    - rasters (dict[str, np.ndarray]): The explanation rasters by name (rows follow y).
+    - x, y, dw, dh (float): Position and size of the grid in data coordinates.
+
+    Returns:
+    - list: The renderers that were added.
+    """
+    names = list(rasters)
+    # The hover reads a 3-D column per cell: the slice of all rasters at the hovered image index
+    source = ColumnDataSource(data=dict(image=[rasters[names[0]]],
+                                        explanation=[np.stack([rasters[name] for name in names], axis=-1)]))
+    color_mapper = LinearColorMapper(palette=['#00000000'], low=0, high=STRENGTH_LEVELS)
+    renderer = p.image(image='image', source=source, x=x, y=y, dw=dw, dh=dh, color_mapper=color_mapper,
+                       level="image", alpha=0)
+    formatter = CustomJSHover(args=dict(names=names, levels=STRENGTH_LEVELS), code="""
+        return Array.from(value, (code, index) => `${names[index]} ${(code / levels).toFixed(2)}`).join(', ')
+    """)
+    p.add_tools(HoverTool(tooltips=[("Why", "@explanation{custom}")], formatters={'@explanation': formatter},
+                          renderers=[renderer]))
+    return [renderer]
+
+
+def compare_export_modes(heatmap: np.ndarray, directory: str, low: float = None, high: float = None) -> list[dict]:
+    """
+    Writes one standalone HTML file per export mode and reports its size and load cost.
+
+    The load cost is approximated by the time needed to parse the document's JSON payload,
+    which is what dominates page load for large heatmaps.
+
+    Parameters:
+    - heatmap (np.ndarray): The 'need_for_action' grid.
+    - directory (str): Output directory for the HTML files (and the 'lod' tiles).
+    - low, high (float): Value range mapped onto the palette (default: 5th and 95th percentile).
+
+    Returns:
+    - list[dict]: Per mode the 'mode', 'path', 'html_bytes' and 'parse_seconds'.
+    """
+    os.makedirs(directory, exist_ok=True)
+    low = float(np.nanpercentile(heatmap, 5)) if low is None else low
+    high = float(np.nanpercentile(heatmap, 95)) if high is None else high
+    rows, cols = heatmap.shape
+
+    report = []
+    for mode in EXPORT_MODES:
+        p = figure(title=f"Need for Green Areas ({mode})", x_range=(0, cols), y_range=(0, rows),
+                   tools="pan,wheel_zoom,reset,save", width=800, height=600)
+        add_heatmap(p, heatmap, 0, 0, cols, rows, low, high, mode=mode,
+                    tile_directory=os.path.join(directory, f"tiles_{mode}"), tile_url=f"tiles_{mode}")
+        html = file_html(p, CDN, f"need_for_action ({mode})")
+        path = os.path.join(directory, f"need_for_action_{mode}.html")
+        with open(path, 'w') as file:
+            file.write(html)
+
+        # The document JSON is embedded in the only application/json script tag
+        payload = html[html.index('type="application/json"'):]
+        payload = payload[payload.index('>') + 1:payload.index('</script>')]
+        start = time.perf_counter()
+        json.loads(payload)
+        parse_seconds = time.perf_counter() - start
+
+        report.append({'mode': mode, 'path': path, 'html_bytes': len(html.encode()), 'parse_seconds': parse_seconds})
+        logging.info(f"{mode:>9}: {len(html.encode()) / 1024:10.1f} KiB, JSON parsed in {parse_seconds * 1000:.1f} ms")
+    return report
@@ -0,0 +1,183 @@
+import logging
+import os
+import numpy as np
+import skfuzzy as fuzz
+from concurrent.futures import ProcessPoolExecutor
+from heatmap_utils_api import batch_inference, FUZZY_TERMS, UNIVERSES
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_PARAMETERS = {(variable, term): spec for variable, terms in FUZZY_TERMS.items() for term, spec in terms.items()}
+"""The hand-tuned membership function parameters of heatmap_utils_api (FUZZY_TERMS), keyed by (variable, term)."""
+
+MF_FUNCTIONS = {'gaussmf': fuzz.gaussmf, 'zmf': fuzz.zmf, 'smf': fuzz.smf}
+MIN_SIGMA = 0.1
+"""Smallest allowed gaussmf sigma, to keep candidate membership functions non-degenerate."""
+
+# Cases and parameter template of the current worker process, set once by _init_worker
+# instead of being shipped with every candidate
+_worker_cases, _worker_template = None, None
+
+
+def load_cases(path: str) -> dict[str, np.ndarray]:
+    """
+    Loads labelled calibration cases from a CSV file with a header row containing the columns
+    air_pollution, population_density, veg_cover and need_for_action.
+
+    Parameters:
+    - path (str): Path to the CSV file.
+
+    Returns:
+    - dict[str, np.ndarray]: One array per column.
+    """
+    table = np.genfromtxt(path, delimiter=',', names=True, dtype=float)
+    return {name: np.atleast_1d(table[name]) for name in ('air_pollution', 'population_density', 'veg_cover', 'need_for_action')}
+
+
+def flatten_parameters(parameters: dict) -> np.ndarray:
+    """
+    Flattens a parameter table like DEFAULT_PARAMETERS into a vector, in table order.
+    """
+    return np.array([value for _, params in parameters.values() for value in params.values()], dtype=float)
+
+
+def unflatten_parameters(vector: np.ndarray, template: dict = DEFAULT_PARAMETERS) -> dict:
+    """
+    Inverse of flatten_parameters, repairing invalid values: sigmas are kept above MIN_SIGMA
+    and the (a, b) pairs of zmf/smf are put in increasing order.
+    """
+    parameters = {}
+    position = 0
+    for key, (kind, params) in template.items():
+        values = [float(value) for value in vector[position:position + len(params)]]
+        position += len(params)
+        if kind == 'gaussmf':
+            values[1] = max(abs(values[1]), MIN_SIGMA)
+        else:
+            values = sorted(values)
+            values[1] = max(values[1], values[0] + 1e-3)
+        parameters[key] = (kind, dict(zip(params.keys(), values)))
+    return parameters
+
+
+def membership_functions(parameters: dict) -> dict[tuple[str, str], np.ndarray]:
+    """
+    Evaluates a parameter table into membership function arrays on the variables' universes,
+    in the form accepted by batch_inference.
+    """
+    return {(variable, term): MF_FUNCTIONS[kind](UNIVERSES[variable], **params)
+            for (variable, term), (kind, params) in parameters.items()}
+
+
+def error_metrics(predicted: np.ndarray, expected: np.ndarray) -> dict[str, float]:
+    """
+    Mean absolute, root mean squared and maximum absolute error.
+    """
+    error = predicted - expected
+    return {
+        'mae': float(np.mean(np.abs(error))),
+        'rmse': float(np.sqrt(np.mean(error ** 2))),
+        'max_error': float(np.max(np.abs(error))),
+        'n_cases': int(len(error))
+    }
+
+
+def evaluate_parameters(parameters: dict, cases: dict[str, np.ndarray]) -> dict[str, float]:
+    """
+    Runs all cases through the batched inference engine with the given parameters.
+
+    Parameters:
+    - parameters (dict): Parameter table like DEFAULT_PARAMETERS.
+    - cases (dict[str, np.ndarray]): Labelled cases, as returned by load_cases.
+
+    Returns:
+    - dict[str, float]: The error metrics of the parameters on the cases.
+    """
+    predicted = batch_inference({label: cases[label] for label in ('air_pollution', 'population_density', 'veg_cover')},
+                                membership_functions=membership_functions(parameters))
+    return error_metrics(predicted, cases['need_for_action'])
+
+
+def _init_worker(cases: dict[str, np.ndarray], template: dict) -> None:
+    global _worker_cases, _worker_template
+    _worker_cases, _worker_template = cases, template
+
+
+def _candidate_rmse(vector: np.ndarray) -> float:
+    return evaluate_parameters(unflatten_parameters(vector, _worker_template), _worker_cases)['rmse']
+
+
+def calibrate(cases: dict[str, np.ndarray], parameters: dict = DEFAULT_PARAMETERS, population: int = 64,
+              max_rounds: int = 100, patience: int = 4, initial_step: float = 0.05, min_step: float = 1e-3,
+              seed: int = None, max_workers: int = None) -> dict:
+    """
+    Searches the membership function parameters that best reproduce the labelled cases.
+
+    Each round draws a population of candidates around the best parameters found so far,
+    scaled by the current step size (a fraction of each variable's universe). The candidates
+    are evaluated in parallel over a process pool, every one of them on all cases at once.
+    When a round brings no improvement the search is in a non-improving region, so the step is
+    halved; the search stops after `patience` such rounds in a row or when the step gets too small.
+
+    Parameters:
+    - cases (dict[str, np.ndarray]): Labelled cases, as returned by load_cases.
+    - parameters (dict): Starting parameter table (default: the hand-tuned parameters).
+    - population (int): Number of candidates per round.
+    - max_rounds (int): Maximum number of rounds.
+    - patience (int): Number of non-improving rounds in a row before stopping.
+    - initial_step (float): Initial step size, relative to the universe span.
+    - min_step (float): The search stops once the step gets below this value.
+    - seed (int): Seed for reproducible searches.
+    - max_workers (int): Size of the process pool (default: number of CPUs).
+
+    Returns:
+    - dict: 'parameters' (best table), 'metrics' (its error metrics), 'initial_metrics',
+      'rounds' and 'evaluations'.
+    """
+    rng = np.random.default_rng(seed)
+    max_workers = max_workers or os.cpu_count() or 1
+    best = flatten_parameters(parameters)
+    spans = np.array([np.ptp(UNIVERSES[variable]) for (variable, _), (_, params) in parameters.items() for _ in params])
+
+    initial_metrics = evaluate_parameters(unflatten_parameters(best, parameters), cases)
+    best_rmse = initial_metrics['rmse']
+    step, stale_rounds, evaluations, rounds = initial_step, 0, 1, 0
+    logging.info(f"Starting calibration on {len(cases['need_for_action'])} cases, initial RMSE = {best_rmse:.4f}")
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(cases, parameters)) as executor:
+        while rounds < max_rounds and stale_rounds < patience and step >= min_step:
+            rounds += 1
+            candidates = best + rng.normal(size=(population, len(best))) * step * spans
+            rmse = np.array(list(executor.map(_candidate_rmse, candidates,
+                                              chunksize=max(1, population // (4 * max_workers)))))
+            evaluations += population
+
+            if rmse.min() < best_rmse:
+                best, best_rmse = candidates[rmse.argmin()], rmse.min()
+                stale_rounds = 0
+            else:
+                stale_rounds += 1
+                step /= 2
+            logging.info(f"Round {rounds}: best RMSE = {best_rmse:.4f}, step = {step:.4f}")
+
+    best_parameters = unflatten_parameters(best, parameters)
+    return {
+        'parameters': best_parameters,
+        'metrics': evaluate_parameters(best_parameters, cases),
+        'initial_metrics': initial_metrics,
+        'rounds': rounds,
+        'evaluations': evaluations
+    }
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Usage: python calibration.py cases.csv
+    result = calibrate(load_cases(sys.argv[1]), seed=0)
+    print(f"Initial: {result['initial_metrics']}")
+    print(f"Calibrated after {result['rounds']} rounds ({result['evaluations']} evaluations): {result['metrics']}")
+    for (variable, term), (kind, params) in result['parameters'].items():
+        formatted = ", ".join(f"{name}={value:.2f}" for name, value in params.items())
+        print(f"{variable}['{term}'] = fuzz.{kind}({variable}.universe, {formatted})")
@@ -0,0 +1,219 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_CHECKPOINT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.heatmap_checkpoints')
+ROWS_PER_BAND = 16
+"""Number of heatmap rows persisted together. A crash loses at most the bands in progress."""
+MANIFEST = 'manifest.json'
+
+
+def _write_atomic(path: str, write) -> None:
+    # Writes through a temporary file in the same directory, so readers never see a partial file
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'wb') as file:
+            write(file)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+class CheckpointedJob:
+    def __init__(self, key: str, shape: tuple[int, int], rows_per_band: int = ROWS_PER_BAND,
+                 directory: str = DEFAULT_CHECKPOINT_DIR) -> None:
+        """
+        On-disk progress of a heatmap computed in bands of rows.
+
+        Every finished band is written to its own .npy file, after which the manifest listing the
+        finished bands is replaced. Both writes are atomic, so after a crash the manifest only lists
+        bands that are complete on disk. A job with the same key, shape and band height picks up
+        where the previous one stopped; a job whose manifest does not match starts over.
+
+        Parameters:
+        - key (str): Identifies the inputs, e.g. HeatmapCache.make_key of the station snapshot,
+          grid specification and fuzzy configuration.
+        - shape (tuple[int, int]): Shape of the heatmap.
+        - rows_per_band (int): Number of rows per band.
+        - directory (str): Directory holding the checkpoints of all jobs.
+        """
+        assert rows_per_band > 0, "rows_per_band must be positive"
+        self.key = key
+        self.shape = tuple(int(n) for n in shape)
+        self.rows_per_band = rows_per_band
+        self.path = os.path.join(directory, key)
+        self.bands = [(start, min(start + rows_per_band, self.shape[0])) for start in range(0, self.shape[0], rows_per_band)]
+        self.completed = set()
+        self._lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+        self._resume()
+        self.resumed = len(self.completed)
+
+    def __str__(self) -> str:
+        return f"CheckpointedJob {self.key[:12]}: {len(self.completed)}/{len(self.bands)} bands done"
+
+    def _band_path(self, band_id: int) -> str:
+        return os.path.join(self.path, f"band_{band_id:06d}.npy")
+
+    def _resume(self) -> None:
+        try:
+            with open(os.path.join(self.path, MANIFEST)) as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            return
+        if (manifest.get('key'), tuple(manifest.get('shape', ())), manifest.get('rows_per_band')) != (self.key, self.shape, self.rows_per_band):
+            logging.warning(f"Checkpoint of job {self.key[:12]} does not match its grid specification, starting over")
+            return
+        for band_id in manifest.get('completed', []):
+            start, stop = self.bands[band_id]
+            try:
+                band = np.load(self._band_path(band_id), mmap_mode='r')
+            except (OSError, ValueError) as e:
+                logging.warning(f"Recomputing unreadable band {band_id} of job {self.key[:12]}: {e}")
+                continue
+            if band.shape == (stop - start, self.shape[1]):
+                self.completed.add(band_id)
+
+    def pending(self) -> list[int]:
+        """
+        Ids of the bands still to compute, in row order.
+        """
+        return [band_id for band_id in range(len(self.bands)) if band_id not in self.completed]
+
+    def save_band(self, band_id: int, values: np.ndarray) -> None:
+        """
+        Persists a finished band and records it in the manifest. Safe to call from several threads.
+        """
+        start, stop = self.bands[band_id]
+        values = np.asarray(values)
+        assert values.shape == (stop - start, self.shape[1]), f"Band {band_id} has shape {values.shape}"
+        _write_atomic(self._band_path(band_id), lambda file: np.save(file, values))
+        with self._lock:
+            self.completed.add(band_id)
+            manifest = {'key': self.key, 'shape': self.shape, 'rows_per_band': self.rows_per_band,
+                        'completed': sorted(self.completed), 'updated': time.time()}
+            _write_atomic(os.path.join(self.path, MANIFEST), lambda file: file.write(json.dumps(manifest).encode()))
+
+    def load(self) -> np.ndarray:
+        """
+        Assembles the heatmap from the bands on disk. All bands must be done.
+        """
+        assert not self.pending(), f"{len(self.pending())} bands of job {self.key[:12]} are not done"
+        result = None
+        for band_id, (start, stop) in enumerate(self.bands):
+            band = np.load(self._band_path(band_id))
+            if result is None:
+                result = np.empty(self.shape, dtype=band.dtype)
+            result[start:stop] = band
+        return result
+
+    def remove(self) -> None:
+        """
+        Deletes the checkpoint of this job.
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def log_progress(progress: dict) -> None:
+    """
+    Default progress callback: one JSON object per line, for log collectors and humans alike.
+    """
+    logging.info(f"progress {json.dumps(progress)}")
+
+
+def run_checkpointed(key: str, shape: tuple[int, int], compute_band, rows_per_band: int = ROWS_PER_BAND,
+                     directory: str = DEFAULT_CHECKPOINT_DIR, max_workers: int = 1, progress_callback=log_progress,
+                     progress_interval: float = 5.0, keep: bool = False) -> np.ndarray:
+    """
+    Computes a heatmap band by band, persisting every band, and skips the bands a previous run of
+    the same job already finished.
+
+    Parameters:
+    - key (str): Identifies the inputs of the job (see CheckpointedJob).
+    - shape (tuple[int, int]): Shape of the heatmap.
+    - compute_band (callable): compute_band(start, stop) returns rows start to stop of the heatmap.
+    - rows_per_band (int): Number of rows per band.
+    - directory (str): Directory holding the checkpoints.
+    - max_workers (int): Number of threads computing bands.
+    - progress_callback (callable): Called with a progress dict (bands and rows done and total,
+      bands resumed from a previous run, elapsed seconds, rows per second and ETA) at most every
+      progress_interval seconds, and once at the end. None disables progress reports.
+    - progress_interval (float): Minimum number of seconds between two progress reports.
+    - keep (bool): Keep the checkpoint after the job completed, instead of deleting it.
+
+    Returns:
+    - np.ndarray: The heatmap.
+    """
+    job = CheckpointedJob(key, shape, rows_per_band, directory)
+    pending = job.pending()
+    if job.resumed:
+        logging.info(f"Resuming job {key[:12]}: {job.resumed}/{len(job.bands)} bands already done")
+
+    start_time, last_report = time.perf_counter(), 0.0
+    rows_total = job.shape[0]
+    rows_resumed = sum(stop - start for band_id, (start, stop) in enumerate(job.bands) if band_id in job.completed)
+    rows_computed = 0
+
+    def report(force: bool = False) -> None:
+        nonlocal last_report
+        now = time.perf_counter()
+        if progress_callback is None or (not force and now - last_report < progress_interval):
+            return
+        last_report = now
+        elapsed = now - start_time
+        rows_per_second = rows_computed / elapsed if elapsed > 0 else 0.0
+        rows_left = rows_total - rows_resumed - rows_computed
+        progress_callback({
+            'job': key[:12],
+            'bands_done': len(job.completed),
+            'bands_total': len(job.bands),
+            'bands_resumed': job.resumed,
+            'rows_done': rows_resumed + rows_computed,
+            'rows_total': rows_total,
+            'elapsed_seconds': round(elapsed, 3),
+            'rows_per_second': round(rows_per_second, 3),
+            'eta_seconds': round(rows_left / rows_per_second, 1) if rows_per_second else None
+        })
+
+    def process(band_id: int) -> int:
+        start, stop = job.bands[band_id]
+        job.save_band(band_id, compute_band(start, stop))
+        return stop - start
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for future in as_completed([executor.submit(process, band_id) for band_id in pending]):
+            rows_computed += future.result()  # Propagates exceptions; finished bands stay on disk
+            report()
+    report(force=True)
+
+    result = job.load()
+    if not keep:
+        job.remove()
+    return result
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Usage: python checkpoint.py [fail_after_band] -- run twice to see the second run resume
+    fail_after = int(sys.argv[1]) if len(sys.argv) > 1 else None
+
+    def compute_band(start: int, stop: int) -> np.ndarray:
+        if fail_after is not None and start // ROWS_PER_BAND > fail_after:
+            raise RuntimeError(f"Simulated crash at row {start}")
+        time.sleep(0.05)
+        return np.add.outer(np.arange(start, stop), np.arange(256)).astype(float)
+
+    heatmap = run_checkpointed('demo', (256, 256), compute_band, progress_interval=0.2)
+    assert np.array_equal(heatmap, np.add.outer(np.arange(256), np.arange(256)))
+    print("Heatmap complete")
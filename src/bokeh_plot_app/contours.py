@@ -0,0 +1,301 @@
+import json
+import logging
+import numpy as np
+from scipy import ndimage
+from mapApi import Map, EARTH_RADIUS
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SIMPLIFY_TOLERANCE = 0.5
+"""Douglas-Peucker tolerance in cells: outlines move at most half a cell."""
+MIN_AREA = 4.0
+"""Polygons and holes smaller than this many cells are dropped."""
+COORDINATE_DECIMALS = 6
+"""Decimals of the GeoJSON longitudes and latitudes (about 0.1 m)."""
+
+# Square corners a, b, c, d as (row, column) offsets, and its edges top, right, bottom, left as corner pairs
+_CORNER_OFFSETS = np.array([(0, 0), (0, 1), (1, 1), (1, 0)])
+_EDGE_CORNERS = ((0, 1), (1, 2), (2, 3), (3, 0))
+
+
+def _segment_table() -> list[list[tuple[int, int]]]:
+    # Per marching squares case (bit i set when corner i is inside), the (entry edge, exit edge) of every
+    # segment. Going round the square, each entry is paired with the next exit, which cuts off one run of
+    # inside corners: diagonal saddles stay separate, matching the 4-connectivity of ndimage.label
+    table = []
+    for case in range(16):
+        inside = [(case >> corner) & 1 for corner in range(4)]
+        entries = [edge for edge, (p, q) in enumerate(_EDGE_CORNERS) if not inside[p] and inside[q]]
+        exits = {edge for edge, (p, q) in enumerate(_EDGE_CORNERS) if inside[p] and not inside[q]}
+        table.append([(entry, next((entry + step) % 4 for step in range(1, 4) if (entry + step) % 4 in exits))
+                      for entry in entries])
+    return table
+
+
+_SEGMENTS = _segment_table()
+
+
+def crossover_levels(variable: str = 'need_for_action') -> dict[str, float]:
+    """
+    Values where adjacent membership functions of a fuzzy variable cross, i.e. where the most likely
+    label changes, keyed by the upper label: {'medium': ~30.7, 'high': ~69.3} for need_for_action.
+    """
+    from heatmap_utils_api import build_fuzzy_system
+
+    fuzzy_variable = build_fuzzy_system()[variable]
+    universe = fuzzy_variable.universe.astype(float)
+    terms = list(fuzzy_variable.terms.items())
+    levels = {}
+    for (_, lower), (label, upper) in zip(terms, terms[1:]):
+        difference = lower.mf - upper.mf
+        index = np.flatnonzero(np.sign(difference[:-1]) * np.sign(difference[1:]) <= 0)[0]
+        fraction = difference[index] / (difference[index] - difference[index + 1]) if difference[index] != difference[index + 1] else 0.0
+        levels[label] = float(universe[index] + fraction * (universe[index + 1] - universe[index]))
+    return levels
+
+
+def _simplify(points: np.ndarray, tolerance: float) -> np.ndarray:
+    # Douglas-Peucker of an open polyline, keeping both ends
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, stop = stack.pop()
+        if stop - start < 2:
+            continue
+        chord = points[stop] - points[start]
+        offsets = points[start + 1:stop] - points[start]
+        length = np.hypot(*chord)
+        distances = (np.abs(chord[0] * offsets[:, 1] - chord[1] * offsets[:, 0]) / length if length > 0
+                     else np.hypot(offsets[:, 0], offsets[:, 1]))
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            middle = start + 1 + index
+            keep[middle] = True
+            stack += [(start, middle), (middle, stop)]
+    return points[keep]
+
+
+def simplify_ring(ring: np.ndarray, tolerance: float = SIMPLIFY_TOLERANCE) -> np.ndarray:
+    """
+    Douglas-Peucker simplification of a closed ring (without repeated first point), split at the
+    point farthest from its first point.
+    """
+    if tolerance <= 0 or len(ring) < 4:
+        return ring
+    far = int(np.argmax(np.hypot(*(ring - ring[0]).T)))
+    closed = np.concatenate([ring, ring[:1]])
+    return np.concatenate([_simplify(closed[:far + 1], tolerance)[:-1], _simplify(closed[far:], tolerance)[:-1]])
+
+
+def _signed_area(ring: np.ndarray) -> float:
+    # Shoelace formula on (row, column) points
+    rows, columns = ring[:, 0], ring[:, 1]
+    return 0.5 * float(np.dot(columns, np.roll(rows, -1)) - np.dot(np.roll(columns, -1), rows))
+
+
+def marching_squares(grid: np.ndarray, level: float) -> tuple[list[np.ndarray], np.ndarray]:
+    """
+    Closed outlines of the region grid >= level, with the cell centres as samples. The grid is
+    padded with values below the level, so outlines close along the grid border.
+
+    Returns:
+    - tuple[list[np.ndarray], np.ndarray]: The rings as (m, 2) arrays of fractional (row, column)
+      cell coordinates, without repeated first point, and per ring the (row, column) of a cell inside it.
+    """
+    padded = np.pad(np.asarray(grid, dtype=float), 1, constant_values=min(level, np.nanmin(grid)) - 1)
+    height, width = padded.shape
+    inside = padded >= level
+    cases = (inside[:-1, :-1] * 1 + inside[:-1, 1:] * 2 + inside[1:, 1:] * 4 + inside[1:, :-1] * 8).astype(np.uint8)
+
+    squares = np.flatnonzero((cases != 0) & (cases != 15))
+    square_cases = cases.ravel()[squares]
+    square_rows, square_columns = np.divmod(squares, width - 1)
+
+    # Edge ids: horizontal edge (r, c)-(r, c + 1) is r * width + c, vertical edge (r, c)-(r + 1, c) adds height * width
+    def edge_ids(edge: int, rows: np.ndarray, columns: np.ndarray) -> np.ndarray:
+        if edge == 0:
+            return rows * width + columns
+        if edge == 1:
+            return height * width + rows * width + columns + 1
+        if edge == 2:
+            return (rows + 1) * width + columns
+        return height * width + rows * width + columns
+
+    starts, ends, segment_squares, segment_entries = [], [], [], []
+    for case in range(1, 15):
+        selected = np.flatnonzero(square_cases == case)
+        for entry, exit_edge in _SEGMENTS[case]:
+            starts.append(edge_ids(entry, square_rows[selected], square_columns[selected]))
+            ends.append(edge_ids(exit_edge, square_rows[selected], square_columns[selected]))
+            segment_squares.append(selected)
+            segment_entries.append(np.full(len(selected), entry))
+    if not starts:
+        return [], np.empty((0, 2), dtype=int)
+    starts, ends = np.concatenate(starts), np.concatenate(ends)
+    segment_squares, segment_entries = np.concatenate(segment_squares), np.concatenate(segment_entries)
+
+    # Every crossing ends one segment and starts the next, so following the segments is a permutation
+    order = np.argsort(starts)
+    following = order[np.searchsorted(starts[order], ends)]
+
+    # Crossing positions by linear interpolation along the edges
+    vertical, flat = np.divmod(starts, height * width)
+    rows, columns = np.divmod(flat, width)
+    first = padded[rows, columns]
+    second = np.where(vertical == 1, padded[np.minimum(rows + 1, height - 1), columns], padded[rows, np.minimum(columns + 1, width - 1)])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = (level - first) / (second - first)
+    fraction = np.where(np.isfinite(fraction), np.clip(fraction, 0, 1), 0.5)
+    positions = np.column_stack([rows + vertical * fraction, columns + (1 - vertical) * fraction]) - 1  # Unpadded cells
+    positions = np.clip(positions, -0.5, np.array(grid.shape) - 0.5)
+
+    rings, first_segments = [], []
+    visited = np.zeros(len(starts), dtype=bool)
+    for segment in range(len(starts)):
+        if visited[segment]:
+            continue
+        ring = []
+        while not visited[segment]:
+            visited[segment] = True
+            ring.append(segment)
+            segment = following[segment]
+        rings.append(positions[ring])
+        first_segments.append(ring[0])
+
+    # The second corner of a segment's entry edge is inside, and on that segment's side of a saddle
+    first_squares = segment_squares[first_segments]
+    corners = _CORNER_OFFSETS[np.array(_EDGE_CORNERS)[segment_entries[first_segments], 1]]
+    inside_cells = np.column_stack([square_rows[first_squares], square_columns[first_squares]]) + corners - 1
+    return rings, inside_cells
+
+
+def zone_polygons(heatmap: np.ndarray, levels: dict[str, float] = None, tolerance: float = SIMPLIFY_TOLERANCE,
+                  min_area: float = MIN_AREA) -> list[dict]:
+    """
+    Simplified outline polygons of the zones where the heatmap reaches each level. On a smooth
+    4000x4000 grid this takes about 1.5 s and yields ~60 KiB of GeoJSON instead of a 122 MiB raster.
+
+    Parameters:
+    - heatmap (np.ndarray): The 'need_for_action' grid (rows follow latitude).
+    - levels (dict[str, float]): Zone name -> level (default: crossover_levels(), i.e. the zones
+      that are at least 'medium' and 'high').
+    - tolerance (float): Simplification tolerance in cells.
+    - min_area (float): Polygons and holes below this many cells are dropped.
+
+    Returns:
+    - list[dict]: Per polygon the 'zone', 'level', 'rings' (outer ring then holes, (m, 2) arrays
+      of (row, column) cell coordinates), 'area_cells' (outer minus holes, before simplification),
+      'n_cells', 'mean_score' and 'max_score' of the cells in the polygon.
+    """
+    levels = crossover_levels() if levels is None else levels
+    polygons = []
+    for zone, level in levels.items():
+        rings, inside_cells = marching_squares(heatmap, level)
+        if not rings:
+            continue
+        components, n_components = ndimage.label(heatmap >= level)
+        ring_components = components[inside_cells[:, 0], inside_cells[:, 1]]
+        areas = -np.array([_signed_area(ring) for ring in rings])  # Positive for outer rings, negative for holes
+        # The outer ring of a component encloses its holes, so it is the component's ring of largest area.
+        # The sign alone does not tell: cells exactly at the level collapse rings to zero area
+        by_area = np.lexsort((-areas, ring_components))
+        outer = np.zeros(len(rings), dtype=bool)
+        outer[by_area[np.unique(ring_components[by_area], return_index=True)[1]]] = True
+        if outer.sum() != n_components:
+            raise RuntimeError(f"{outer.sum()} outer rings for {n_components} components at level {level}")
+
+        bounding_boxes = ndimage.find_objects(components, n_components)
+        holes = {}
+        for ring_index in np.flatnonzero(~outer & (np.abs(areas) >= min_area)):
+            holes.setdefault(ring_components[ring_index], []).append(ring_index)
+
+        for ring_index in np.flatnonzero(outer & (areas >= min_area)):
+            component = ring_components[ring_index]
+            hole_indices = holes.get(component, [])
+            # Statistics over the bounding box only: ndimage.mean and maximum scan and sort the whole grid
+            box = bounding_boxes[component - 1]
+            scores = heatmap[box][components[box] == component]
+            polygons.append({
+                'zone': zone,
+                'level': level,
+                'rings': [simplify_ring(rings[index], tolerance) for index in [ring_index, *hole_indices]],
+                'area_cells': float(areas[ring_index] + areas[hole_indices].sum()),
+                'n_cells': len(scores),
+                'mean_score': float(scores.mean()),
+                'max_score': float(scores.max())
+            })
+    return polygons
+
+
+def to_geojson(polygons: list[dict], map_obj: Map) -> dict:
+    """
+    GeoJSON FeatureCollection of zone polygons in real coordinates, using the map's grid bounds.
+    Areas are converted to square metres, and rings follow the right-hand rule of RFC 7946.
+    """
+    size = map_obj.size
+    lat_step = (map_obj.max_lat - map_obj.min_lat) / size
+    lon_step = (map_obj.max_lon - map_obj.min_lon) / size
+    mean_latitude = np.radians((map_obj.min_lat + map_obj.max_lat) / 2)
+    cell_area = (EARTH_RADIUS * np.radians(lat_step)) * (EARTH_RADIUS * np.cos(mean_latitude) * np.radians(lon_step))
+
+    features = []
+    for polygon in polygons:
+        rings = []
+        for index, ring in enumerate(polygon['rings']):
+            # Cell (row, column) -> (longitude, latitude); cell centres sit at (index + 0.5) / size
+            coordinates = np.column_stack([map_obj.min_lon + (ring[:, 1] + 0.5) * lon_step,
+                                           map_obj.min_lat + (ring[:, 0] + 0.5) * lat_step])
+            counter_clockwise = _signed_area(coordinates[:, ::-1]) > 0
+            if counter_clockwise != (index == 0):  # Exterior counterclockwise, holes clockwise
+                coordinates = coordinates[::-1]
+            coordinates = np.round(np.concatenate([coordinates, coordinates[:1]]), COORDINATE_DECIMALS)
+            rings.append(coordinates.tolist())
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'Polygon', 'coordinates': rings},
+            'properties': {'zone': polygon['zone'], 'level': round(polygon['level'], 3),
+                           'area_m2': round(polygon['area_cells'] * cell_area, 1), 'n_cells': polygon['n_cells'],
+                           'mean_score': round(polygon['mean_score'], 3), 'max_score': round(polygon['max_score'], 3)}
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def export_geojson(heatmap: np.ndarray, map_obj: Map, path: str, levels: dict[str, float] = None,
+                   tolerance: float = SIMPLIFY_TOLERANCE, min_area: float = MIN_AREA) -> dict:
+    """
+    Writes the zone polygons of a heatmap to a GeoJSON file (see zone_polygons and to_geojson).
+
+    Returns:
+    - dict: The FeatureCollection.
+    """
+    collection = to_geojson(zone_polygons(heatmap, levels, tolerance, min_area), map_obj)
+    with open(path, 'w') as file:
+        json.dump(collection, file, separators=(',', ':'))
+    return collection
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    import time
+    from mapApi import Station
+    from heatmap_utils_api import compute_heatmap
+
+    # Usage: python contours.py [grid_size] [n_stations]
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    n_stations = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    rng = np.random.default_rng(0)
+    stations = [Station.from_values(51.4 + 0.2 * rng.random(), -0.2 + 0.3 * rng.random(), rng.integers(0, 71),
+                                    rng.integers(0, 151), rng.integers(0, 101)) for _ in range(n_stations)]
+    map_obj = Map(np.array(stations), size=size)
+    heatmap = compute_heatmap(map_obj)
+
+    start = time.perf_counter()
+    collection = export_geojson(heatmap, map_obj, 'need_for_action_zones.geojson')
+    seconds = time.perf_counter() - start
+    geojson_bytes = os.path.getsize('need_for_action_zones.geojson')
+    print(f"{len(collection['features'])} polygons at levels {crossover_levels()} in {seconds:.2f} s: "
+          f"{geojson_bytes / 1024:.1f} KiB, the float64 raster is {heatmap.nbytes / 1024:.0f} KiB "
+          f"({heatmap.nbytes / geojson_bytes:.0f}x)")
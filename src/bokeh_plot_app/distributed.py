@@ -0,0 +1,261 @@
+import logging
+import os
+import socket
+import threading
+import time
+import numpy as np
+from multiprocessing.managers import BaseManager
+from mapApi import Map, Station, POLLUTANTS
+from heatmap_utils_api import batch_inference, build_fuzzy_system, build_pollutant_system, get_grid_locations
+from heatmap_cache import fuzzy_config_fingerprint
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+TILE_SIZE = 256
+"""Tiles are TILE_SIZE x TILE_SIZE cells, except at the right and bottom edges."""
+LEASE_TIMEOUT = 30.0
+"""A tile goes back to the queue when its worker has not sent a heartbeat for this many seconds."""
+POLL_INTERVAL = 0.2
+"""Seconds a worker waits before asking again when all remaining tiles are leased to others."""
+
+
+class TileQueue:
+    def __init__(self, snapshot: dict, shape: tuple[int, int], tile_size: int, output_path: str,
+                 lease_timeout: float = LEASE_TIMEOUT) -> None:
+        """
+        Work queue of heatmap tiles, served to the workers by the coordinator's manager.
+        All methods are called from the manager's server threads, hence the lock.
+
+        Parameters:
+        - snapshot (dict): What every worker needs once: the station coordinates and data, the grid size,
+          the interpolation backend and the fuzzy configuration (membership functions and fingerprint).
+          The lease timeout is added, so that workers send their heartbeats often enough.
+        - shape (tuple[int, int]): Shape of the heatmap.
+        - tile_size (int): Size of a tile along both axes.
+        - output_path (str): .npy file the tiles are written to, as a memory map.
+        - lease_timeout (float): Seconds without heartbeat after which a worker is considered dead.
+        """
+        self.snapshot = {**snapshot, 'lease_timeout': lease_timeout}
+        self.lease_timeout = lease_timeout
+        self.tiles = [(row, column, min(row + tile_size, shape[0]), min(column + tile_size, shape[1]))
+                      for row in range(0, shape[0], tile_size) for column in range(0, shape[1], tile_size)]
+        self.pending = list(range(len(self.tiles)))[::-1]  # Popped from the end, so in tile order
+        self.leases = {}  # tile id -> worker id
+        self.done = set()
+        self.heartbeats = {}  # worker id -> time of the last contact
+        self.requeued = 0
+        self.output = np.lib.format.open_memmap(output_path, mode='w+', dtype=np.float64, shape=shape)
+        self._lock = threading.Lock()
+
+    def register(self, worker_id: str) -> dict:
+        with self._lock:
+            self.heartbeats[worker_id] = time.monotonic()
+        logging.info(f"Worker {worker_id} registered")
+        return self.snapshot
+
+    def heartbeat(self, worker_id: str) -> None:
+        with self._lock:
+            self.heartbeats[worker_id] = time.monotonic()
+
+    def get_tile(self, worker_id: str) -> tuple | str:
+        """
+        Leases the next tile to a worker.
+
+        Returns:
+        - tuple | str: (tile id, row start, column start, row stop, column stop), or 'wait' when all
+          remaining tiles are leased to other workers, or 'done' when the heatmap is complete.
+        """
+        with self._lock:
+            self.heartbeats[worker_id] = time.monotonic()
+            self._requeue_expired()
+            if not self.pending:
+                return 'done' if len(self.done) == len(self.tiles) else 'wait'
+            tile_id = self.pending.pop()
+            self.leases[tile_id] = worker_id
+            return (tile_id, *self.tiles[tile_id])
+
+    def submit(self, worker_id: str, tile_id: int, values: np.ndarray) -> None:
+        with self._lock:
+            self.heartbeats[worker_id] = time.monotonic()
+            if tile_id in self.done:
+                return  # A re-queued tile finished twice; both results are identical
+            row, column, row_stop, column_stop = self.tiles[tile_id]
+            self.output[row:row_stop, column:column_stop] = values
+            self.done.add(tile_id)
+            self.leases.pop(tile_id, None)
+            if tile_id in self.pending:
+                self.pending.remove(tile_id)
+
+    def _requeue_expired(self) -> None:
+        now = time.monotonic()
+        for tile_id, worker_id in list(self.leases.items()):
+            if now - self.heartbeats.get(worker_id, 0) > self.lease_timeout:
+                del self.leases[tile_id]
+                self.pending.append(tile_id)
+                self.requeued += 1
+                logging.warning(f"Worker {worker_id} went silent, re-queued tile {tile_id}")
+
+    def progress(self) -> dict:
+        with self._lock:
+            self._requeue_expired()
+            return {'tiles': len(self.tiles), 'done': len(self.done), 'leased': len(self.leases),
+                    'pending': len(self.pending), 'requeued': self.requeued, 'workers': len(self.heartbeats)}
+
+
+class TileManager(BaseManager):
+    pass
+
+
+def make_snapshot(map_obj: Map, pollutants: bool = False) -> dict:
+    """
+    Everything a worker needs to compute tiles of the map's heatmap, in picklable form.
+    The membership functions are shipped as arrays, so workers use the coordinator's fuzzy
+    configuration even if theirs was calibrated differently. With pollutants, workers evaluate
+    the system of build_pollutant_system on the stations' PM10, NO2 and O3 as well.
+    """
+    control_system = (build_pollutant_system() if pollutants else build_fuzzy_system())['ctrl_sys']
+    variables = list(control_system.antecedents) + list(control_system.consequents)
+    return {
+        'coordinates': map_obj.coordinates,
+        'data': map_obj.data,
+        'pollutants': map_obj.pollutants,
+        'use_pollutants': pollutants,
+        'size': map_obj.size,
+        'interpolation': (map_obj.interpolation, map_obj.interpolation_params),
+        'membership_functions': {(variable.label, label): np.asarray(term.mf)
+                                 for variable in variables for label, term in variable.terms.items()},
+        'fuzzy_config': fuzzy_config_fingerprint(control_system)
+    }
+
+
+def run_coordinator(map_obj: Map, output_path: str, authkey: bytes, address: tuple[str, int] = ('127.0.0.1', 50000),
+                    tile_size: int = TILE_SIZE, lease_timeout: float = LEASE_TIMEOUT, progress_interval: float = 5.0,
+                    on_listening=None, pollutants: bool = False) -> np.ndarray:
+    """
+    Splits the map's heatmap into tiles and serves them to workers over TCP until all tiles are done.
+    Workers are started separately with run_worker, on this or other machines, and may join or
+    die at any time: the tiles of a worker that stops sending heartbeats are handed out again.
+
+    Parameters:
+    - map_obj (Map): The map to compute the heatmap of.
+    - output_path (str): .npy file receiving the heatmap, written tile by tile.
+    - authkey (bytes): Shared secret of the coordinator and the workers. The manager unpickles what
+      authenticated clients send, so anyone holding it can run code on the coordinator: keep it secret.
+    - address (tuple[str, int]): Interface and port to listen on (port 0 picks a free port). Only
+      listen beyond localhost on a trusted network.
+    - tile_size (int): Size of a tile along both axes.
+    - lease_timeout (float): Seconds without heartbeat after which a worker's tiles are re-queued.
+    - progress_interval (float): Seconds between progress log lines.
+    - on_listening (callable): Called with the (host, port) the coordinator listens on, before the
+      first tile is handed out, e.g. to start local workers when the port was picked with 0.
+    - pollutants (bool): Also use the stations' PM10, NO2 and O3, like compute_heatmap(pollutants=True).
+
+    Returns:
+    - np.ndarray: The heatmap, memory-mapped from output_path.
+    """
+    tile_queue = TileQueue(make_snapshot(map_obj, pollutants), (map_obj.size, map_obj.size), tile_size, output_path, lease_timeout)
+    TileManager.register('get_queue', callable=lambda: tile_queue)
+    manager = TileManager(address=address, authkey=authkey)
+    server = manager.get_server()
+    threading.Thread(target=server.serve_forever, name="tile-server", daemon=True).start()
+    logging.info(f"Coordinator listening on {server.address} with {len(tile_queue.tiles)} tiles of {tile_size} cells")
+    if on_listening is not None:
+        on_listening(server.address)
+
+    start, last_report = time.perf_counter(), 0.0
+    while True:
+        progress = tile_queue.progress()
+        if progress['done'] == progress['tiles']:
+            break
+        if time.perf_counter() - last_report >= progress_interval:
+            logging.info(f"{progress['done']}/{progress['tiles']} tiles done, {progress['leased']} leased, "
+                         f"{progress['requeued']} re-queued")
+            last_report = time.perf_counter()
+        time.sleep(POLL_INTERVAL)
+
+    # Give the workers one poll interval to receive 'done' before the server goes away
+    time.sleep(2 * POLL_INTERVAL)
+    server.stop_event.set()
+    tile_queue.output.flush()
+    logging.info(f"All {len(tile_queue.tiles)} tiles done in {time.perf_counter() - start:.2f} s "
+                 f"({tile_queue.requeued} re-queued)")
+    return np.load(output_path, mmap_mode='r')
+
+
+def run_worker(address: tuple[str, int], authkey: bytes, worker_id: str = None) -> int:
+    """
+    Computes tiles handed out by a coordinator until the heatmap is complete. A coordinator that
+    went away, e.g. because it finished while this worker was computing a re-queued tile, also ends
+    the work.
+
+    Parameters:
+    - address (tuple[str, int]): Host and port of the coordinator.
+    - authkey (bytes): Shared secret of the coordinator and the workers.
+    - worker_id (str): Name of the worker in the coordinator's logs (default: host and process id).
+
+    Returns:
+    - int: Number of tiles this worker computed.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    TileManager.register('get_queue')
+    manager = TileManager(address=address, authkey=authkey)
+    manager.connect()
+    tile_queue = manager.get_queue()
+
+    # The snapshot is shipped once; the tiles only carry their bounds
+    snapshot = tile_queue.register(worker_id)
+    stations = [Station.from_values(latitude, longitude, *values, pollutants=dict(zip(POLLUTANTS, row)))
+                for (latitude, longitude), values, row in zip(snapshot['coordinates'], snapshot['data'], snapshot['pollutants'])]
+    map_obj = Map(np.array(stations), size=snapshot['size'])
+    method, params = snapshot['interpolation']
+    if method != 'idw' or params:
+        map_obj.set_interpolation(method, **params)
+    grid_locations = get_grid_locations(map_obj)
+    use_pollutants = snapshot['use_pollutants']
+    control_system = build_pollutant_system()['ctrl_sys'] if use_pollutants else None
+
+    # Heartbeats go over their own connection, so a long tile does not look like a dead worker,
+    # at the pace of the coordinator's lease timeout rather than this worker's default
+    stop = threading.Event()
+    heartbeat_interval = snapshot['lease_timeout'] / 4
+
+    def send_heartbeats() -> None:
+        try:
+            heartbeat_queue = manager.get_queue()
+            while not stop.wait(heartbeat_interval):
+                heartbeat_queue.heartbeat(worker_id)
+        except (EOFError, ConnectionError):
+            pass  # The coordinator stopped; the main loop finds out on its next call
+
+    threading.Thread(target=send_heartbeats, name="heartbeat", daemon=True).start()
+
+    n_tiles = 0
+    try:
+        while True:
+            try:
+                task = tile_queue.get_tile(worker_id)
+            except (EOFError, ConnectionError):
+                task = None
+            if task is None or task == 'done':
+                break
+            if task == 'wait':
+                time.sleep(POLL_INTERVAL)
+                continue
+            tile_id, row, column, row_stop, column_stop = task
+            data = map_obj.get_data_batch(grid_locations[row:row_stop, column:column_stop].reshape(-1, 2),
+                                          pollutants=use_pollutants)
+            inputs = {'air_pollution': data[:, 0], 'population_density': data[:, 1], 'veg_cover': data[:, 2]}
+            if use_pollutants:
+                inputs.update({name: data[:, 2 + index] for index, name in enumerate(POLLUTANTS[1:], 1)})
+            values = batch_inference(inputs, control_system=control_system, membership_functions=snapshot['membership_functions'])
+            values[np.all(data[:, :3] == -1, axis=1)] = 0.0  # Cells without data, like compute_need_for_action
+            try:
+                tile_queue.submit(worker_id, tile_id, values.reshape(row_stop - row, column_stop - column))
+            except (EOFError, ConnectionError):
+                break
+            n_tiles += 1
+    finally:
+        stop.set()
+    logging.info(f"Worker {worker_id} finished after {n_tiles} tiles")
+    return n_tiles
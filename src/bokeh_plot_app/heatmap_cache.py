@@ -0,0 +1,169 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.heatmap_cache')
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2
+"""Default size bound of the on-disk cache (512 MB)."""
+
+
+def fuzzy_config_fingerprint(control_system) -> str:
+    """
+    Hashes a skfuzzy ControlSystem: the universes and membership functions of all variables,
+    and the rule base. Any change to the fuzzy model gives a different fingerprint.
+    """
+    digest = hashlib.sha256()
+    variables = list(control_system.antecedents) + list(control_system.consequents)
+    for variable in sorted(variables, key=lambda variable: variable.label):
+        digest.update(variable.label.encode())
+        digest.update(np.ascontiguousarray(variable.universe, dtype=float).tobytes())
+        for label, term in variable.terms.items():
+            digest.update(label.encode())
+            digest.update(np.ascontiguousarray(term.mf, dtype=float).tobytes())
+    for rule in control_system.rules:
+        digest.update(str(rule).encode())
+    return digest.hexdigest()
+
+
+class HeatmapCache:
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        """
+        Content-addressed on-disk cache of heatmap results.
+
+        Entries are keyed by a hash of everything the heatmap depends on (station coordinates and
+        data, grid specification and fuzzy configuration), so an unchanged station snapshot is
+        served from disk instead of being recomputed. The cache is bounded in size and evicts the
+        least recently used entries first.
+
+        Parameters:
+        - directory (str): Directory holding the cache entries.
+        - max_bytes (int): Maximum total size of the entries on disk.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __str__(self) -> str:
+        stats = self.stats()
+        return (f"HeatmapCache at {self.directory}: {stats['entries']} entries, {stats['bytes']} bytes, "
+                f"{stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions")
+
+    @staticmethod
+    def make_key(coordinates: np.ndarray, data: np.ndarray, grid_spec: dict, fuzzy_config: str) -> str:
+        """
+        Builds the cache key of a heatmap computation.
+
+        Parameters:
+        - coordinates (np.ndarray): Station coordinates, shape (n_stations, 2).
+        - data (np.ndarray): Station data vectors, shape (n_stations, n_channels).
+        - grid_spec (dict): Everything defining the grid, e.g. its size and bounds.
+        - fuzzy_config (str): Fingerprint of the fuzzy system, see fuzzy_config_fingerprint.
+
+        Returns:
+        - str: Hex digest identifying the computation.
+        """
+        digest = hashlib.sha256()
+        for array in (coordinates, data):
+            array = np.ascontiguousarray(array, dtype=float)
+            digest.update(str(array.shape).encode())
+            digest.update(array.tobytes())
+        digest.update(json.dumps(grid_spec, sort_keys=True, default=float).encode())
+        digest.update(fuzzy_config.encode())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def get(self, key: str) -> tuple[dict[str, np.ndarray], dict] | None:
+        """
+        Looks up a cache entry.
+
+        Parameters:
+        - key (str): Key from make_key.
+
+        Returns:
+        - tuple[dict[str, np.ndarray], dict] | None: The cached arrays and metadata, or None on a miss.
+        """
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                arrays = {name: entry[name] for name in entry.files if name != '__metadata__'}
+                metadata = json.loads(str(entry['__metadata__']))
+        except (OSError, ValueError, KeyError) as e:
+            if os.path.exists(path):
+                logging.warning(f"Discarding unreadable cache entry {key}: {e}")
+                os.remove(path)
+            self.misses += 1
+            return None
+
+        os.utime(path)  # Mark as recently used
+        self.hits += 1
+        return arrays, metadata
+
+    def put(self, key: str, arrays: dict[str, np.ndarray], metadata: dict = None) -> None:
+        """
+        Stores a cache entry atomically and evicts old entries if the cache grew too large.
+
+        Parameters:
+        - key (str): Key from make_key.
+        - arrays (dict[str, np.ndarray]): Result arrays, e.g. the heatmap.
+        - metadata (dict): JSON-serializable derived results, e.g. station labels and recommendations.
+        """
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as file:
+                np.savez(file, __metadata__=np.array(json.dumps(metadata or {}, default=float)), **arrays)
+            os.replace(temporary_path, self._path(key))
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+        self.evict()
+
+    def _entries(self) -> list[tuple[float, int, str]]:
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self) -> None:
+        """
+        Removes least recently used entries until the cache fits in max_bytes.
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        """
+        Hit/miss counters of this cache object, and the current size of the cache on disk.
+        """
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries)
+        }
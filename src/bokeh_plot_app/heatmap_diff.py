@@ -0,0 +1,255 @@
+import hashlib
+import json
+import logging
+import struct
+import zlib
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+BLOCK_SIZE = 32
+"""Rows and columns per block. A 4000x4000 grid has 15625 blocks of 8 KiB (float64)."""
+PATCH_FORMAT = 1
+"""Version of the patch layout, bumped on incompatible changes of encode_patch."""
+MAGIC = b'BAPT'
+CHECKSUM_BYTES = 8
+
+
+def block_grid(shape: tuple[int, int], block_size: int = BLOCK_SIZE) -> tuple[int, int]:
+    """
+    Number of block rows and columns of a grid. Blocks on the bottom and right edges may be smaller.
+    """
+    return -(-shape[0] // block_size), -(-shape[1] // block_size)
+
+
+def block_slices(block_row: int, block_column: int, block_size: int = BLOCK_SIZE) -> tuple[slice, slice]:
+    return (slice(block_row * block_size, (block_row + 1) * block_size),
+            slice(block_column * block_size, (block_column + 1) * block_size))
+
+
+def block_checksums(heatmap: np.ndarray, block_size: int = BLOCK_SIZE) -> np.ndarray:
+    """
+    BLAKE2b checksum of every block's bytes, as a (block rows, block columns) array of uint64.
+    Detects any change, including NaN payloads and the sign of zero.
+    """
+    rows, columns = block_grid(heatmap.shape, block_size)
+    checksums = np.empty((rows, columns), dtype=np.uint64)
+    for block_row in range(rows):
+        for block_column in range(columns):
+            block = np.ascontiguousarray(heatmap[block_slices(block_row, block_column, block_size)])
+            checksums[block_row, block_column] = int.from_bytes(
+                hashlib.blake2b(block.data, digest_size=CHECKSUM_BYTES).digest(), 'little')
+    return checksums
+
+
+def changed_blocks(previous: np.ndarray, current: np.ndarray, tolerance: float, block_size: int = BLOCK_SIZE) -> np.ndarray:
+    """
+    Boolean (block rows, block columns) array of the blocks where some cell moved by more than
+    tolerance, or became or stopped being NaN.
+    """
+    assert previous.shape == current.shape, f"Shapes differ: {previous.shape} and {current.shape}"
+    rows, columns = block_grid(current.shape, block_size)
+    padded_shape = (rows * block_size, columns * block_size)
+    with np.errstate(invalid='ignore'):
+        moved = (np.abs(current - previous) > tolerance) | (np.isnan(current) != np.isnan(previous))
+    padded = np.zeros(padded_shape, dtype=bool)
+    padded[:current.shape[0], :current.shape[1]] = moved
+    return padded.reshape(rows, block_size, columns, block_size).any(axis=(1, 3))
+
+
+def full_patch(heatmap: np.ndarray, version: int, block_size: int = BLOCK_SIZE, metadata: dict = None) -> dict:
+    """
+    Patch holding every block of a heatmap, with base_version None. Consumers that lost versions,
+    e.g. a slow pipeline subscriber, resynchronize with it.
+    """
+    blocks = np.argwhere(np.ones(block_grid(heatmap.shape, block_size), dtype=bool))
+    return {'format': PATCH_FORMAT, 'version': version, 'base_version': None, 'shape': heatmap.shape,
+            'dtype': heatmap.dtype.str, 'block_size': block_size, 'metadata': metadata, 'blocks': blocks,
+            'values': [heatmap[block_slices(block_row, block_column, block_size)].copy() for block_row, block_column in blocks]}
+
+
+class BlockDiffer:
+    def __init__(self, block_size: int = BLOCK_SIZE, tolerance: float = 0.0) -> None:
+        """
+        Publisher side of the diff layer: turns successive heatmaps into versioned patches that
+        hold only the blocks that changed since the previous version.
+
+        With tolerance 0 blocks are compared by checksum, and only the checksums are kept. With a
+        positive tolerance a copy of the published grid is kept, and a block is sent once some cell
+        moved by more than tolerance from what consumers hold, so small drifts do not accumulate.
+
+        The first heatmap, and any heatmap whose shape, dtype or metadata (e.g. the grid bounds)
+        changed, gives a full patch with base_version None.
+
+        Parameters:
+        - block_size (int): Rows and columns per block.
+        - tolerance (float): Largest change of a cell that is not published.
+        """
+        assert block_size > 0, "block_size must be positive"
+        assert tolerance >= 0, "tolerance must not be negative"
+        self.block_size = block_size
+        self.tolerance = tolerance
+        self.version = 0
+        self._layout = None  # (shape, dtype, metadata) of the published version
+        self._checksums = None
+        self._published = None
+
+    def diff(self, heatmap: np.ndarray, metadata: dict = None) -> dict:
+        """
+        Publishes a new heatmap version.
+
+        Parameters:
+        - heatmap (np.ndarray): The new heatmap.
+        - metadata (dict): JSON serializable description of the grid, e.g. its bounds. A change
+          of metadata invalidates all blocks.
+
+        Returns:
+        - dict: The patch: 'format', 'version', 'base_version' (None for a full patch), 'shape',
+          'dtype', 'block_size', 'metadata', 'blocks' ((k, 2) int array of block rows and columns)
+          and 'values' (list of the k block arrays).
+        """
+        heatmap = np.asarray(heatmap)
+        layout = (heatmap.shape, heatmap.dtype.str, json.dumps(metadata, sort_keys=True, default=float))
+        if layout != self._layout:
+            if self.tolerance == 0:
+                self._checksums = block_checksums(heatmap, self.block_size)
+            else:
+                self._published = heatmap.copy()
+            patch = full_patch(heatmap, self.version + 1, self.block_size, metadata)
+        else:
+            if self.tolerance == 0:
+                checksums = block_checksums(heatmap, self.block_size)
+                changed = checksums != self._checksums
+                self._checksums = checksums
+            else:
+                changed = changed_blocks(self._published, heatmap, self.tolerance, self.block_size)
+            blocks = np.argwhere(changed)
+            values = [heatmap[block_slices(block_row, block_column, self.block_size)].copy() for block_row, block_column in blocks]
+            if self.tolerance > 0:
+                # Track what consumers hold, so that small drifts add up until they are sent
+                for (block_row, block_column), block in zip(blocks, values):
+                    self._published[block_slices(block_row, block_column, self.block_size)] = block
+            patch = {'format': PATCH_FORMAT, 'version': self.version + 1, 'base_version': self.version,
+                     'shape': heatmap.shape, 'dtype': heatmap.dtype.str, 'block_size': self.block_size,
+                     'metadata': metadata, 'blocks': blocks, 'values': values}
+        self.version += 1
+        self._layout = layout
+        return patch
+
+
+def patch_summary(patch: dict) -> dict:
+    """
+    Changed and total blocks, and the share of cells sent.
+    """
+    n_blocks = int(np.prod(block_grid(patch['shape'], patch['block_size'])))
+    n_cells = sum(block.size for block in patch['values'])
+    return {'version': patch['version'], 'base_version': patch['base_version'], 'changed_blocks': len(patch['values']),
+            'total_blocks': n_blocks, 'changed_fraction': n_cells / int(np.prod(patch['shape']))}
+
+
+def encode_patch(patch: dict, compression_level: int = 1) -> bytes:
+    """
+    Compact binary form of a patch: MAGIC, the length of a JSON header (uint32, little endian),
+    the header, and the zlib-compressed block values concatenated in the order of the header's
+    block list. Cost and size grow with the number of changed blocks, not with the grid.
+    """
+    header = {key: patch[key] for key in ('format', 'version', 'base_version', 'dtype', 'block_size', 'metadata')}
+    header['shape'] = [int(n) for n in patch['shape']]
+    header['blocks'] = np.asarray(patch['blocks']).astype(int).tolist()
+    header = json.dumps(header, separators=(',', ':'), default=float).encode()
+    payload = zlib.compress(b''.join(np.ascontiguousarray(block).tobytes() for block in patch['values']), compression_level)
+    return MAGIC + struct.pack('<I', len(header)) + header + payload
+
+
+def decode_patch(data: bytes) -> dict:
+    """
+    Inverse of encode_patch.
+    """
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a heatmap patch")
+    (header_length,) = struct.unpack_from('<I', data, len(MAGIC))
+    start = len(MAGIC) + 4
+    patch = json.loads(data[start:start + header_length])
+    if patch['format'] != PATCH_FORMAT:
+        raise ValueError(f"Unsupported patch format {patch['format']}, expected {PATCH_FORMAT}")
+    payload = zlib.decompress(data[start + header_length:])
+    shape, block_size, dtype = tuple(patch['shape']), patch['block_size'], np.dtype(patch['dtype'])
+    values, offset = [], 0
+    for block_row, block_column in patch['blocks']:
+        rows = min(block_size, shape[0] - block_row * block_size)
+        columns = min(block_size, shape[1] - block_column * block_size)
+        count = rows * columns
+        values.append(np.frombuffer(payload, dtype=dtype, count=count, offset=offset).reshape(rows, columns))
+        offset += count * dtype.itemsize
+    patch['shape'] = shape
+    patch['blocks'] = np.array(patch['blocks'], dtype=int).reshape(-1, 2)
+    patch['values'] = values
+    return patch
+
+
+def apply_patch(heatmap: np.ndarray, patch: dict) -> None:
+    """
+    Writes the blocks of a patch into a heatmap in place. The caller checks the versions
+    (see PatchReceiver).
+    """
+    assert heatmap.shape == tuple(patch['shape']), f"Patch of shape {tuple(patch['shape'])} for a {heatmap.shape} heatmap"
+    for (block_row, block_column), block in zip(patch['blocks'], patch['values']):
+        heatmap[block_slices(block_row, block_column, patch['block_size'])] = block
+
+
+class PatchReceiver:
+    def __init__(self) -> None:
+        """
+        Consumer side of the diff layer: keeps a heatmap up to date by applying patches in place.
+        """
+        self.heatmap = None
+        self.version = None
+        self.metadata = None
+
+    def apply(self, patch: dict) -> np.ndarray:
+        """
+        Applies a patch, given as a dict or as encoded bytes.
+
+        Raises:
+        - ValueError: When the patch is based on another version than the one held. The consumer
+          then needs a full patch, e.g. from a new BlockDiffer or after a layout change.
+        """
+        if isinstance(patch, (bytes, bytearray, memoryview)):
+            patch = decode_patch(bytes(patch))
+        if patch['base_version'] is None:
+            self.heatmap = np.empty(tuple(patch['shape']), dtype=patch['dtype'])
+        elif patch['base_version'] != self.version:
+            raise ValueError(f"Patch v{patch['version']} applies to v{patch['base_version']}, but v{self.version} is held")
+        apply_patch(self.heatmap, patch)
+        self.version = patch['version']
+        self.metadata = patch['metadata']
+        return self.heatmap
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from scipy import ndimage
+
+    # Usage: python heatmap_diff.py [grid_size] [changed_fraction]
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    fraction = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    rng = np.random.default_rng(0)
+    heatmap = ndimage.zoom(ndimage.gaussian_filter(rng.random((size // 10, size // 10)), 8), 10, order=1) * 100
+
+    differ, receiver = BlockDiffer(), PatchReceiver()
+    receiver.apply(encode_patch(differ.diff(heatmap)))
+    updated = heatmap.copy()
+    side = int(size * fraction ** 0.5)
+    updated[:side, :side] += 1.0  # A change concentrated around a few stations
+    start = time.perf_counter()
+    patch = differ.diff(updated)
+    diff_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    encoded = encode_patch(patch)
+    receiver.apply(encoded)
+    publish_seconds = time.perf_counter() - start
+    assert np.array_equal(receiver.heatmap, updated) and receiver.version == 2
+    print(f"{patch_summary(patch)}: diff {diff_seconds:.3f} s, encode+apply {publish_seconds:.3f} s, "
+          f"{len(encoded) / 1024:.0f} KiB instead of {updated.nbytes / 1024:.0f} KiB")
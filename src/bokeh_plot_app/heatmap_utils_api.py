@@ -1,9 +1,7 @@
+import functools
 import numpy as np
-import skfuzzy as fuzz
-from skfuzzy import control as ctrl
-from mapApi import Map, Station
+from mapApi import Map, Station, POLLUTANTS
 import logging
-from skfuzzy import interp_membership
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -18,77 +16,202 @@ Unit: inhabitants/ha"""
 MAX_VC = 101
 """Maximum value for vegetation cover (exclusive)
 Unit: %""" 
-
-# Create universe variables
-# Input
-population_density = ctrl.Antecedent(np.arange(0, MAX_PD, 1), 'population_density')
-air_pollution = ctrl.Antecedent(np.arange(0, MAX_AP, 1), 'air_pollution')
-veg_cover = ctrl.Antecedent(np.arange(0, MAX_VC, 1), 'veg_cover')
-# Output
-need_for_action = ctrl.Consequent(np.arange(0, 101, 1), 'need_for_action')
-
-# Define membership functions
-# Population Density Membership Functions
-#   based on scale from https://www.geocat.ch/geonetwork/srv/eng/catalog.search#/metadata/4bfbbf20-d90e-4131-8fe2-4c454ad45c16
-population_density['very_low'] = fuzz.zmf(population_density.universe, a=2, b=3)
-# based on scale from https://www.geocat.ch/geonetwork/srv/eng/catalog.search#/metadata/4bfbbf20-d90e-4131-8fe2-4c454ad45c16
-population_density['very_low'] = fuzz.gaussmf(population_density.universe, mean=2, sigma=1)
-population_density['low'] = fuzz.gaussmf(population_density.universe, mean=5, sigma=1)
-population_density['medium'] = fuzz.gaussmf(population_density.universe, mean=11, sigma=2)
-population_density['high'] = fuzz.gaussmf(population_density.universe, mean=28, sigma=6)
-population_density['very_high'] = fuzz.gaussmf(population_density.universe, mean=80, sigma=20)
-population_density['highest'] = fuzz.smf(population_density.universe, a=100, b=120)    
-
-# Air Pollution Membership Functions
-air_pollution['good'] = fuzz.zmf(air_pollution.universe, a=10, b=15)
-air_pollution['moderate'] = fuzz.gaussmf(air_pollution.universe, mean=25, sigma=7)
-air_pollution['unhealthy'] = fuzz.smf(air_pollution.universe, a=35, b=50)   
-
-# Vegetation Cover Membership Functions
-veg_cover['low'] = fuzz.zmf(veg_cover.universe, a=15, b=30)
-veg_cover['medium'] = fuzz.gaussmf(veg_cover.universe, mean=50, sigma=15)
-veg_cover['high'] = fuzz.smf(veg_cover.universe, a=65, b=85)  
-
-# Need for Action Membership Functions
-need_for_action['low'] = fuzz.zmf(need_for_action.universe, a=20, b=40)
-need_for_action['medium'] = fuzz.gaussmf(need_for_action.universe, mean=50, sigma=15)
-need_for_action['high'] = fuzz.smf(need_for_action.universe, a=60, b=80)  
-
-# Define fuzzy rules
-rule1 = ctrl.Rule(
-    air_pollution['unhealthy'] & (population_density['very_high'] | population_density['high'] | population_density['highest']),
-    need_for_action['high']
+MAX_POLLUTANTS = {'pm10': 201, 'no2': 401, 'o3': 301}
+"""Maximum values (exclusive) of the extra pollutant antecedents, see build_pollutant_system
+Unit: µg/m³"""
+
+UNIVERSES = {
+    'population_density': np.arange(0, MAX_PD, 1),
+    'air_pollution': np.arange(0, MAX_AP, 1),
+    'veg_cover': np.arange(0, MAX_VC, 1),
+    'need_for_action': np.arange(0, 101, 1)
+}
+"""Universes of the fuzzy variables. Plain arrays, so they are available without building the system."""
+FUZZY_TERMS = {
+    # Population Density Membership Functions
+    #   based on scale from https://www.geocat.ch/geonetwork/srv/eng/catalog.search#/metadata/4bfbbf20-d90e-4131-8fe2-4c454ad45c16
+    'population_density': {
+        'very_low': ('gaussmf', {'mean': 2, 'sigma': 1}),
+        'low': ('gaussmf', {'mean': 5, 'sigma': 1}),
+        'medium': ('gaussmf', {'mean': 11, 'sigma': 2}),
+        'high': ('gaussmf', {'mean': 28, 'sigma': 6}),
+        'very_high': ('gaussmf', {'mean': 80, 'sigma': 20}),
+        'highest': ('smf', {'a': 100, 'b': 120})
+    },
+    # Air Pollution Membership Functions
+    'air_pollution': {
+        'good': ('zmf', {'a': 10, 'b': 15}),
+        'moderate': ('gaussmf', {'mean': 25, 'sigma': 7}),
+        'unhealthy': ('smf', {'a': 35, 'b': 50})
+    },
+    # Vegetation Cover Membership Functions
+    'veg_cover': {
+        'low': ('zmf', {'a': 15, 'b': 30}),
+        'medium': ('gaussmf', {'mean': 50, 'sigma': 15}),
+        'high': ('smf', {'a': 65, 'b': 85})
+    },
+    # Need for Action Membership Functions
+    'need_for_action': {
+        'low': ('zmf', {'a': 20, 'b': 40}),
+        'medium': ('gaussmf', {'mean': 50, 'sigma': 15}),
+        'high': ('smf', {'a': 60, 'b': 80})
+    }
+}
+"""Membership functions per fuzzy variable and term, in label order: the name of the skfuzzy
+function and its parameters."""
+FUZZY_RULES = (
+    (('and', ('air_pollution', 'unhealthy'), ('or', ('or', ('population_density', 'very_high'), ('population_density', 'high')),
+                                              ('population_density', 'highest'))), 'high'),
+    (('and', ('air_pollution', 'unhealthy'), ('population_density', 'very_low')), 'low'),
+    (('and', ('air_pollution', 'unhealthy'), ('or', ('population_density', 'low'), ('population_density', 'medium'))), 'medium'),
+    (('air_pollution', 'good'), 'low'),
+    (('veg_cover', 'high'), 'low'),
+    (('air_pollution', 'moderate'), 'medium')
 )
+"""The rules rule1 to rule6 as (clause, need_for_action term). A clause is a (variable, term) pair,
+or ('and' | 'or', clause, clause), combined with min and max like skfuzzy's defaults."""
+FUZZY_NAMES = ('population_density', 'air_pollution', 'veg_cover', 'need_for_action',
+               'rule1', 'rule2', 'rule3', 'rule4', 'rule5', 'rule6', 'ctrl_sys')
+"""Module attributes holding the fuzzy system. They are built on first access, see build_fuzzy_system."""
+
+def _membership_functions(universe: np.ndarray, terms: dict) -> dict[str, np.ndarray]:
+    import skfuzzy as fuzz  # Without skfuzzy.control, which imports matplotlib
+    return {term: getattr(fuzz, kind)(universe, **params) for term, (kind, params) in terms.items()}
+
+@functools.cache
+def build_fuzzy_system() -> dict:
+    """
+    Builds the fuzzy variables, rules and control system of UNIVERSES, FUZZY_TERMS and FUZZY_RULES, once.
 
-rule2 = ctrl.Rule(
-    air_pollution['unhealthy'] & population_density['very_low'],
-    need_for_action['low']
-)
+    skfuzzy's control package imports matplotlib, which dominates the import time of this module,
+    so the system is only constructed when something uses it. The module attributes listed in
+    FUZZY_NAMES (e.g. ctrl_sys) resolve to the objects built here. The vectorized inference does
+    not need it, see fuzzy_table.
 
-rule3 = ctrl.Rule(
-    air_pollution['unhealthy'] & (population_density['low'] | population_density['medium']),
-    need_for_action['medium']
-)
+    Returns:
+    - dict: The objects of FUZZY_NAMES by name.
+    """
+    from skfuzzy import control as ctrl
+
+    # Create universe variables
+    variables = {label: ctrl.Antecedent(universe, label) for label, universe in UNIVERSES.items() if label != 'need_for_action'}
+    need_for_action = variables['need_for_action'] = ctrl.Consequent(UNIVERSES['need_for_action'], 'need_for_action')
+
+    # Define membership functions
+    for label, variable in variables.items():
+        for term, mf in _membership_functions(variable.universe, FUZZY_TERMS[label]).items():
+            variable[term] = mf
+
+    # Define fuzzy rules
+    def build_clause(clause):
+        if clause[0] == 'and':
+            return build_clause(clause[1]) & build_clause(clause[2])
+        if clause[0] == 'or':
+            return build_clause(clause[1]) | build_clause(clause[2])
+        return variables[clause[0]][clause[1]]
+
+    rules = {f"rule{index + 1}": ctrl.Rule(build_clause(clause), need_for_action[term])
+             for index, (clause, term) in enumerate(FUZZY_RULES)}
+
+    # Create control system
+    ctrl_sys = ctrl.ControlSystem(list(rules.values()))
+    return {**variables, **rules, 'ctrl_sys': ctrl_sys}
+
+@functools.cache
+def fuzzy_table() -> dict:
+    """
+    The fuzzy system of build_fuzzy_system as plain arrays and tuples, in the form batch_inference
+    evaluates (see compile_control_system), built without importing the slow skfuzzy.control.
+    """
+    terms = {label: _membership_functions(UNIVERSES[label], FUZZY_TERMS[label]) for label in FUZZY_TERMS}
+    return {
+        'antecedents': {label: (UNIVERSES[label], terms[label]) for label in FUZZY_TERMS if label != 'need_for_action'},
+        'consequents': {'need_for_action': (UNIVERSES['need_for_action'], terms['need_for_action'], np.fmax)},
+        'rules': [(clause, np.fmin, np.fmax, [('need_for_action', term, 1.0)]) for clause, term in FUZZY_RULES]
+    }
 
-rule4 = ctrl.Rule(
-    air_pollution['good'],
-    need_for_action['low']
-)
+def compile_control_system(control_system: 'ctrl.ControlSystem') -> dict:
+    """
+    Converts a skfuzzy control system to the form of fuzzy_table.
 
-rule5 = ctrl.Rule(
-    veg_cover['high'],
-    need_for_action['low']
-)
+    Returns:
+    - dict: 'antecedents' and 'consequents' by label, with their universe and membership function
+      per term (and for consequents the accumulation method), and 'rules' in the order of
+      control_system.rules as (clause, AND function, OR function, [(consequent, term, weight)]).
+      Clauses are nested tuples like FUZZY_RULES, with ('not', clause) as well.
+    """
+    from skfuzzy.control.term import TermAggregate
+
+    def compile_clause(clause):
+        if isinstance(clause, TermAggregate):
+            if clause.kind == 'not':
+                return ('not', compile_clause(clause.term1))
+            return (clause.kind, compile_clause(clause.term1), compile_clause(clause.term2))
+        return (clause.parent.label, clause.label)
+
+    return {
+        'antecedents': {antecedent.label: (antecedent.universe, {label: term.mf for label, term in antecedent.terms.items()})
+                        for antecedent in control_system.antecedents},
+        'consequents': {consequent.label: (consequent.universe, {label: term.mf for label, term in consequent.terms.items()},
+                                           consequent.accumulation_method)
+                        for consequent in control_system.consequents},
+        'rules': [(compile_clause(rule.antecedent), rule.and_func, rule.or_func,
+                   [(weighted.term.parent.label, weighted.term.label, weighted.weight) for weighted in rule.consequent])
+                  for rule in control_system.rules]
+    }
 
-rule6 = ctrl.Rule(
-    air_pollution['moderate'],
-    need_for_action['medium']
-)
+def __getattr__(name: str):
+    if name in FUZZY_NAMES:
+        return build_fuzzy_system()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@functools.cache
+def build_pollutant_system() -> dict:
+    """
+    Extends the system of build_fuzzy_system with PM10, NO2 and O3 antecedents, named like
+    POLLUTANTS, once. Their scales follow the WHO 2021 guideline levels (24-hour PM10 45 and
+    NO2 25 µg/m³, 8-hour O3 100 µg/m³).
+
+    The new rules only use the 'moderate' and 'unhealthy' terms, which are exactly 0 at good
+    levels (trapezoids rather than gaussians, whose tails would still shift the centroid), so a
+    missing reading (-1, clipped to 0) or a good one fires nothing and need_for_action stays what
+    the PM2.5 system computes.
+
+    Returns:
+    - dict: The antecedents 'pm10', 'no2' and 'o3', the rules 'rule7' to 'rule10' and 'ctrl_sys'.
+    """
+    import skfuzzy as fuzz
+    from skfuzzy import control as ctrl
+
+    base = build_fuzzy_system()
+    population_density, need_for_action = base['population_density'], base['need_for_action']
+    pm10 = ctrl.Antecedent(np.arange(0, MAX_POLLUTANTS['pm10'], 1), 'pm10')
+    no2 = ctrl.Antecedent(np.arange(0, MAX_POLLUTANTS['no2'], 1), 'no2')
+    o3 = ctrl.Antecedent(np.arange(0, MAX_POLLUTANTS['o3'], 1), 'o3')
+
+    pm10['good'] = fuzz.zmf(pm10.universe, a=20, b=45)
+    pm10['moderate'] = fuzz.trapmf(pm10.universe, [30, 45, 70, 100])
+    pm10['unhealthy'] = fuzz.smf(pm10.universe, a=75, b=100)
+
+    no2['good'] = fuzz.zmf(no2.universe, a=15, b=25)
+    no2['moderate'] = fuzz.trapmf(no2.universe, [15, 25, 50, 80])
+    no2['unhealthy'] = fuzz.smf(no2.universe, a=50, b=100)
 
-# Create control system
-ctrl_sys = ctrl.ControlSystem([
-    rule1, rule2, rule3, rule4, rule5, rule6 
-])
+    o3['good'] = fuzz.zmf(o3.universe, a=60, b=100)
+    o3['moderate'] = fuzz.trapmf(o3.universe, [80, 100, 140, 180])
+    o3['unhealthy'] = fuzz.smf(o3.universe, a=140, b=180)
+
+    densely_populated = population_density['high'] | population_density['very_high'] | population_density['highest']
+    rule7 = ctrl.Rule(pm10['unhealthy'] & densely_populated, need_for_action['high'])
+    rule8 = ctrl.Rule(no2['unhealthy'] & densely_populated, need_for_action['high'])
+    rule9 = ctrl.Rule(pm10['moderate'] | no2['moderate'] | o3['moderate'], need_for_action['medium'])
+    # Ozone forms regionally, so local measures help less than for the other pollutants
+    rule10 = ctrl.Rule(o3['unhealthy'], need_for_action['medium'])
+
+    ctrl_sys = ctrl.ControlSystem([base[f"rule{index}"] for index in range(1, 7)] + [rule7, rule8, rule9, rule10])
+    return {'pm10': pm10, 'no2': no2, 'o3': o3, 'rule7': rule7, 'rule8': rule8, 'rule9': rule9, 'rule10': rule10,
+            'ctrl_sys': ctrl_sys}
 
 
 def run_simulation(query_location: tuple[float, float], map_obj: Map) -> float:
@@ -112,7 +235,8 @@ def run_simulation(query_location: tuple[float, float], map_obj: Map) -> float:
     
     try:
         # Instantiate a new simulation object for each run
-        sim = ctrl.ControlSystemSimulation(ctrl_sys)
+        from skfuzzy import control as ctrl
+        sim = ctrl.ControlSystemSimulation(build_fuzzy_system()['ctrl_sys'])
         
         # Input the data into the simulation
         sim.input['veg_cover'] = veg_cover_val                      # Vegetation Cover (%)
@@ -135,9 +259,255 @@ def run_simulation(query_location: tuple[float, float], map_obj: Map) -> float:
         logging.error(f"Error during simulation at location {query_location}: {e}")
         return 0.0  # Assign a default or error value
 
-def generate_random_stations(n_stations: int, map_size: int, max_ap: int = MAX_AP, max_pd: int = MAX_PD, max_vc: int = MAX_VC) -> np.ndarray[Station]:
+BATCH_CHUNK_SIZE = 16384
+"""Number of query points pushed through the batched inference engine at once.
+Bounds the (chunk, len(universe)) temporaries used during defuzzification."""
+
+def _rule_firing(clause, memberships: dict, and_func, or_func) -> np.ndarray:
+    """
+    Recursively evaluates the antecedent clause of a rule for a batch of inputs.
+
+    Parameters:
+    - clause (tuple): The (sub)clause to evaluate, see compile_control_system.
+    - memberships (dict): Maps (variable label, term label) to membership arrays.
+    - and_func, or_func: The AND/OR operators of the rule.
+
+    Returns:
+    - np.ndarray: Firing strength of the clause for every input.
+    """
+    if clause[0] == 'not':
+        return 1. - _rule_firing(clause[1], memberships, and_func, or_func)
+    if clause[0] in ('and', 'or'):
+        left = _rule_firing(clause[1], memberships, and_func, or_func)
+        right = _rule_firing(clause[2], memberships, and_func, or_func)
+        return and_func(left, right) if clause[0] == 'and' else or_func(left, right)
+    return memberships[clause]
+
+def _centroid(universe: np.ndarray, mf: np.ndarray) -> np.ndarray:
+    """
+    Row-wise centroid of piecewise linear membership functions, using the same
+    trapezoid decomposition as skfuzzy's centroid defuzzification.
+    Rows with an empty membership function get a centroid of 0.
+    """
+    dx = np.diff(universe)
+    x1 = universe[:-1]
+    y1, y2 = mf[:, :-1], mf[:, 1:]
+    area = (0.5 * (y1 + y2)) @ dx
+    moment = (x1 * 0.5 * (y1 + y2) + dx * (y1 + 2 * y2) / 6) @ dx
+    return np.divide(moment, area, out=np.zeros_like(area), where=area > 0)
+
+def batch_inference(inputs: dict[str, np.ndarray], control_system: 'ctrl.ControlSystem' = None,
+                    output: str = 'need_for_action', chunk_size: int = BATCH_CHUNK_SIZE,
+                    membership_functions: dict[tuple[str, str], np.ndarray] = None, dtype=np.float64,
+                    explain: bool = False) -> np.ndarray | tuple[np.ndarray, dict[str, np.ndarray]]:
+    """
+    Vectorized Mamdani inference for many input points at once.
+
+    Mirrors what ControlSystemSimulation does for a single point (inputs clipped to the
+    universe bounds, min/max for AND/OR, max accumulation and centroid defuzzification),
+    but evaluates every rule on whole arrays. The only difference is that the aggregated
+    output is sampled on the consequent universe, without the extra cut points skfuzzy
+    inserts, which keeps the deviation from the reference well below one unit.
+
+    Parameters:
+    - inputs (dict[str, np.ndarray]): Crisp values per antecedent label, all of the same shape.
+    - control_system (ctrl.ControlSystem): The fuzzy system to evaluate (default ctrl_sys, evaluated
+      from fuzzy_table without building it).
+    - output (str): Label of the consequent to defuzzify.
+    - chunk_size (int): Number of points evaluated per chunk.
+    - membership_functions (dict[tuple[str, str], np.ndarray]): Optional replacement membership functions,
+      keyed by (variable label, term label), e.g. to evaluate calibrated parameters without a new system.
+    - dtype: Floating point type of the memberships, the aggregated output and the result.
+      np.float32 halves the memory traffic of the (chunk, len(universe)) aggregation.
+    - explain (bool): Also return the firing strength of every rule ('rule1', 'rule2', ... in the order
+      of control_system.rules) and the clip level of every consequent term ('clip_low', ...), from
+      the same pass.
+
+    Returns:
+    - np.ndarray | tuple[np.ndarray, dict[str, np.ndarray]]: Defuzzified output, with the same shape
+      as the inputs, and with explain the strengths and clip levels (0-1) in that shape too.
+    """
+    system = fuzzy_table() if control_system is None else compile_control_system(control_system)
+    antecedents = system['antecedents']
+    consequent_universe, consequent_terms, accumulation_method = system['consequents'][output]
+    membership_functions = membership_functions or {}
+    shape = np.shape(next(iter(inputs.values())))
+    flat_inputs = {label: np.ravel(np.asarray(inputs[label], dtype=dtype)) for label in antecedents}
+    n_points = int(np.prod(shape))
+
+    universe = np.asarray(consequent_universe, dtype=dtype)
+    term_mfs = {label: np.asarray(membership_functions.get((output, label), mf), dtype=dtype)
+                for label, mf in consequent_terms.items()}
+    result = np.empty(n_points, dtype=dtype)
+    rules = system['rules']
+    if explain:
+        firings = np.zeros((len(rules), n_points), dtype=dtype)
+        clips = np.zeros((len(term_mfs), n_points), dtype=dtype)
+
+    for start in range(0, n_points, chunk_size):
+        stop = min(start + chunk_size, n_points)
+
+        # Fuzzification
+        memberships = {}
+        for label, (antecedent_universe, terms) in antecedents.items():
+            value = np.clip(flat_inputs[label][start:stop], antecedent_universe.min(), antecedent_universe.max())
+            for term_label, term_mf in terms.items():
+                mf = membership_functions.get((label, term_label), term_mf)
+                memberships[(label, term_label)] = np.interp(value, antecedent_universe, mf).astype(dtype, copy=False)
+
+        # Rule activation and accumulation of the cuts per consequent term
+        cuts = {}
+        for index, (clause, and_func, or_func, consequents) in enumerate(rules):
+            firing = _rule_firing(clause, memberships, and_func, or_func)
+            if explain:
+                firings[index, start:stop] = firing
+            for consequent_label, label, weight in consequents:
+                if consequent_label != output:
+                    continue
+                activation = firing * weight
+                cuts[label] = activation if label not in cuts else accumulation_method(activation, cuts[label])
+
+        # Aggregation and defuzzification
+        aggregated = np.zeros((stop - start, len(universe)), dtype=dtype)
+        for label, cut in cuts.items():
+            np.maximum(aggregated, np.minimum(cut[:, None], term_mfs[label][None, :]), out=aggregated)
+        result[start:stop] = _centroid(universe, aggregated)
+        if explain:
+            for index, label in enumerate(term_mfs):
+                if label in cuts:
+                    clips[index, start:stop] = cuts[label]
+
+    if not explain:
+        return result.reshape(shape)
+    explanation = {f"rule{index + 1}": firing.reshape(shape) for index, firing in enumerate(firings)}
+    explanation.update({f"clip_{label}": clip.reshape(shape) for label, clip in zip(term_mfs, clips)})
+    return result.reshape(shape), explanation
+
+def compute_need_for_action(air_pollution_val: np.ndarray, population_density_val: np.ndarray,
+                            veg_cover_val: np.ndarray, dtype=np.float64, explain: bool = False,
+                            extra_inputs: dict[str, np.ndarray] = None,
+                            control_system: 'ctrl.ControlSystem' = None) -> np.ndarray | tuple[np.ndarray, dict[str, np.ndarray]]:
+    """
+    Batched counterpart of run_simulation, for already interpolated data.
+
+    Parameters:
+    - air_pollution_val (np.ndarray): Air pollution values (µg/m³).
+    - population_density_val (np.ndarray): Population density values (inhabitants/ha).
+    - veg_cover_val (np.ndarray): Vegetation cover values (%).
+    - dtype: Floating point type of the inference, see batch_inference.
+    - explain (bool): Also return the rule firing strengths and clip levels, see batch_inference.
+    - extra_inputs (dict[str, np.ndarray]): Values of further antecedents by label, e.g. the
+      interpolated 'pm10', 'no2' and 'o3' of interpolate_grid(pollutants=True).
+    - control_system (ctrl.ControlSystem): System with antecedents for all inputs (default ctrl_sys,
+      or with extra_inputs the system of build_pollutant_system).
+
+    Returns:
+    - np.ndarray | tuple[np.ndarray, dict[str, np.ndarray]]: 'need_for_action' per point, and with
+      explain the firing strengths and clip levels. Points without data (all values -1) get 0.
+    """
+    air_pollution_val = np.asarray(air_pollution_val, dtype=dtype)
+    population_density_val = np.asarray(population_density_val, dtype=dtype)
+    veg_cover_val = np.asarray(veg_cover_val, dtype=dtype)
+
+    if control_system is None and extra_inputs:
+        control_system = build_pollutant_system()['ctrl_sys']
+    result = batch_inference({
+        'air_pollution': air_pollution_val,
+        'population_density': population_density_val,
+        'veg_cover': veg_cover_val,
+        **(extra_inputs or {})
+    }, control_system=control_system, dtype=dtype, explain=explain)
+    need_action, explanation = result if explain else (result, {})
+    missing = (air_pollution_val == -1) & (population_density_val == -1) & (veg_cover_val == -1)
+    need_action[missing] = 0.0
+    for raster in explanation.values():
+        raster[missing] = 0.0
+    return (need_action, explanation) if explain else need_action
+
+def get_grid_locations(map_obj: Map) -> np.ndarray:
+    """
+    Real coordinates of the heatmap cell centres, laid out like the heatmap in main.py
+    (rows follow latitude, columns follow longitude).
+
+    Parameters:
+    - map_obj (Map): The map defining the bounds and grid size.
+
+    Returns:
+    - np.ndarray: Array of shape (size, size, 2) holding (latitude, longitude) per cell.
+    """
+    fractions = (np.arange(map_obj.size) + 0.5) / map_obj.size
+    latitudes = map_obj.min_lat + fractions * (map_obj.max_lat - map_obj.min_lat)
+    longitudes = map_obj.min_lon + fractions * (map_obj.max_lon - map_obj.min_lon)
+    lat_grid, lon_grid = np.meshgrid(latitudes, longitudes, indexing='ij')
+    return np.stack([lat_grid, lon_grid], axis=-1)
+
+def interpolate_grid(map_obj: Map, dtype=np.float64, pollutants: bool = False) -> tuple[np.ndarray, ...]:
+    """
+    Interpolates the station data for every heatmap cell in one batched query.
+
+    Parameters:
+    - map_obj (Map): The map object containing stations and data.
+    - dtype: Floating point type of the interpolated grids.
+    - pollutants (bool): Also interpolate PM10, NO2 and O3, in the same pass (see Map.get_data_batch).
+
+    Returns:
+    - tuple[np.ndarray, ...]: (air_pollution, population_density, veg_cover) grids, and with
+      pollutants a fourth item: the dict of 'pm10', 'no2' and 'o3' grids.
+    """
+    locations = get_grid_locations(map_obj).reshape(-1, 2)
+    data = map_obj.get_data_batch(locations, dtype=dtype, pollutants=pollutants).reshape(map_obj.size, map_obj.size, -1)
+    if not pollutants:
+        return data[..., 0], data[..., 1], data[..., 2]
+    return data[..., 0], data[..., 1], data[..., 2], {name: data[..., 2 + index] for index, name in enumerate(POLLUTANTS[1:], 1)}
+
+def compute_heatmap(map_obj: Map, dtype=np.float64, explain: bool = False,
+                    pollutants: bool = False) -> np.ndarray | tuple[np.ndarray, dict[str, np.ndarray]]:
+    """
+    Batched equivalent of calling run_simulation for every cell of the map grid.
+
+    Parameters:
+    - map_obj (Map): The map object containing stations and data.
+    - dtype: Floating point type of interpolation, inference and the heatmap (np.float64 or np.float32).
+    - explain (bool): Also return the explanation rasters: per rule its firing strength and per
+      consequent term its clip level, quantized to uint8 (see quantize_strengths).
+    - pollutants (bool): Also use the stations' PM10, NO2 and O3 readings (see build_pollutant_system).
+
+    Returns:
+    - np.ndarray | tuple[np.ndarray, dict[str, np.ndarray]]: The (size, size) 'need_for_action'
+      heatmap, and with explain the (size, size) uint8 explanation rasters by name.
+    """
+    if pollutants:
+        *grids, extra_inputs = interpolate_grid(map_obj, dtype=dtype, pollutants=True)
+        result = compute_need_for_action(*grids, dtype=dtype, explain=explain, extra_inputs=extra_inputs)
+    else:
+        result = compute_need_for_action(*interpolate_grid(map_obj, dtype=dtype), dtype=dtype, explain=explain)
+    if not explain:
+        return result
+    heatmap, explanation = result
+    return heatmap, quantize_strengths(explanation)
+
+STRENGTH_LEVELS = 255
+"""Firing strengths and clip levels (0-1) are stored as uint8 steps of 1/STRENGTH_LEVELS."""
+
+def quantize_strengths(explanation: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """
+    Quantizes firing strengths and clip levels to uint8 rasters, within 1/510 of the exact values.
+    """
+    return {name: np.rint(np.clip(values, 0, 1) * STRENGTH_LEVELS).astype(np.uint8) for name, values in explanation.items()}
+
+def explain_cell(rasters: dict[str, np.ndarray], row: int, column: int) -> dict[str, float]:
+    """
+    Why a heatmap cell scores as it does: the firing strength of every rule and the clip level of
+    every consequent term at the cell, read from the rasters of compute_heatmap(explain=True).
+    """
+    return {name: float(raster[row, column]) / STRENGTH_LEVELS for name, raster in rasters.items()}
+
+def generate_random_stations(n_stations: int, map_size: int, max_ap: int = MAX_AP, max_pd: int = MAX_PD, max_vc: int = MAX_VC,
+                             seed=None, origin: tuple[float, float] = (51.4, -0.2), extent: tuple[float, float] = (0.2, 0.3)) -> np.ndarray[Station]:
     """
     Generates an array of n_stations stations, placed randomly (but all with unique locations) on the map with random data.
+    The unique grid cells come from generate_unique_random_locations, and each station sits at the centre of its cell
+    of a map_size x map_size grid over the bounding box given by origin and extent.
 
     Parameters:
         n_stations:
@@ -150,6 +520,10 @@ def generate_random_stations(n_stations: int, map_size: int, max_ap: int = MAX_A
             Maximum value for randomly drawn population density data. Should be less than 151.
         max_vc:
             Maximum value for randomly drawn vegetation cover data. Should be less than 101.
+        seed:
+            Seed (or np.random.Generator) for reproducible stations
+        origin, extent:
+            (latitude, longitude) of the south-west corner and size of the bounding box in degrees
     
     Returns:
         An np.array of stations
@@ -158,24 +532,24 @@ def generate_random_stations(n_stations: int, map_size: int, max_ap: int = MAX_A
     assert max_pd <= MAX_PD, f"max_pd can not be >{MAX_PD}"
     assert max_vc <= MAX_VC, f"max_vc can not be >{MAX_VC}"
 
-    # Random values for stations
-    random_locations = generate_unique_random_locations(n_locations=n_stations, map_size=map_size)
-    random_aq = np.random.randint(low=0, high=max_ap, size=n_stations)
-    random_pd = np.random.randint(low=0, high=max_pd, size=n_stations)
-    random_vc = np.random.randint(low=0, high=max_vc, size=n_stations)
-    # Initiate random stations
-    stations = [Station(random_locations[i], random_aq[i], random_pd[i], random_vc[i]) for i in range(n_stations)]
+    rng = np.random.default_rng(seed)
+    cells = np.array(generate_unique_random_locations(n_locations=n_stations, map_size=map_size, seed=rng)).reshape(-1, 2)
+    # Cell (x, y) is heatmap column x (longitude) and row y (latitude)
+    latitudes = origin[0] + (cells[:, 1] + 0.5) / map_size * extent[0]
+    longitudes = origin[1] + (cells[:, 0] + 0.5) / map_size * extent[1]
+    data = np.column_stack([rng.integers(0, max_ap, n_stations), rng.integers(0, max_pd, n_stations), rng.integers(0, max_vc, n_stations)])
+    stations = [Station.from_values(latitude, longitude, *values) for latitude, longitude, values in zip(latitudes, longitudes, data)]
     return np.array(stations)
 
-def generate_unique_random_locations(n_locations: int, map_size: int) -> list[tuple[int, int]]:
+def generate_unique_random_locations(n_locations: int, map_size: int, seed=None) -> list[tuple[int, int]]:
         """
-        Generates a list of n_locations unique locations where x,y < map_size
+        Generates a list of n_locations unique locations where x,y < map_size.
+        seed can be an int or an np.random.Generator, e.g. the one drawing the station data.
         """
         assert n_locations <= map_size**2, f"The map is too small to have this many unique locations!\n({n_locations=}, {map_size=})"
-        unique_locations = set()
-        while len(unique_locations) < n_locations:
-            unique_locations.add((np.random.randint(0, map_size), np.random.randint(0, map_size)))
-        return list(unique_locations)
+        # Sample linear cell indices without replacement instead of rejecting duplicates one by one
+        linear = np.random.default_rng(seed).choice(map_size**2, size=n_locations, replace=False)
+        return [(int(x), int(y)) for x, y in zip(*np.divmod(linear, map_size))]
 
 #Fuzzy labels for hover
 
@@ -183,6 +557,8 @@ def get_air_pollution_label(value):
     """
     Computes the fuzzy label for air pollution value.
     """
+    from skfuzzy import interp_membership
+    air_pollution = build_fuzzy_system()['air_pollution']
     if value < 0 or value > MAX_AP:
         return "Undefined"
 
@@ -203,6 +579,8 @@ def get_population_density_label(value):
     """
     Computes the fuzzy label for population density value.
     """
+    from skfuzzy import interp_membership
+    population_density = build_fuzzy_system()['population_density']
     if value < 0 or value > MAX_PD:
         return "Undefined"
 
@@ -233,6 +611,8 @@ def get_veg_cover_label(value):
     """
     Computes the fuzzy label for vegetation cover value.
     """
+    from skfuzzy import interp_membership
+    veg_cover = build_fuzzy_system()['veg_cover']
     if value < 0 or value > MAX_VC:
         return "Undefined"
 
@@ -253,6 +633,8 @@ def get_need_for_action_label(value):
     """
     Computes the fuzzy label for need for action value.
     """
+    from skfuzzy import interp_membership
+    need_for_action = build_fuzzy_system()['need_for_action']
     if value < 0 or value > 100:
         return "Undefined"
 
@@ -271,6 +653,43 @@ def get_need_for_action_label(value):
 
     plt.show()
 
+LABEL_LIMITS = {
+    'air_pollution': MAX_AP,
+    'population_density': MAX_PD,
+    'veg_cover': MAX_VC,
+    'need_for_action': 100
+}
+"""Fuzzy variables with a hover label, and the largest value the label functions accept."""
+UNDEFINED_CODE = 255
+"""Label raster code of the 'Undefined' label."""
+
+def label_names(variable: str) -> list[str]:
+    """
+    Label names of a variable, indexed by their label raster code ('very_low' -> 'Very Low').
+    """
+    return [label.replace('_', ' ').title() for label in FUZZY_TERMS[variable]]
+
+def label_raster(values: np.ndarray, variable: str) -> np.ndarray:
+    """
+    Vectorized get_*_label: the code of the most likely label of every value, as uint8.
+    Values out of range or without any membership get UNDEFINED_CODE.
+
+    Parameters:
+    - values (np.ndarray): Crisp values of the variable, any shape.
+    - variable (str): One of LABEL_LIMITS.
+
+    Returns:
+    - np.ndarray: uint8 codes with the shape of values, indexing label_names(variable).
+    """
+    table, max_value = fuzzy_table(), LABEL_LIMITS[variable]
+    universe, terms = {**table['antecedents'], **table['consequents']}[variable][:2]
+    values = np.asarray(values)
+    # Like interp_membership, values beyond the universe have no membership
+    degrees = np.stack([np.interp(values, universe, mf, left=0, right=0) for mf in terms.values()])
+    codes = np.argmax(degrees, axis=0).astype(np.uint8)  # First maximum, like max() over the degrees dict
+    codes[(values < 0) | (values > max_value) | (degrees.max(axis=0) == 0)] = UNDEFINED_CODE
+    return codes
+
 def get_recommendation(air_quality_label: str, population_density_label: str, veg_cover_label: str, need_for_action_label: str) -> str:
     """
     Provides a recommendation string based on the fuzzy labels for air pollution,
@@ -311,3 +730,57 @@ def get_recommendation(air_quality_label: str, population_density_label: str, ve
                 "Maintain your approaches, continue monitoring air quality and population density,<br> "
                 "and preserve or slightly enhance green spaces as needed.")
 
+RECOMMENDATION_VARIABLES = ('air_pollution', 'population_density', 'veg_cover', 'need_for_action')
+"""Label inputs of get_recommendation, in its argument order."""
+
+@functools.cache
+def recommendation_table() -> tuple[tuple[str, ...], np.ndarray]:
+    """
+    Interned get_recommendation texts and a lookup table from label codes to text codes.
+
+    get_recommendation only depends on four labels, so it is evaluated once for every label
+    combination ('Undefined' included) and each distinct text is stored once.
+
+    Returns:
+    - tuple[tuple[str, ...], np.ndarray]: The distinct recommendation texts, and a uint8 table of
+      shape (n_labels + 1) per RECOMMENDATION_VARIABLES, indexed by label codes with the last index
+      of every axis standing for 'Undefined', holding the index of the text.
+    """
+    names = [label_names(variable) + ['Undefined'] for variable in RECOMMENDATION_VARIABLES]
+    table = np.empty([len(labels) for labels in names], dtype=np.uint8)
+    texts = {}
+    for index in np.ndindex(table.shape):
+        text = get_recommendation(*(labels[code] for labels, code in zip(names, index)))
+        table[index] = texts.setdefault(text, len(texts))
+    return tuple(texts), table
+
+def recommendation_raster(air_pollution_labels: np.ndarray, population_density_labels: np.ndarray,
+                          veg_cover_labels: np.ndarray, need_for_action_labels: np.ndarray) -> np.ndarray:
+    """
+    Vectorized get_recommendation on label rasters (see label_raster).
+
+    Returns:
+    - np.ndarray: uint8 codes with the shape of the rasters, indexing recommendation_table()[0].
+    """
+    _, table = recommendation_table()
+    # UNDEFINED_CODE maps onto the last index of each axis
+    indices = [np.minimum(labels, size - 1) for labels, size in
+               zip((air_pollution_labels, population_density_labels, veg_cover_labels, need_for_action_labels), table.shape)]
+    return table[tuple(indices)]
+
+def compute_label_layers(map_obj: Map, heatmap: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    Labels and recommendation of every heatmap cell, as uint8 rasters.
+
+    Parameters:
+    - map_obj (Map): The map the heatmap was computed for.
+    - heatmap (np.ndarray): Its (size, size) 'need_for_action' heatmap.
+
+    Returns:
+    - dict[str, np.ndarray]: A label raster per RECOMMENDATION_VARIABLES (codes into label_names) and
+      'recommendation' (codes into recommendation_table()[0]), all of shape (size, size).
+    """
+    values = (*interpolate_grid(map_obj), heatmap)
+    layers = {variable: label_raster(value, variable) for variable, value in zip(RECOMMENDATION_VARIABLES, values)}
+    layers['recommendation'] = recommendation_raster(*(layers[variable] for variable in RECOMMENDATION_VARIABLES))
+    return layers
@@ -0,0 +1,131 @@
+import numpy as np
+from scipy import ndimage
+from mapApi import Map
+from heatmap_utils_api import (get_grid_locations,
+    get_air_pollution_label,
+    get_population_density_label,
+    get_veg_cover_label,
+    get_need_for_action_label,
+    get_recommendation)
+
+
+def find_hotspots(heatmap: np.ndarray, k: int = 10, min_separation: float = 5.0, threshold: float = None) -> list[dict]:
+    """
+    Finds the k highest local maxima of the heatmap that are at least min_separation cells apart.
+
+    Local maxima are found with a 3x3 maximum filter, the best candidates are picked with a
+    partial selection (argpartition) instead of a full sort, and non-maximum suppression then
+    discards candidates too close to a higher ranked hotspot.
+
+    Parameters:
+    - heatmap (np.ndarray): The 'need_for_action' grid.
+    - k (int): Maximum number of hotspots to return.
+    - min_separation (float): Minimum distance in cells between two hotspots.
+    - threshold (float): Ignore maxima below this value.
+
+    Returns:
+    - list[dict]: Hotspots sorted by decreasing score, with 'row', 'column' and 'score'.
+    """
+    if k <= 0:
+        return []
+    is_peak = heatmap == ndimage.maximum_filter(heatmap, size=3, mode='nearest')
+    if threshold is not None:
+        is_peak &= heatmap >= threshold
+    peak_rows, peak_cols = np.nonzero(is_peak)
+    peak_scores = heatmap[peak_rows, peak_cols]
+
+    # Plateaus produce many equal peaks, so keep drawing more candidates until k survive the suppression
+    n_candidates = min(len(peak_scores), 4 * k)
+    while True:
+        if n_candidates < len(peak_scores):
+            top = np.argpartition(-peak_scores, n_candidates - 1)[:n_candidates]
+        else:
+            top = np.arange(len(peak_scores))
+        top = top[np.argsort(-peak_scores[top], kind='stable')]
+
+        hotspots = []
+        for index in top:
+            row, col = peak_rows[index], peak_cols[index]
+            if all((row - h['row']) ** 2 + (col - h['column']) ** 2 >= min_separation ** 2 for h in hotspots):
+                hotspots.append({'row': int(row), 'column': int(col), 'score': float(peak_scores[index])})
+                if len(hotspots) == k:
+                    return hotspots
+        if n_candidates >= len(peak_scores):
+            return hotspots
+        n_candidates = min(len(peak_scores), max(1, 4 * n_candidates))
+
+
+def label_zones(heatmap: np.ndarray, threshold: float, min_area: int = 1) -> tuple[np.ndarray, list[dict]]:
+    """
+    Labels the connected regions of the heatmap at or above threshold.
+
+    Parameters:
+    - heatmap (np.ndarray): The 'need_for_action' grid.
+    - threshold (float): Cells at or above this value belong to a zone.
+    - min_area (int): Zones with fewer cells are dropped (their cells get label 0).
+
+    Returns:
+    - tuple[np.ndarray, list[dict]]: The label grid (0 outside zones) and one dict per zone with
+      'zone', 'area' (cells), 'mean_score', 'max_score' and the 'row'/'column' of its centroid,
+      sorted by decreasing mean score.
+    """
+    labels, n_zones = ndimage.label(heatmap >= threshold)
+    flat_labels = labels.ravel()
+    area = np.bincount(flat_labels, minlength=n_zones + 1)
+    score_sum = np.bincount(flat_labels, weights=heatmap.ravel(), minlength=n_zones + 1)
+    max_score = ndimage.maximum(heatmap, labels, index=np.arange(1, n_zones + 1))
+    centroids = ndimage.center_of_mass(np.ones_like(heatmap), labels, index=np.arange(1, n_zones + 1))
+
+    keep = np.zeros(n_zones + 1, dtype=bool)
+    keep[1:] = area[1:] >= min_area
+    labels[~keep[labels]] = 0
+
+    zones = [{
+        'zone': zone,
+        'area': int(area[zone]),
+        'mean_score': float(score_sum[zone] / area[zone]),
+        'max_score': float(max_score[zone - 1]),
+        'row': float(centroids[zone - 1][0]),
+        'column': float(centroids[zone - 1][1])
+    } for zone in range(1, n_zones + 1) if keep[zone]]
+    zones.sort(key=lambda zone: zone['mean_score'], reverse=True)
+    return labels, zones
+
+
+def describe_hotspots(hotspots: list[dict], map_obj: Map, zone_labels: np.ndarray = None) -> list[dict]:
+    """
+    Adds real coordinates, interpolated data, fuzzy labels and a recommendation to each hotspot.
+
+    Parameters:
+    - hotspots (list[dict]): Hotspots as returned by find_hotspots.
+    - map_obj (Map): The map the heatmap was computed on.
+    - zone_labels (np.ndarray): Optional label grid from label_zones, to tag each hotspot with its zone.
+
+    Returns:
+    - list[dict]: The hotspots, extended in place.
+    """
+    if not hotspots:
+        return hotspots
+    grid_locations = get_grid_locations(map_obj)
+    locations = np.array([grid_locations[h['row'], h['column']] for h in hotspots])
+    data = map_obj.get_data_batch(locations)
+
+    for hotspot, (latitude, longitude), (aq, pd, vc) in zip(hotspots, locations, data):
+        hotspot.update({
+            'latitude': float(latitude),
+            'longitude': float(longitude),
+            'air_quality': float(aq),
+            'population_density': float(pd),
+            'veg_cover': float(vc),
+            'air_quality_label': get_air_pollution_label(aq),
+            'population_density_label': get_population_density_label(pd),
+            'veg_cover_label': get_veg_cover_label(vc),
+            'need_for_action_label': get_need_for_action_label(hotspot['score'])
+        })
+        hotspot['recommendation'] = get_recommendation(hotspot['air_quality_label'],
+                                                       hotspot['population_density_label'],
+                                                       hotspot['veg_cover_label'],
+                                                       hotspot['need_for_action_label'])
+        if zone_labels is not None:
+            hotspot['zone'] = int(zone_labels[hotspot['row'], hotspot['column']])
+    return hotspots
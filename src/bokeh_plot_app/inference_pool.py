@@ -0,0 +1,145 @@
+import copy
+import logging
+import os
+import queue
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from mapApi import Map
+from heatmap_utils_api import batch_inference, build_fuzzy_system, get_grid_locations
+from checkpoint import run_checkpointed
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+ROWS_PER_TASK = 16
+"""Number of heatmap rows handed to a worker thread at once."""
+
+
+class InferenceSession:
+    def __init__(self, control_system: 'ctrl.ControlSystem' = None) -> None:
+        """
+        A reusable fuzzy inference session, owned by one thread at a time.
+
+        skfuzzy keeps the state of every simulation on the shared rule and term objects of the
+        control system, so two simulations of the same system must not run concurrently. Each
+        session therefore works on a private copy of the control system, and its simulation
+        object is built once and reused for every query.
+
+        Parameters:
+        - control_system (ctrl.ControlSystem): The fuzzy system to copy (default ctrl_sys).
+        """
+        from skfuzzy import control as ctrl
+
+        if control_system is None:
+            control_system = build_fuzzy_system()['ctrl_sys']
+        self.control_system = copy.deepcopy(control_system)
+        self.simulation = ctrl.ControlSystemSimulation(self.control_system)
+        self.n_queries = 0
+
+    def compute(self, air_pollution_val: float, population_density_val: float, veg_cover_val: float) -> float:
+        """
+        Computes 'need_for_action' for a single point with the session's reference simulation.
+        Points without data (all values -1) get 0, like run_simulation.
+        """
+        self.n_queries += 1
+        if air_pollution_val == -1 and population_density_val == -1 and veg_cover_val == -1:
+            return 0.0
+        self.simulation.input['veg_cover'] = veg_cover_val
+        self.simulation.input['air_pollution'] = air_pollution_val
+        self.simulation.input['population_density'] = population_density_val
+        self.simulation.compute()
+        return self.simulation.output.get('need_for_action', 0.0)
+
+    def compute_batch(self, air_pollution_val: np.ndarray, population_density_val: np.ndarray,
+                      veg_cover_val: np.ndarray) -> np.ndarray:
+        """
+        Computes 'need_for_action' for a batch of points with the vectorized engine.
+        The heavy lifting happens in NumPy, which releases the GIL, so batches from several
+        threads run in parallel.
+        """
+        self.n_queries += np.size(air_pollution_val)
+        need_action = batch_inference({
+            'air_pollution': air_pollution_val,
+            'population_density': population_density_val,
+            'veg_cover': veg_cover_val
+        }, control_system=self.control_system)
+        missing = (np.asarray(air_pollution_val) == -1) & (np.asarray(population_density_val) == -1) & (np.asarray(veg_cover_val) == -1)
+        need_action[missing] = 0.0
+        return need_action
+
+
+class SessionPool:
+    def __init__(self, size: int = None, control_system: 'ctrl.ControlSystem' = None) -> None:
+        """
+        A fixed pool of inference sessions, one per worker thread.
+
+        Parameters:
+        - size (int): Number of sessions (default: number of CPUs).
+        - control_system (ctrl.ControlSystem): The fuzzy system used by all sessions (default ctrl_sys).
+        """
+        self.size = size or os.cpu_count() or 1
+        self._sessions = queue.LifoQueue()
+        for _ in range(self.size):
+            self._sessions.put(InferenceSession(control_system))
+
+    def __str__(self) -> str:
+        return f"SessionPool with {self._sessions.qsize()}/{self.size} sessions available."
+
+    @contextmanager
+    def session(self, timeout: float = None):
+        """
+        Checks out a session for the duration of a with-block, and returns it to the pool afterwards.
+        Blocks until a session is available.
+        """
+        session = self._sessions.get(timeout=timeout)
+        try:
+            yield session
+        finally:
+            self._sessions.put(session)
+
+
+def compute_heatmap_threaded(map_obj: Map, pool: SessionPool = None, rows_per_task: int = ROWS_PER_TASK,
+                             reference: bool = False, checkpoint: str = None) -> np.ndarray:
+    """
+    Computes the heatmap with a thread pool, each thread working on bands of rows with a pooled session.
+
+    Parameters:
+    - map_obj (Map): The map object containing stations and data.
+    - pool (SessionPool): Sessions to use. A pool with one session per CPU is created if not given.
+    - rows_per_task (int): Number of rows per task.
+    - reference (bool): Evaluate every cell with the sessions' skfuzzy simulation instead of the
+      vectorized engine. Much slower, but identical to run_simulation.
+    - checkpoint (str): Job key (e.g. the heatmap cache key). When given, every band is persisted
+      as it finishes and a rerun with the same key skips the finished bands, see checkpoint.py.
+
+    Returns:
+    - np.ndarray: The (size, size) 'need_for_action' heatmap, laid out like in main.py.
+    """
+    pool = pool or SessionPool()
+    grid_locations = get_grid_locations(map_obj)
+
+    def compute_band(start: int, stop: int) -> np.ndarray:
+        data = map_obj.get_data_batch(grid_locations[start:stop].reshape(-1, 2))
+        with pool.session() as session:
+            if reference:
+                band = [session.compute(*values) for values in data]
+            else:
+                band = session.compute_batch(data[:, 0], data[:, 1], data[:, 2])
+        return np.reshape(band, (stop - start, map_obj.size))
+
+    if checkpoint is not None:
+        return run_checkpointed(checkpoint, (map_obj.size, map_obj.size), compute_band,
+                                rows_per_band=rows_per_task, max_workers=pool.size)
+
+    heatmap = np.empty((map_obj.size, map_obj.size))
+
+    def process_band(start: int) -> None:
+        stop = min(start + rows_per_task, map_obj.size)
+        heatmap[start:stop] = compute_band(start, stop)
+
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        # list() propagates exceptions raised in the worker threads
+        list(executor.map(process_band, range(0, map_obj.size, rows_per_task)))
+
+    return heatmap
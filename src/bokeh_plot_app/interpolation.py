@@ -0,0 +1,318 @@
+import logging
+import time
+import numpy as np
+from abc import ABC, abstractmethod
+from mapApi import Map, EARTH_RADIUS, to_unit_vectors
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+CHUNK_SIZE = 16384
+"""Number of locations whose weights are computed at once. Bounds the (chunk, k + 1, k + 1) temporaries."""
+
+
+class Interpolator(ABC):
+    clamp = False
+    """Whether Map.get_data_batch clips the result to the range of the stations used at each location,
+    for the backends whose weights can be negative and overshoot on noisy data."""
+
+    def __init__(self, map_obj: Map) -> None:
+        """
+        Base class of the interpolation backends of Map (see INTERPOLATORS and Map.interpolation).
+
+        Every backend is linear in the station data: it computes, per location, the stations it
+        uses and their weights. These only depend on the station layout, so they can be reused for
+        any station data, and the backends cache whatever they precompute for the layout. Map
+        discards its backend when a station is added.
+        """
+        self.map = map_obj
+
+    def __str__(self) -> str:
+        return f"{type(self).__name__} over {len(self.map.coordinates)} stations"
+
+    @abstractmethod
+    def get_weights(self, locations: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Stations and weights interpolating many locations.
+
+        Parameters:
+        - locations (np.ndarray): Array of shape (n, 2) with (latitude, longitude) rows in real coordinates.
+
+        Returns:
+        - tuple[np.ndarray, np.ndarray]: Station indices and weights, both of shape (n, k).
+        """
+
+
+class IDW(Interpolator):
+    def __init__(self, map_obj: Map, n_neighbors: int = 3) -> None:
+        """
+        Inverse distance weighting of the n nearest stations, the original interpolation of get_data.
+        """
+        super().__init__(map_obj)
+        self.n_neighbors = n_neighbors
+
+    def get_weights(self, locations: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        return self.map.idw_weights(locations, self.n_neighbors)
+
+
+class Barycentric(Interpolator):
+    def __init__(self, map_obj: Map) -> None:
+        """
+        Linear interpolation on the Delaunay triangulation of the stations, as in the offline app.
+        Locations outside the convex hull of the stations fall back to IDW.
+        """
+        from scipy.spatial import Delaunay, QhullError
+
+        super().__init__(map_obj)
+        # Triangulated on the plane tangent to the sphere at the centre of the stations
+        centre = map_obj.points.mean(axis=0)
+        centre /= np.linalg.norm(centre)
+        east = np.cross([0.0, 0.0, 1.0], centre)
+        east /= np.linalg.norm(east)
+        self._basis = np.stack([east, np.cross(centre, east)], axis=1) * EARTH_RADIUS
+        try:
+            self.triangulation = Delaunay(map_obj.points @ self._basis)
+        except QhullError as e:
+            logging.warning(f"Stations cannot be triangulated, falling back to IDW: {str(e).splitlines()[0]}")
+            self.triangulation = None
+
+    def get_weights(self, locations: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        locations = np.asarray(locations, dtype=float).reshape(-1, 2)
+        indices, weights = self.map.idw_weights(locations, 3)
+        if self.triangulation is None:
+            return indices, weights
+
+        planar = to_unit_vectors(locations[:, 0], locations[:, 1]) @ self._basis
+        simplices = self.triangulation.find_simplex(planar)
+        inside = simplices >= 0
+        transform = self.triangulation.transform[simplices[inside]]
+        coordinates = np.einsum('nij,nj->ni', transform[:, :2], planar[inside] - transform[:, 2])
+        weights[inside] = np.column_stack([coordinates, 1 - coordinates.sum(axis=1)])
+        indices[inside] = self.triangulation.simplices[simplices[inside]]
+        return indices, weights
+
+
+class LocalLinearSystem(Interpolator):
+    def __init__(self, map_obj: Map, n_neighbors: int = 12, scale: float = None, smoothing: float = 0.0,
+                 clamp: bool = True) -> None:
+        """
+        Base of the neighbourhood-limited backends solving, for the k nearest stations of a location,
+
+            [K + sI  1] [w]   [k_q]
+            [1'      0] [m] = [ 1 ]
+
+        with K the kernel between the stations, k_q between the stations and the location and s the
+        smoothing. The kernels are written in their conditionally positive definite form (e.g. minus
+        the multiquadric), so that a positive smoothing regularizes the fit like the nugget of
+        kriging: the stations are no longer reproduced exactly, and the weights of a noisy
+        neighbourhood stop oscillating between large positive and negative values. The
+        inverse of the left-hand side only depends on the neighbourhood, so it is computed once per
+        distinct set of neighbours and cached: neighbouring grid cells mostly share their stations,
+        and a grid over thousands of stations needs far fewer factorizations than cells.
+
+        Parameters:
+        - map_obj (Map): The map.
+        - n_neighbors (int): Size of the neighbourhoods.
+        - scale (float): Length scale of the kernel in metres (default: median distance between
+          neighbouring stations).
+        - smoothing (float): Added to the diagonal of K, in units of the kernel. 0 interpolates exactly.
+        - clamp (bool): Clip the interpolated values to the range of the k stations (see Interpolator.clamp).
+        """
+        assert smoothing >= 0, "smoothing must not be negative"
+        super().__init__(map_obj)
+        self.n_neighbors = min(n_neighbors, len(map_obj.points))
+        self.positions = map_obj.points * EARTH_RADIUS  # Chord distances, equal to arc lengths at city scale
+        if scale is None:
+            spacing, _ = map_obj.query_neighbors(map_obj.coordinates, 2)
+            scale = float(np.median(spacing[:, -1])) or 1.0
+        self.scale = scale
+        self.smoothing = smoothing
+        self.clamp = clamp
+        self.factorizations = {}  # Sorted neighbour indices (as bytes) -> inverse of the system
+        self.hits = 0
+        self.misses = 0
+
+    @abstractmethod
+    def kernel(self, distances: np.ndarray) -> np.ndarray:
+        """
+        Kernel of the system, in its conditionally positive definite form, for distances in metres.
+        """
+
+    def _invert(self, neighborhoods: np.ndarray) -> np.ndarray:
+        k = neighborhoods.shape[1]
+        positions = self.positions[neighborhoods]
+        systems = np.ones((len(neighborhoods), k + 1, k + 1))
+        systems[:, :k, :k] = self.kernel(np.linalg.norm(positions[:, :, None] - positions[:, None, :], axis=-1))
+        systems[:, np.arange(k), np.arange(k)] += self.smoothing
+        systems[:, k, k] = 0.0
+        try:
+            return np.linalg.inv(systems)
+        except np.linalg.LinAlgError:
+            # Coincident stations make a system singular; the pseudo-inverse splits their weight
+            return np.linalg.pinv(systems)
+
+    def get_weights(self, locations: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        locations = np.asarray(locations, dtype=float).reshape(-1, 2)
+        _, indices = self.map.query_neighbors(locations, self.n_neighbors)
+        indices = np.sort(indices, axis=1)  # One cache entry per set of neighbours, whatever their order
+        weights = np.empty(indices.shape)
+        query_positions = to_unit_vectors(locations[:, 0], locations[:, 1]) * EARTH_RADIUS
+
+        for start in range(0, len(locations), CHUNK_SIZE):
+            stop = min(start + CHUNK_SIZE, len(locations))
+            chunk = indices[start:stop]
+            # Grid locations come in rows, so neighbouring locations share their neighbourhood:
+            # look up one factorization per run of equal neighbourhoods instead of sorting them all
+            changed = np.concatenate([[True], np.any(chunk[1:] != chunk[:-1], axis=1)])
+            run_starts, run_of_location = np.flatnonzero(changed), np.cumsum(changed) - 1
+            keys = [chunk[run_start].tobytes() for run_start in run_starts]
+            missing = {key: run_start for key, run_start in zip(keys, run_starts) if key not in self.factorizations}
+            self.misses += len(missing)
+            self.hits += len(keys) - len(missing)
+            if missing:
+                for key, factorization in zip(missing, self._invert(chunk[list(missing.values())])):
+                    self.factorizations[key] = factorization
+            factorizations = np.stack([self.factorizations[key] for key in keys])
+
+            right_hand_side = np.ones((stop - start, chunk.shape[1] + 1))
+            right_hand_side[:, :-1] = self.kernel(np.linalg.norm(self.positions[chunk] - query_positions[start:stop, None], axis=-1))
+            weights[start:stop] = np.einsum('nij,nj->ni', factorizations[run_of_location, :-1], right_hand_side)
+        return indices, weights
+
+
+class LocalRBF(LocalLinearSystem):
+    KERNELS = {
+        'multiquadric': lambda r: -np.sqrt(1 + r ** 2),
+        'linear': lambda r: -r,
+        'gaussian': lambda r: np.exp(-r ** 2)
+    }
+
+    def __init__(self, map_obj: Map, n_neighbors: int = 12, kernel: str = 'multiquadric', scale: float = None,
+                 smoothing: float = 0.1, clamp: bool = True) -> None:
+        """
+        Radial basis function interpolation with a constant term, fitted to the k nearest stations of
+        every location instead of all stations like the legacy scipy Rbf. Exact interpolation
+        (smoothing 0) overshoots on noisy station data, hence the default smoothing and clamp.
+
+        Parameters:
+        - kernel (str): One of KERNELS, applied to distances divided by the scale.
+        """
+        assert kernel in self.KERNELS, f"kernel must be one of {tuple(self.KERNELS)}, not {kernel!r}"
+        super().__init__(map_obj, n_neighbors, scale, smoothing, clamp)
+        self._kernel = self.KERNELS[kernel]
+
+    def kernel(self, distances: np.ndarray) -> np.ndarray:
+        return self._kernel(distances / self.scale)
+
+
+class LocalKriging(LocalLinearSystem):
+    def __init__(self, map_obj: Map, n_neighbors: int = 12, variogram_range: float = None, nugget: float = 0.0,
+                 clamp: bool = True) -> None:
+        """
+        Ordinary kriging with an exponential variogram over the k nearest stations of every location.
+
+        Parameters:
+        - variogram_range (float): Practical range of the variogram in metres, where the correlation
+          drops to 5% (default: five times the median distance between neighbouring stations).
+        - nugget (float): Nugget as a fraction of the sill. Above 0 the stations are smoothed
+          instead of reproduced exactly.
+        """
+        super().__init__(map_obj, n_neighbors, clamp=clamp)
+        self.scale = variogram_range or 5 * self.scale
+        self.nugget = nugget
+
+    def kernel(self, distances: np.ndarray) -> np.ndarray:
+        variogram = self.nugget + (1 - self.nugget) * (1 - np.exp(-3 * distances / self.scale))
+        return np.where(distances > 0, -variogram, 0.0)
+
+
+INTERPOLATORS = {
+    'idw': IDW,
+    'barycentric': Barycentric,
+    'rbf': LocalRBF,
+    'kriging': LocalKriging
+}
+"""Interpolation backends by name, selected with Map.set_interpolation: 'idw' inverse distance weighting
+of the nearest stations, 'barycentric' linear on the Delaunay triangulation, 'rbf' local radial basis
+functions and 'kriging' local ordinary kriging. Compare them with benchmark_interpolators (this
+module's __main__)."""
+
+
+def _smooth_field(coordinates: np.ndarray, origin: np.ndarray, extent: np.ndarray) -> np.ndarray:
+    # Known smooth test field over the three data channels, on the 0-70 / 0-150 / 0-100 scales
+    u, v = ((coordinates - origin) / extent).T
+    return np.column_stack([35 + 30 * np.sin(3 * u) * np.cos(2 * v), 75 + 70 * np.cos(2 * u + v) * u,
+                            50 + 45 * np.sin(2 * v - u)])
+
+
+FIELD_SCALES = np.array([70.0, 150.0, 100.0])
+
+
+def benchmark_interpolators(n_stations: int = 1000, size: int = 500, seed=0, methods: dict = None, noise: float = 0.0) -> dict:
+    """
+    Compares the backends on stations sampling a known smooth field: the error against the field
+    on the heatmap grid, the share of cells outside the range of the station values, the time of
+    a first grid evaluation (including the factorizations) and of a second one from the cache.
+
+    Parameters:
+    - n_stations (int): Number of random stations.
+    - size (int): Grid size.
+    - seed: Seed of the station layout.
+    - methods (dict): Backend name -> parameters (default: every backend with its defaults).
+    - noise (float): Standard deviation of independent noise added to the station values, as a
+      fraction of the channel scales. Real stations are far from smooth, and it is on noisy data
+      that the backends with negative weights overshoot.
+
+    Returns:
+    - dict: Per backend 'rmse' (per channel), 'max_abs_error', 'out_of_range' (per channel),
+      'first_seconds' and 'cached_seconds'.
+    """
+    from mapApi import Station
+    from heatmap_utils_api import get_grid_locations
+
+    rng = np.random.default_rng(seed)
+    origin, extent = np.array([51.4, -0.2]), np.array([0.2, 0.3])
+    coordinates = origin + rng.random((n_stations, 2)) * extent
+    data = _smooth_field(coordinates, origin, extent) + rng.normal(0, noise, (n_stations, 3)) * FIELD_SCALES
+    stations = [Station.from_values(latitude, longitude, *values) for (latitude, longitude), values in zip(coordinates, data)]
+    map_obj = Map(np.array(stations), size=size)
+    locations = get_grid_locations(map_obj).reshape(-1, 2)
+    truth = _smooth_field(locations, origin, extent)
+
+    report = {}
+    for method, params in (methods or {method: {} for method in INTERPOLATORS}).items():
+        map_obj.set_interpolation(method, **params)
+        timings = []
+        for _ in range(2):
+            start = time.perf_counter()
+            values = map_obj.get_data_batch(locations)
+            timings.append(time.perf_counter() - start)
+        error = values - truth
+        report[method] = {
+            'rmse': np.sqrt(np.mean(error ** 2, axis=0)).tolist(),
+            'max_abs_error': float(np.abs(error).max()),
+            'out_of_range': np.mean((values < data.min(axis=0)) | (values > data.max(axis=0)), axis=0).tolist(),
+            'first_seconds': timings[0],
+            'cached_seconds': timings[1]
+        }
+        logging.info(f"{method:>11}: rmse {np.round(report[method]['rmse'], 3).tolist()}, "
+                     f"max error {report[method]['max_abs_error']:.2f}, "
+                     f"out of range {np.round(report[method]['out_of_range'], 3).tolist()}, "
+                     f"{timings[0]:.2f} s, cached {timings[1]:.2f} s")
+    return report
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Usage: python interpolation.py [n_stations] [grid_size] [noise]
+    n_stations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    noise = float(sys.argv[3]) if len(sys.argv) > 3 else 0.3
+    logging.info("Smooth field")
+    benchmark_interpolators(n_stations, size)
+    logging.info(f"Smooth field with noise {noise}")
+    benchmark_interpolators(n_stations, size, noise=noise)
+    logging.info("Exact local RBF and kriging, without smoothing or clamp")
+    benchmark_interpolators(n_stations, size, noise=noise, methods={'rbf': {'smoothing': 0.0, 'clamp': False}})
+    benchmark_interpolators(n_stations, size, noise=noise, methods={'kriging': {'clamp': False}})
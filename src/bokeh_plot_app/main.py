@@ -6,16 +6,26 @@ from bokeh.models import (
 )
 from mapApi import Map, Station
 from heatmap_utils_api import (run_simulation,
+    ctrl_sys,
     get_air_pollution_label,
     get_population_density_label,
     get_veg_cover_label,
     get_need_for_action_label,
-    get_recommendation)
-from tqdm import tqdm
+    get_recommendation,
+    compute_label_layers,
+    compute_heatmap,
+    explain_cell,
+    recommendation_table,
+    RECOMMENDATION_VARIABLES)
+from hotspots import find_hotspots, label_zones, describe_hotspots
+from uncertainty import uncertainty_maps
+from inference_pool import SessionPool, compute_heatmap_threaded
+from heatmap_cache import HeatmapCache, fuzzy_config_fingerprint
+from png_renderer import render_rgba, draw_markers, write_png
+from bokeh_payload import add_heatmap, add_recommendation_layer, add_explanation_layer
 import random
 import logging
 import os
-import matplotlib.pyplot as plt
 
 
 # Configure logging
@@ -24,6 +34,19 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # Define map size and number of stations
 MAP_SIZE, N_STATIONS = 100, 14  # Adjust based on your coordinate system and data
 
+# Priority zones: number of hotspots, their minimum separation (grid cells) and the zone threshold
+N_HOTSPOTS, HOTSPOT_SEPARATION, HOTSPOT_THRESHOLD = 5, MAP_SIZE // 10, 60
+
+# How the heatmap is embedded in the HTML: 'float', 'rgba', 'quantized' or 'lod' (overview + tiles on zoom)
+HEATMAP_EXPORT_MODE = 'rgba'
+
+# Use skfuzzy's simulation for every heatmap cell (the reference). False switches to the much faster
+# vectorized inference engine, whose values differ from the reference by up to 0.02
+EXACT_INFERENCE = True
+
+# Number of Monte Carlo samples for the uncertainty maps (0 disables the uncertainty mode)
+UNCERTAINTY_SAMPLES = 0
+
 # List of location ids in London 14
 real_location_ids = [
     3057947, 225719, 3057946, 3057945, 3057948,
@@ -76,21 +99,42 @@ average_lon = (x_min + x_max) / 2
 print(f"Map Longitude Range: min_lon = {map_obj.min_lon}, max_lon = {map_obj.max_lon}")
 print(f"Map Latitude Range: min_lat = {map_obj.min_lat}, max_lat = {map_obj.max_lat}")
 
-# Heatmap generation loop
-heatmap = np.empty((map_obj.size, map_obj.size))
-
-for i in tqdm(range(map_obj.size), desc="Processing columns (longitude)"):
-    for j in range(map_obj.size):
-        # Calculate fractions along the grid
-        fraction_x = (i + 0.5) / map_obj.size  # Longitude fraction
-        fraction_y = (j + 0.5) / map_obj.size  # Latitude fraction
-
-        # Map fractions to actual longitude and latitude
-        longitude = x_min + fraction_x * (x_max - x_min)
-        latitude = y_min + fraction_y * (y_max - y_min)
-
-        query_location = (latitude, longitude)  # Use (latitude, longitude)
-        heatmap[j, i] = run_simulation(query_location, map_obj)
+# Look up the results of this exact station snapshot, grid and fuzzy configuration in the cache
+heatmap_cache = HeatmapCache()
+cache_key = HeatmapCache.make_key(
+    coordinates=np.array([station.location for station in stations]),
+    data=map_obj.data,
+    grid_spec={'size': map_obj.size, 'bounds': [y_min, y_max, x_min, x_max], 'exact_inference': EXACT_INFERENCE},
+    fuzzy_config=fuzzy_config_fingerprint(ctrl_sys)
+)
+cached = heatmap_cache.get(cache_key)
+
+if cached is not None:
+    heatmap = cached[0]['heatmap']
+    print(f"Heatmap loaded from cache (key {cache_key[:12]}).")
+else:
+    # Heatmap generation, spread over a pool of reusable inference sessions. Finished bands are
+    # checkpointed under the cache key, so an interrupted run resumes where it stopped
+    heatmap = compute_heatmap_threaded(map_obj, SessionPool(), reference=EXACT_INFERENCE, checkpoint=cache_key)
+
+# Labels and recommendation of every cell, as uint8 codes stored with the heatmap
+if cached is not None and 'recommendation' in cached[0]:
+    label_layers = {name: cached[0][name] for name in (*RECOMMENDATION_VARIABLES, 'recommendation')}
+else:
+    label_layers = compute_label_layers(map_obj, heatmap)
+
+# Rule firing strengths and clip levels of every cell, as uint8 rasters stored next to the label layers
+if cached is not None and any(name.startswith('explain_') for name in cached[0]):
+    explanation = {name[len('explain_'):]: raster for name, raster in cached[0].items() if name.startswith('explain_')}
+else:
+    explanation = compute_heatmap(map_obj, explain=True)[1]
+
+# Uncertainty mode: propagate sensor noise and the estimated station data into the heatmap
+if UNCERTAINTY_SAMPLES > 0:
+    uncertainty = uncertainty_maps(map_obj, n_samples=UNCERTAINTY_SAMPLES, threshold=HOTSPOT_THRESHOLD)
+    print(f"Uncertainty over {UNCERTAINTY_SAMPLES} samples: "
+          f"mean std = {uncertainty['std'].mean():.2f}, max std = {uncertainty['std'].max():.2f}, "
+          f"cells with P(need for action >= {HOTSPOT_THRESHOLD}) > 0.5: {(uncertainty['exceedance_probability'] > 0.5).sum()}")
 
 # Transpose the heatmap to match x and y axes
 #heatmap = heatmap.T
@@ -127,20 +171,38 @@ high_percentile = np.percentile(heatmap, 95) # 95th percentile
 print(f"5th Percentile: {low_percentile}, 95th Percentile: {high_percentile}")
 color_mapper = LinearColorMapper(palette="Inferno256", low=low_percentile, high=high_percentile)
 
-# Add the heatmap image to the map
-# The 'image' glyph expects a 2D array and will overlay it on the map
-
-p.image(
-    image=[heatmap],
+# Add the heatmap image to the map, in the configured export mode (see bokeh_payload.EXPORT_MODES)
+add_heatmap(
+    p, heatmap,
     x=x_min,
     y=y_min,
     dw=(x_max - x_min),
     dh=(y_max - y_min),
-    color_mapper=color_mapper,
-    level="image",
-    alpha=0.6  # Adjust transparency as needed
+    low=low_percentile,
+    high=high_percentile,
+    mode=HEATMAP_EXPORT_MODE,
+    alpha=0.6,  # Adjust transparency as needed
+    tile_directory="need_for_action_tiles",
+    tile_url="need_for_action_tiles"
 )
 
+# Hovering any cell shows its recommendation
+add_recommendation_layer(
+    p, label_layers['recommendation'], recommendation_table()[0],
+    x=x_min,
+    y=y_min,
+    dw=(x_max - x_min),
+    dh=(y_max - y_min)
+)
+
+# Hovering any cell also shows why it scores as it does
+add_explanation_layer(
+    p, explanation,
+    x=x_min,
+    y=y_min,
+    dw=(x_max - x_min),
+    dh=(y_max - y_min)
+)
 
 # Add a color bar to interpret the heatmap colors
 color_bar = ColorBar(
@@ -184,29 +246,42 @@ def get_need_for_action_at_station(station, heatmap, map_obj):
     return heatmap[j, i]
 
 
-# Extract 'need_for_action' for each station
-station_need_action = [get_need_for_action_at_station(station, heatmap, map_obj) for station in stations]
-
-# Extract numerical values for each station
-station_aq = [station.data[0] for station in stations]
-station_pd = [station.data[1] for station in stations]
-station_vc = [station.data[2] for station in stations]
-
-# Compute fuzzy labels for each variable
-station_aq_labels = [get_air_pollution_label(value) for value in station_aq]
-station_pd_labels = [get_population_density_label(value) for value in station_pd]
-station_vc_labels = [get_veg_cover_label(value) for value in station_vc]
-
-# Extract 'need_for_action' for each station
-station_need_action = [get_need_for_action_at_station(station, heatmap, map_obj) for station in stations]
-station_need_action_labels = [get_need_for_action_label(value) for value in station_need_action]
-
-# Compute recommendations for each station
-station_recommendations = [
-    get_recommendation(aq_label, pd_label, vc_label, nfa_label)
-    for aq_label, pd_label, vc_label, nfa_label
-    in zip(station_aq_labels, station_pd_labels, station_vc_labels, station_need_action_labels)
-]
+if cached is not None:
+    # Derived station results were stored together with the heatmap
+    station_results = cached[1]
+    station_need_action = station_results['need_for_action']
+    station_aq_labels = station_results['air_quality_labels']
+    station_pd_labels = station_results['population_density_labels']
+    station_vc_labels = station_results['veg_cover_labels']
+    station_need_action_labels = station_results['need_for_action_labels']
+    station_recommendations = station_results['recommendations']
+else:
+    # Compute fuzzy labels for each variable
+    station_aq_labels = [get_air_pollution_label(value) for value in station_aq]
+    station_pd_labels = [get_population_density_label(value) for value in station_pd]
+    station_vc_labels = [get_veg_cover_label(value) for value in station_vc]
+
+    # Extract 'need_for_action' for each station
+    station_need_action = [float(get_need_for_action_at_station(station, heatmap, map_obj)) for station in stations]
+    station_need_action_labels = [get_need_for_action_label(value) for value in station_need_action]
+
+    # Compute recommendations for each station
+    station_recommendations = [
+        get_recommendation(aq_label, pd_label, vc_label, nfa_label)
+        for aq_label, pd_label, vc_label, nfa_label
+        in zip(station_aq_labels, station_pd_labels, station_vc_labels, station_need_action_labels)
+    ]
+
+    heatmap_cache.put(cache_key, {'heatmap': heatmap, **label_layers,
+                                  **{f"explain_{name}": raster for name, raster in explanation.items()}}, {
+        'need_for_action': station_need_action,
+        'air_quality_labels': station_aq_labels,
+        'population_density_labels': station_pd_labels,
+        'veg_cover_labels': station_vc_labels,
+        'need_for_action_labels': station_need_action_labels,
+        'recommendations': station_recommendations
+    })
+print(heatmap_cache)
 
 # Update ColumnDataSource to include 'need_for_action'
 source = ColumnDataSource(data=dict(
@@ -268,6 +343,58 @@ labels = LabelSet(
 
 p.add_layout(labels)
 
+# Extract priority zones from the whole heatmap, not only at the stations
+zone_labels, zones = label_zones(heatmap, threshold=HOTSPOT_THRESHOLD)
+hotspots = find_hotspots(heatmap, k=N_HOTSPOTS, min_separation=HOTSPOT_SEPARATION)
+hotspots = describe_hotspots(hotspots, map_obj, zone_labels=zone_labels)
+
+print(f"Found {len(zones)} zones with need for action >= {HOTSPOT_THRESHOLD}:")
+for zone in zones:
+    print(f"Zone {zone['zone']}: area = {zone['area']} cells, mean = {zone['mean_score']:.2f}, max = {zone['max_score']:.2f}")
+for rank, hotspot in enumerate(hotspots, start=1):
+    print(f"Hotspot {rank}: ({hotspot['latitude']:.4f}, {hotspot['longitude']:.4f}), "
+          f"need for action = {hotspot['score']:.2f} ({hotspot['need_for_action_label']}), zone {hotspot['zone']}")
+    strengths = explain_cell(explanation, hotspot['row'], hotspot['column'])
+    rule = max((name for name in strengths if name.startswith('rule')), key=strengths.get)
+    print(f"    strongest rule: {rule} ({strengths[rule]:.2f})")
+
+hotspot_source = ColumnDataSource(data=dict(
+    latitude=[hotspot['latitude'] for hotspot in hotspots],
+    longitude=[hotspot['longitude'] for hotspot in hotspots],
+    zone=[hotspot['zone'] for hotspot in hotspots],
+    air_quality_label=[hotspot['air_quality_label'] for hotspot in hotspots],
+    population_density_label=[hotspot['population_density_label'] for hotspot in hotspots],
+    vegetation_cover_label=[hotspot['veg_cover_label'] for hotspot in hotspots],
+    need_for_action=[hotspot['score'] for hotspot in hotspots],
+    need_for_action_label=[hotspot['need_for_action_label'] for hotspot in hotspots],
+    recommendation=[hotspot['recommendation'] for hotspot in hotspots]
+))
+
+hotspot_renderer = p.scatter(
+    'longitude', 'latitude',
+    size=14,
+    marker="triangle",
+    fill_color="red",
+    fill_alpha=0.8,
+    line_color="black",
+    legend_label="Priority zones",
+    source=hotspot_source
+)
+
+p.add_tools(HoverTool(
+    tooltips=[
+        ("Latitude", "@latitude"),
+        ("Longitude", "@longitude"),
+        ("Zone", "@zone"),
+        ("Air Quality", "@air_quality_label"),
+        ("Population Density", "@population_density_label"),
+        ("Vegetation Cover", "@vegetation_cover_label"),
+        ("Need for Action", "@need_for_action (@need_for_action_label)"),
+        ("Recommendation", "@recommendation{safe}")
+    ],
+    renderers=[hotspot_renderer]
+))
+
 # Show the plot
 show(p)
 
@@ -284,14 +411,14 @@ print(f"y_min (Latitude): {y_min}, y_max (Latitude): {y_max}")
 print("Sample Heatmap Values:")
 print(heatmap[:5, :5])  # Print a small section of the heatmap
 
-plt.figure(figsize=(8, 6))
-plt.imshow(heatmap, extent=[x_min, x_max, y_min, y_max], origin='lower', cmap='inferno')
-plt.colorbar(label='Need for Action')
-plt.scatter(station_longitudes, station_latitudes, c='green', marker='o')
-plt.xlabel('Longitude')
-plt.ylabel('Latitude')
-plt.title('Heatmap Verification')
-plt.show()
+# Headless verification image, instead of a blocking matplotlib figure
+PIXELS_PER_CELL = 8
+verification_image = render_rgba(heatmap, cmap='inferno', origin='lower', pixels_per_cell=PIXELS_PER_CELL)
+marker_columns = (np.array(station_longitudes) - x_min) / (x_max - x_min) * map_obj.size * PIXELS_PER_CELL
+marker_rows = (1 - (np.array(station_latitudes) - y_min) / (y_max - y_min)) * map_obj.size * PIXELS_PER_CELL
+draw_markers(verification_image, marker_rows, marker_columns, radius=PIXELS_PER_CELL)
+write_png("heatmap_verification.png", verification_image)
+print("Verification image written to heatmap_verification.png")
 
 for station in stations:
     print(f"Station ID: {station.location_id}, Latitude: {station.latitude}, Longitude: {station.longitude}")
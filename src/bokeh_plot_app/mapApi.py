@@ -1,7 +1,16 @@
 import numpy as np
 from scipy.spatial import cKDTree
-from openaq_api import get_air_quality_and_coordinates
-from scipy.interpolate import Rbf  # Optional for advanced interpolation
+
+POLLUTANTS = ('pm25', 'pm10', 'no2', 'o3')
+"""OpenAQ parameters kept per station, in the order of Station.pollutants. PM2.5 is also data[0]."""
+MISSING = -1
+"""Value of a reading a station does not provide."""
+
+def pollutant_vector(measurements: dict[str, float]) -> np.ndarray:
+    """
+    Fixed-width vector of the POLLUTANTS from {parameter name: value}, MISSING where absent.
+    """
+    return np.array([MISSING if measurements.get(name) is None else measurements[name] for name in POLLUTANTS], dtype=float)
 
 class Station:
     def __init__(self, location_id: int, population_density: int, veg_cover: int) -> None:
@@ -15,7 +24,10 @@ class Station:
         """
         self.location_id = location_id  # Store the location_id as an instance attribute
 
-        air_quality, coordinates = get_air_quality_and_coordinates(location_id)
+        from openaq_api import get_latest_measurements  # Imports requests only when fetching
+        measurements, coordinates = get_latest_measurements(location_id)  # Every pollutant from one /latest call
+        self.pollutants = pollutant_vector(measurements)
+        air_quality = measurements.get('pm25')
         
         if coordinates:
             self.latitude = coordinates['latitude']
@@ -32,6 +44,22 @@ class Station:
             veg_cover                                        # Vegetation Cover (%)
         ])
     
+    @classmethod
+    def from_values(cls, latitude: float, longitude: float, air_quality: float, population_density: float,
+                    veg_cover: float, location_id: int = None, pollutants: dict[str, float] = None) -> 'Station':
+        """
+        Create a Station from known coordinates and data, without calling the OpenAQ API.
+        pollutants maps POLLUTANTS names to values; PM2.5 defaults to air_quality.
+        """
+        station = cls.__new__(cls)
+        station.location_id = location_id
+        station.latitude = latitude
+        station.longitude = longitude
+        station.location = (latitude, longitude)
+        station.data = np.array([air_quality, population_density, veg_cover])
+        station.pollutants = pollutant_vector({'pm25': air_quality, **(pollutants or {})})
+        return station
+
     def __str__(self) -> str:
         aq, pd, vc = self.data
         return f"""
@@ -42,10 +70,46 @@ class Station:
     Vegetation Cover =      {vc}
     """
 
+EARTH_RADIUS = 6371008.8
+"""Mean Earth radius in metres. Stations are indexed on a sphere of this radius."""
+
+
+def to_unit_vectors(latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """
+    Converts latitudes and longitudes (degrees) to 3D unit vectors (spherical ECEF).
+    Straight-line distances between unit vectors grow monotonically with the great-circle distance,
+    so nearest neighbours in this space are the geodesically nearest stations.
+
+    Returns:
+    - np.ndarray: Array of shape (n, 3).
+    """
+    latitudes, longitudes = np.radians(latitudes), np.radians(longitudes)
+    cos_latitudes = np.cos(latitudes)
+    return np.stack([cos_latitudes * np.cos(longitudes), cos_latitudes * np.sin(longitudes), np.sin(latitudes)], axis=-1)
+
+
+def chord_to_metres(chord: np.ndarray) -> np.ndarray:
+    """
+    Converts straight-line distances between unit vectors to great-circle distances in metres.
+    """
+    return 2 * EARTH_RADIUS * np.arcsin(np.clip(chord / 2, 0, 1))
+
+
+def metres_to_chord(distance: float) -> float:
+    """
+    Inverse of chord_to_metres.
+    """
+    return 2 * np.sin(min(distance / (2 * EARTH_RADIUS), np.pi / 2))
+
+
 class Map:
     def __init__(self, stations: np.ndarray, size: int=100, verbose: bool=False) -> None:
         """
         Initialize the Map with a set of stations.
+
+        Stations are indexed by their position on the sphere, so neighbour distances are real
+        distances in metres, whatever the city. The latitude/longitude bounds only define the
+        extent of the heatmap grid.
         
         Parameters:
         - stations (np.ndarray): Array of Station objects.
@@ -56,32 +120,45 @@ class Map:
         self.verbose = verbose
         
         # Extract real coordinates from stations
-        real_coordinates = np.array([[station.latitude, station.longitude] for station in stations])
+        self.coordinates = np.array([[station.latitude, station.longitude] for station in stations], dtype=float).reshape(-1, 2)
         self.data = np.array([station.data for station in stations])  # Shape: (n_stations, 3)
+        self.pollutants = np.array([self._pollutants(station) for station in stations], dtype=float).reshape(-1, len(POLLUTANTS))
         
-        # Determine min and max for normalization
-        self.min_lat = real_coordinates[:, 0].min()
-        self.max_lat = real_coordinates[:, 0].max()
-        self.min_lon = real_coordinates[:, 1].min()
-        self.max_lon = real_coordinates[:, 1].max()
+        # Determine min and max of the grid
+        self.min_lat = self.coordinates[:, 0].min()
+        self.max_lat = self.coordinates[:, 0].max()
+        self.min_lon = self.coordinates[:, 1].min()
+        self.max_lon = self.coordinates[:, 1].max()
         
         if self.verbose:
             print(f"Latitude range: {self.min_lat} to {self.max_lat}")
             print(f"Longitude range: {self.min_lon} to {self.max_lon}")
         
-        # Normalize coordinates to [0, size)
-        self.normalized_coordinates = np.zeros_like(real_coordinates, dtype=float)
-        self.normalized_coordinates[:, 0] = (real_coordinates[:, 0] - self.min_lat) / (self.max_lat - self.min_lat) * (size - 1)
-        self.normalized_coordinates[:, 1] = (real_coordinates[:, 1] - self.min_lon) / (self.max_lon - self.min_lon) * (size - 1)
-        
-        if self.verbose:
-            print(f"Normalized coordinates:\n{self.normalized_coordinates}")
-        
-        # Build KD-Tree for efficient spatial queries
-        self.kd_tree = cKDTree(self.normalized_coordinates)
+        # Fixed metric space: positions never change when stations are added
+        self.points = to_unit_vectors(self.coordinates[:, 0], self.coordinates[:, 1])
+        self._kd_tree = None
+
+        # Interpolation backend, see set_interpolation
+        self.interpolation = 'idw'
+        self.interpolation_params = {}
+        self._interpolator = None
     
+    @staticmethod
+    def _pollutants(station: Station) -> np.ndarray:
+        # Stations pickled before pollutants existed only know their PM2.5
+        return station.pollutants if hasattr(station, 'pollutants') else pollutant_vector({'pm25': station.data[0]})
+
     def __str__(self) -> str:
-        return f"Map contains {len(self.normalized_coordinates)} stations."
+        return f"Map contains {len(self.coordinates)} stations."
+
+    @property
+    def kd_tree(self) -> cKDTree:
+        """
+        KD-Tree over the stations' unit vectors, rebuilt lazily after stations were added.
+        """
+        if self._kd_tree is None:
+            self._kd_tree = cKDTree(self.points)
+        return self._kd_tree
     
     def add_station(self, station: Station) -> None:
         """
@@ -90,24 +167,55 @@ class Map:
         Parameters:
         - station (Station): The Station object to add.
         """
-        # Update min and max
+        # Grow the grid extent if needed
         self.min_lat = min(self.min_lat, station.latitude)
         self.max_lat = max(self.max_lat, station.latitude)
         self.min_lon = min(self.min_lon, station.longitude)
         self.max_lon = max(self.max_lon, station.longitude)
         
-        # Normalize new station's coordinates
-        normalized_lat = (station.latitude - self.min_lat) / (self.max_lat - self.min_lat) * (self.size - 1)
-        normalized_lon = (station.longitude - self.min_lon) / (self.max_lon - self.min_lon) * (self.size - 1)
-        normalized_location = (normalized_lat, normalized_lon)
-        
-        # Append to existing data
-        self.normalized_coordinates = np.vstack([self.normalized_coordinates, normalized_location])
+        # Append to existing data; the positions of the other stations are unaffected
+        self.coordinates = np.vstack([self.coordinates, [station.latitude, station.longitude]])
+        self.points = np.vstack([self.points, to_unit_vectors(station.latitude, station.longitude)])
         self.data = np.vstack([self.data, station.data])
-        self.kd_tree = cKDTree(self.normalized_coordinates)  # Rebuild KD-Tree
+        self.pollutants = np.vstack([self.pollutants, self._pollutants(station)])
+        self._kd_tree = None  # Rebuilt on the next query
+        self._interpolator = None  # Its cached factorizations belong to the old layout
         
         if self.verbose:
-            print(f"Added Station at ({station.latitude:.4f}, {station.longitude:.4f}) normalized to ({normalized_lat:.2f}, {normalized_lon:.2f}).")
+            print(f"Added Station at ({station.latitude:.4f}, {station.longitude:.4f}).")
+
+    def query_neighbors(self, locations: np.ndarray, n_neighbors: int=3) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the n nearest stations of many locations.
+
+        Parameters:
+        - locations (np.ndarray): Array of shape (n, 2) with (latitude, longitude) rows in real coordinates.
+        - n_neighbors (int): Number of nearest stations (at most the number of stations).
+
+        Returns:
+        - tuple[np.ndarray, np.ndarray]: Great-circle distances in metres and station indices, both of shape (n, n_neighbors).
+        """
+        locations = np.asarray(locations, dtype=float).reshape(-1, 2)
+        n_neighbors = min(n_neighbors, len(self.points))
+        chords, indices = self.kd_tree.query(to_unit_vectors(locations[:, 0], locations[:, 1]), k=n_neighbors, workers=-1)
+        return (chord_to_metres(chords).reshape(len(locations), n_neighbors),
+                np.asarray(indices).reshape(len(locations), n_neighbors))
+
+    def stations_within(self, locations: np.ndarray, radius: float) -> list[np.ndarray]:
+        """
+        Finds the stations within a great-circle distance of many locations.
+
+        Parameters:
+        - locations (np.ndarray): Array of shape (n, 2) with (latitude, longitude) rows in real coordinates.
+        - radius (float): Distance in metres.
+
+        Returns:
+        - list[np.ndarray]: Per location, the indices of the stations within the radius.
+        """
+        locations = np.asarray(locations, dtype=float).reshape(-1, 2)
+        neighbors = self.kd_tree.query_ball_point(to_unit_vectors(locations[:, 0], locations[:, 1]),
+                                                  r=metres_to_chord(radius), workers=-1)
+        return [np.array(indices, dtype=int) for indices in neighbors]
     
     def get_data(self, location: tuple[float, float], n_neighbors: int=3) -> tuple[float, int, int]:
         """
@@ -120,47 +228,119 @@ class Map:
         Returns:
         - tuple[float, int, int]: Interpolated (air_quality, population_density, veg_cover)
         """
-        # Normalize the input coordinates
-        latitude, longitude = location
-        lat_range = self.max_lat - self.min_lat
-        lon_range = self.max_lon - self.min_lon
+        return tuple(self.get_data_batch(np.array([location]), n_neighbors)[0])
 
-        # Avoid division by zero
-        if lat_range == 0:
-            normalized_lat = 0
-        else:
-            normalized_lat = (latitude - self.min_lat) / lat_range * (self.size - 1)
-        
-        if lon_range == 0:
-            normalized_lon = 0
-        else:
-            normalized_lon = (longitude - self.min_lon) / lon_range * (self.size - 1)
-        
-        normalized_location = (normalized_lat, normalized_lon)
-        
-        # Query KD-Tree for nearest neighbors using normalized coordinates
-        distances, indices = self.kd_tree.query(normalized_location, k=n_neighbors)
-        
-        # Handle case when only one neighbor is found
-        if n_neighbors == 1:
-            indices = [indices]
-            distances = [distances]
-        
-        # Check if any station is exactly at the query location
-        exact_match = np.isclose(distances, 0)
-        if any(exact_match):
-            matched_index = indices[exact_match][0]
-            return tuple(self.data[matched_index])
-        
-        # Compute weights using Inverse Distance Weighting (IDW)
+    def set_interpolation(self, method: str = 'idw', **params) -> None:
+        """
+        Selects the interpolation backend used by get_data, get_data_batch and get_interpolation_weights.
+
+        Parameters:
+        - method (str): One of interpolation.INTERPOLATORS: 'idw' (default), 'barycentric', 'rbf' or 'kriging'.
+        - params: Parameters of the backend, e.g. n_neighbors for 'rbf' and 'kriging'.
+        """
+        from interpolation import INTERPOLATORS
+        assert method in INTERPOLATORS, f"method must be one of {tuple(INTERPOLATORS)}, not {method!r}"
+        self.interpolation = method
+        self.interpolation_params = params
+        self._interpolator = None
+
+    @property
+    def interpolator(self):
+        """
+        The selected interpolation backend, built lazily for the current station layout.
+        """
+        if self._interpolator is None:
+            from interpolation import INTERPOLATORS
+            self._interpolator = INTERPOLATORS[self.interpolation](self, **self.interpolation_params)
+        return self._interpolator
+
+    def get_interpolation_weights(self, locations: np.ndarray, n_neighbors: int=3) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Computes the neighbours and normalized weights used by get_data for many locations, with the
+        selected interpolation backend (see set_interpolation).
+        They only depend on the station layout, so they can be reused for different station data.
+
+        Parameters:
+        - locations (np.ndarray): Array of shape (n, 2) with (latitude, longitude) rows in real coordinates.
+        - n_neighbors (int): Number of nearest neighbors to consider for IDW. The other backends
+          take their neighbourhood size from set_interpolation.
+
+        Returns:
+        - tuple[np.ndarray, np.ndarray]: Station indices and weights, both of shape (n, k).
+        """
+        if self.interpolation == 'idw' and not self.interpolation_params:
+            return self.idw_weights(locations, n_neighbors)
+        return self.interpolator.get_weights(locations)
+
+    def idw_weights(self, locations: np.ndarray, n_neighbors: int=3) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Inverse Distance Weighting neighbours and normalized weights of many locations.
+
+        Returns:
+        - tuple[np.ndarray, np.ndarray]: Station indices and weights, both of shape (n, n_neighbors).
+        """
+        distances, indices = self.query_neighbors(locations, n_neighbors)
+
+        # Inverse Distance Weighting on the distances in metres
         weights = 1 / (distances ** 2 + 1e-6)  # Adding a small value to prevent division by zero
-        weighted_data = self.data[indices].T * weights
-        weighted_sum = np.sum(weighted_data, axis=1)
-        sum_weights = np.sum(weights)
-        interpolated = weighted_sum / sum_weights
-        
-        return tuple(interpolated)
-    
+        weights /= weights.sum(axis=1, keepdims=True)
+
+        # Locations with a station exactly on them take that station's data
+        exact_match = np.isclose(distances, 0)
+        has_match = exact_match.any(axis=1)
+        first_match = np.argmax(exact_match, axis=1)
+        weights[has_match] = 0
+        weights[has_match, first_match[has_match]] = 1
+
+        return indices, weights
+
+    def get_data_batch(self, locations: np.ndarray, n_neighbors: int=3, dtype=np.float64, pollutants: bool=False) -> np.ndarray:
+        """
+        Vectorized version of get_data, interpolating many locations with one KD-Tree query. With a
+        backend whose weights can be negative (see Interpolator.clamp), every value is clipped to the
+        range of the stations it was interpolated from.
+
+        Parameters:
+        - locations (np.ndarray): Array of shape (n, 2) with (latitude, longitude) rows in real coordinates.
+        - n_neighbors (int): Number of nearest neighbors to consider for interpolation.
+        - dtype: Floating point type of the weights and the result. The neighbour search itself always
+          runs in float64, since float32 coordinates would only resolve about a metre.
+        - pollutants (bool): Also interpolate the other POLLUTANTS (pm10, no2, o3), in the same pass.
+          Their weights are renormalized over the neighbours that measure them, since many stations
+          lack some sensors; a cell none of whose neighbours measures a pollutant gets MISSING.
+
+        Returns:
+        - np.ndarray: Array of shape (n, 3) with interpolated (air_quality, population_density, veg_cover),
+          or (n, 6) with pollutants, followed by (pm10, no2, o3).
+        """
+        indices, weights = self.get_interpolation_weights(locations, n_neighbors)
+        weights = weights.astype(dtype, copy=False)
+        clamp = self.interpolation != 'idw' and self.interpolator.clamp
+        if not pollutants:
+            neighbors = self.data.astype(dtype, copy=False)[indices]
+            result = np.einsum('nk,nkc->nc', weights, neighbors)
+            if clamp:
+                np.clip(result, neighbors.min(axis=1), neighbors.max(axis=1), out=result)
+            return result
+
+        # All channels and the presence of the extra pollutants as one (n_stations, C) array: one gather, one contraction
+        extra = self.pollutants[:, 1:]
+        present = extra != MISSING
+        channels = np.hstack([self.data, np.where(present, extra, 0), present]).astype(dtype)
+        neighbors = channels[indices]
+        result = np.einsum('nk,nkc->nc', weights, neighbors)
+        n_base, n_extra = self.data.shape[1], extra.shape[1]
+        totals = result[:, n_base + n_extra:]
+        result = result[:, :n_base + n_extra]
+        np.divide(result[:, n_base:], totals, out=result[:, n_base:], where=totals != 0)
+        if clamp:
+            # Over the neighbours that measure each pollutant; cells without any become MISSING below
+            values, measured = neighbors[:, :, :n_base + n_extra], neighbors[:, :, n_base + n_extra:] != 0
+            measured = np.concatenate([np.ones_like(measured[:, :, :n_base]), measured], axis=2)
+            np.clip(result, np.where(measured, values, np.inf).min(axis=1), np.where(measured, values, -np.inf).max(axis=1), out=result)
+        result[:, n_base:][totals == 0] = MISSING
+        return result
+
     def barycentric_coordinates(triangle: np.ndarray, point: tuple[float, float]):
         """
         Calculate the barycentric coordinates of a point with respect to a triangle.
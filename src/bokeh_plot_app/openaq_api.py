@@ -1,68 +1,89 @@
+import functools
 import requests
 
-def get_air_quality(location_id):
+API_KEY = '2caa6fe0fe5066bc5d382ec56ee1bcea909f0874444db7983cf39353caa408b2'  # Replace with your actual API key
+HEADERS = {
+    'Accept': 'application/json',
+    'X-API-Key': API_KEY
+}
+
+
+@functools.cache
+def get_location_sensors(location_id):
     """
-    Fetches the latest PM2.5 air quality data from the specified location_id using OpenAQ API v3.
+    Fetches the sensors of the specified location_id using OpenAQ API v3. They do not change between
+    polls, so they are fetched once per location and process; failures raise and are not cached.
 
     Parameters:
-    - location_id (int): The ID of the location to fetch data from.
+    - location_id (int): The ID of the location.
 
     Returns:
-    - air_quality (float): The PM2.5 value, or None if data is unavailable.
+    - tuple: (sensors, coordinates)
+        - sensors (dict): {sensor id: parameter name}, e.g. {12345: 'pm25', 12346: 'no2'}.
+        - coordinates (dict): {'latitude': float, 'longitude': float}, or None if unavailable.
     """
-    api_key = '2caa6fe0fe5066bc5d382ec56ee1bcea909f0874444db7983cf39353caa408b2'  # Replace with your actual API key
+    response = requests.get(f'https://api.openaq.org/v3/locations/{location_id}', headers=HEADERS)
+    response.raise_for_status()
+    results = response.json().get('results')
+    if not results:
+        raise ValueError(f"No sensor data available for location_id {location_id}.")
+    location_data = results[0]
+    sensors = {sensor['id']: sensor['parameter']['name'] for sensor in location_data.get('sensors', [])}
+    return sensors, location_data.get('coordinates')
+
 
-    headers = {
-        'Accept': 'application/json',
-        'X-API-Key': api_key
-    }
+def get_latest_measurements(location_id):
+    """
+    Fetches the latest value of every parameter measured at the specified location_id with a
+    single /latest request (plus one sensor lookup the first time a location is seen).
+
+    Parameters:
+    - location_id (int): The ID of the location to fetch data from.
 
-    # Step 1: Fetch sensor information to get the mapping
-    url_sensors = f'https://api.openaq.org/v3/locations/{location_id}'
+    Returns:
+    - tuple: (measurements, coordinates)
+        - measurements (dict): {parameter name: value}, e.g. {'pm25': 12.1, 'pm10': 20.4, 'no2': 31.0}.
+          Empty if data is unavailable.
+        - coordinates (dict): {'latitude': float, 'longitude': float}, or None if unavailable.
+    """
     try:
-        response_sensors = requests.get(url_sensors, headers=headers)
-        response_sensors.raise_for_status()
-        data_sensors = response_sensors.json()
-
-        if 'results' in data_sensors and data_sensors['results']:
-            location_data = data_sensors['results'][0]
-            sensors = location_data.get('sensors', [])
-            # Create mapping from sensorsId to parameter name
-            sensors_mapping = {sensor['id']: sensor['parameter']['name'] for sensor in sensors}
-        else:
-            print(f"No sensor data available for location_id {location_id}.")
-            return None
+        sensors, coordinates = get_location_sensors(location_id)
     except Exception as e:
-        print(f"Error fetching sensor data: {e}")
-        return None
+        print(f"Error fetching sensor data for location ID {location_id}: {e}")
+        return {}, None
 
-    # Step 2: Fetch latest measurements
     url_latest = f'https://api.openaq.org/v3/locations/{location_id}/latest'
     try:
-        response_latest = requests.get(url_latest, headers=headers)
-        response_latest.raise_for_status()
-        data_latest = response_latest.json()
-
-        # Print the response data for debugging
-        print("API Response:")
-        print(data_latest)
-
-        if 'results' in data_latest and data_latest['results']:
-            measurements = data_latest['results']
-            for measurement in measurements:
-                sensor_id = measurement.get('sensorsId')
-                parameter_name = sensors_mapping.get(sensor_id)
-                if parameter_name == 'pm25':
-                    pm25_value = measurement['value']
-                    return pm25_value
-            print("PM2.5 data not found in the measurements.")
-        else:
-            print(f"No measurement data available for location_id {location_id}.")
+        response = requests.get(url_latest, headers=HEADERS)
+        response.raise_for_status()
+        data = response.json()
     except Exception as e:
-        print(f"Error fetching measurement data: {e}")
-        return None
+        print(f"Error fetching data for location ID {location_id}: {e}")
+        return {}, coordinates
+
+    measurements = {}
+    for result in data.get('results') or []:
+        parameter_name = sensors.get(result.get('sensorsId'))
+        if parameter_name is not None and result.get('value') is not None:
+            measurements.setdefault(parameter_name, result['value'])
+        coordinates = coordinates or result.get('coordinates')
+    if not measurements:
+        print(f"No measurement data available for location ID {location_id}.")
+    return measurements, coordinates
 
-    return None
+
+def get_air_quality(location_id):
+    """
+    Fetches the latest PM2.5 air quality data from the specified location_id using OpenAQ API v3.
+
+    Parameters:
+    - location_id (int): The ID of the location to fetch data from.
+
+    Returns:
+    - air_quality (float): The PM2.5 value, or None if data is unavailable.
+    """
+    measurements, _ = get_latest_measurements(location_id)
+    return measurements.get('pm25')
 
 
 def get_air_quality_and_coordinates(location_id):
@@ -77,32 +98,5 @@ def get_air_quality_and_coordinates(location_id):
         - air_quality (float): The PM2.5 value, or None if data is unavailable.
         - coordinates (dict): {'latitude': float, 'longitude': float}, or None if data is unavailable.
     """
-    api_key = '2caa6fe0fe5066bc5d382ec56ee1bcea909f0874444db7983cf39353caa408b2'  # Replace with your API key
-
-    headers = {
-        'Accept': 'application/json',
-        'X-API-Key': api_key
-    }
-
-    url_latest = f'https://api.openaq.org/v3/locations/{location_id}/latest'
-
-    try:
-        response = requests.get(url_latest, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-
-        if 'results' in data and isinstance(data['results'], list) and data['results']:
-            # Extract data for the location_id
-            for result in data['results']:
-                if result.get('locationsId') == location_id:
-                    coordinates = result.get('coordinates')
-                    air_quality = result.get('value', -1)
-                    return air_quality, coordinates
-            print(f"No data found for location ID {location_id}.")
-        else:
-            print(f"No results available for location ID {location_id}.")
-    except Exception as e:
-        print(f"Error fetching data for location ID {location_id}: {e}")
-        return None, None
-
-    return None, None
+    measurements, coordinates = get_latest_measurements(location_id)
+    return measurements.get('pm25'), coordinates
@@ -0,0 +1,132 @@
+import heapq
+import logging
+import numpy as np
+from what_if import WhatIfEngine
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+OBJECTIVES = ('total', 'weighted')
+"""Aggregate 'need_for_action' measures the optimizer can minimize."""
+
+
+def candidate_grid(shape: tuple[int, int], stride: int) -> np.ndarray:
+    """
+    Regularly spaced candidate sites covering the grid.
+
+    Parameters:
+    - shape (tuple[int, int]): Shape of the heatmap grid.
+    - stride (int): Distance in cells between neighbouring candidates.
+
+    Returns:
+    - np.ndarray: Array of shape (n, 2) with (row, column) candidate locations.
+    """
+    offset = stride // 2
+    rows, cols = np.meshgrid(np.arange(offset, shape[0], stride), np.arange(offset, shape[1], stride), indexing='ij')
+    return np.stack([rows.ravel(), cols.ravel()], axis=1)
+
+
+def _gains(engine: WhatIfEngine, locations: np.ndarray, radius: float, added_veg_cover: float, objective: str) -> np.ndarray:
+    """
+    Reduction of the objective for each candidate, given the current state of the engine.
+    """
+    result = engine.evaluate(locations, radius, added_veg_cover)
+    return -result['delta_total'] if objective == 'total' else -result['delta_weighted']
+
+
+def place_green_areas(engine: WhatIfEngine, n_sites: int, radius: float, added_veg_cover: float,
+                      candidates: np.ndarray = None, objective: str = 'total', lazy: bool = True,
+                      batch_size: int = 32) -> list[dict]:
+    """
+    Greedily picks the n_sites candidates that reduce the aggregate 'need_for_action' the most.
+
+    After every placement the fields of a working copy of the engine are updated in place,
+    so later gains are marginal gains on top of the sites already chosen. With lazy=True the
+    CELF strategy is used: gains are kept in a priority queue and only the top entries are
+    re-evaluated after each pick. A stale gain is also reused as is when no site placed since
+    it was computed overlaps its footprint, since its cells did not change.
+
+    Parameters:
+    - engine (WhatIfEngine): Engine holding the base fields. It is not modified.
+    - n_sites (int): Number of green areas to place (the budget).
+    - radius (float): Radius of every green area, in cells.
+    - added_veg_cover (float): Vegetation cover (%) added by every green area.
+    - candidates (np.ndarray): Array of shape (n, 2) with (row, column) candidate sites.
+      Defaults to a regular grid with a stride of one radius.
+    - objective (str): 'total' or 'weighted' (population-weighted) need for action.
+    - lazy (bool): Use lazy-greedy (CELF) evaluation instead of re-evaluating all candidates.
+    - batch_size (int): Number of stale queue entries re-evaluated together.
+
+    Returns:
+    - list[dict]: The chosen sites in order of selection, with 'rank', 'row', 'column',
+      'marginal_gain' and 'evaluations' (gain evaluations spent so far).
+    """
+    assert objective in OBJECTIVES, f"objective must be one of {OBJECTIVES}, not {objective!r}"
+    engine = WhatIfEngine(engine.air_pollution, engine.population_density, engine.veg_cover, engine.need_for_action)
+    if candidates is None:
+        candidates = candidate_grid(engine.shape, stride=max(1, int(radius)))
+    candidates = np.asarray(candidates).reshape(-1, 2)
+    n_sites = min(n_sites, len(candidates))
+
+    # Initial gains, evaluated for all candidates in one batched pass
+    gains = _gains(engine, candidates, radius, added_veg_cover, objective)
+    evaluations = len(candidates)
+    # Heap entries: (-gain, candidate index, round in which the gain was computed)
+    queue = [(-gain, index, 0) for index, gain in enumerate(gains)]
+    heapq.heapify(queue)
+
+    placed = []
+    ranked_sites = []
+    while len(ranked_sites) < n_sites and queue:
+        if not lazy and ranked_sites:
+            # Plain greedy: refresh every remaining candidate
+            indices = np.array([index for _, index, _ in queue])
+            gains = _gains(engine, candidates[indices], radius, added_veg_cover, objective)
+            evaluations += len(indices)
+            queue = [(-gain, index, len(placed)) for index, gain in zip(indices, gains)]
+            heapq.heapify(queue)
+
+        neg_gain, index, evaluated_round = queue[0]
+        if evaluated_round < len(placed) and _overlaps(candidates[index], placed[evaluated_round:], radius):
+            # Stale gain: re-evaluate the top stale entries together and push them back
+            stale = []
+            while queue and len(stale) < batch_size:
+                entry = heapq.heappop(queue)
+                if entry[2] < len(placed) and _overlaps(candidates[entry[1]], placed[entry[2]:], radius):
+                    stale.append(entry[1])
+                else:
+                    heapq.heappush(queue, entry[:2] + (len(placed),))
+                    break
+            fresh_gains = _gains(engine, candidates[stale], radius, added_veg_cover, objective)
+            evaluations += len(stale)
+            for stale_index, gain in zip(stale, fresh_gains):
+                heapq.heappush(queue, (-gain, stale_index, len(placed)))
+            continue
+
+        # The top entry is up to date, so it is the best remaining candidate
+        heapq.heappop(queue)
+        if -neg_gain <= 0:
+            logging.info(f"No remaining candidate improves the objective, stopping after {len(ranked_sites)} sites.")
+            break
+        row, column = candidates[index]
+        engine.apply((row, column), radius, added_veg_cover)
+        placed.append(candidates[index])
+        ranked_sites.append({
+            'rank': len(ranked_sites) + 1,
+            'row': int(row),
+            'column': int(column),
+            'marginal_gain': float(-neg_gain),
+            'evaluations': evaluations
+        })
+
+    return ranked_sites
+
+
+def _overlaps(location: np.ndarray, placed: list[np.ndarray], radius: float) -> bool:
+    """
+    Whether a candidate's footprint overlaps the footprint of any of the given placed sites.
+    """
+    if not placed:
+        return False
+    distances = np.hypot(*(np.asarray(placed) - location).T)
+    return bool(np.any(distances <= 2 * radius))
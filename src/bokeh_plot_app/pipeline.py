@@ -0,0 +1,312 @@
+import asyncio
+import logging
+import time
+import numpy as np
+from concurrent.futures import Executor, ThreadPoolExecutor
+from mapApi import Map, Station, MISSING, POLLUTANTS, pollutant_vector
+from heatmap_utils_api import compute_heatmap
+from heatmap_diff import BLOCK_SIZE, BlockDiffer
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEBOUNCE = 1.0
+"""Seconds the coalescing stage keeps collecting readings after the first one of a batch."""
+INGEST_QUEUE_SIZE = 1024
+"""Readings buffered between ingest and coalescing. A full queue blocks the source."""
+SUBSCRIBER_QUEUE_SIZE = 2
+"""Heatmaps buffered per subscriber. A slow subscriber loses its oldest heatmaps, never memory."""
+FETCH_CONCURRENCY = 8
+"""Number of OpenAQ requests in flight at once."""
+
+
+class StageMetrics:
+    def __init__(self, name: str, queue: asyncio.Queue = None) -> None:
+        """
+        Counters and timings of one pipeline stage, and the depth of its input queue.
+        """
+        self.name = name
+        self.queue = queue
+        self.processed = 0
+        self.dropped = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.processed += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def summary(self) -> dict:
+        return {
+            'queue_depth': self.queue.qsize() if self.queue is not None else None,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'mean_ms': self.total_seconds / self.processed * 1000 if self.processed else None,
+            'max_ms': self.max_seconds * 1000
+        }
+
+
+def _put_latest(queue: asyncio.Queue, item) -> bool:
+    # Puts without blocking, discarding the oldest item of a full queue. Returns whether one was discarded.
+    dropped = False
+    if queue.full():
+        queue.get_nowait()
+        dropped = True
+    queue.put_nowait(item)
+    return dropped
+
+
+def compute_snapshot(coordinates: np.ndarray, data: np.ndarray, size: int, pollutants: np.ndarray = None) -> np.ndarray:
+    """
+    Computes the heatmap of a station snapshot. Module level, so it also runs in a process pool.
+    With pollutants, an (n_stations, len(POLLUTANTS)) array, the heatmap also uses PM10, NO2 and O3
+    (see compute_heatmap).
+    """
+    if pollutants is None:
+        pollutants = [None] * len(data)
+    stations = [Station.from_values(latitude, longitude, *values,
+                                    pollutants=None if row is None else dict(zip(POLLUTANTS, row)))
+                for (latitude, longitude), values, row in zip(coordinates, data, pollutants)]
+    return compute_heatmap(Map(np.array(stations), size=size), pollutants=pollutants[0] is not None)
+
+
+async def stub_source(stations: list[dict], interval: float = 0.1, noise: float = 2.0, n_readings: int = None, seed=None):
+    """
+    Local stand-in for OpenAQ: emits readings of the given stations in turn, with the air
+    quality following a random walk.
+
+    Parameters:
+    - stations (list[dict]): Stations with location_id, latitude, longitude, air_quality,
+      population_density and veg_cover.
+    - interval (float): Seconds between readings.
+    - noise (float): Standard deviation of an air quality step.
+    - n_readings (int): Stop after this many readings (default: never).
+    - seed: Seed of the random walk.
+    """
+    rng = np.random.default_rng(seed)
+    air_quality = np.array([station['air_quality'] for station in stations], dtype=float)
+    count = 0
+    while n_readings is None or count < n_readings:
+        index = count % len(stations)
+        air_quality[index] = max(0.0, air_quality[index] + rng.normal(scale=noise))
+        yield {**stations[index], 'air_quality': float(air_quality[index]), 'time': time.time()}
+        count += 1
+        await asyncio.sleep(interval)
+
+
+async def openaq_source(location_ids: list[int], station_data: dict[int, tuple[float, float]], poll_interval: float = 600.0,
+                        executor: Executor = None):
+    """
+    Polls the latest readings of the locations from OpenAQ, forever: one /latest request per
+    location and poll gives PM2.5 ('air_quality') and all POLLUTANTS ('pollutants'). The blocking requests
+    run in an executor, FETCH_CONCURRENCY at a time, and readings are emitted as they arrive.
+
+    Parameters:
+    - location_ids (list[int]): OpenAQ location ids.
+    - station_data (dict[int, tuple[float, float]]): (population_density, veg_cover) per location id.
+    - poll_interval (float): Seconds between two polls of the same location.
+    - executor (Executor): Executor for the requests (default: the event loop's).
+    """
+    from openaq_api import get_latest_measurements
+
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+
+    async def fetch(location_id: int) -> dict | None:
+        async with semaphore:
+            measurements, coordinates = await loop.run_in_executor(executor, get_latest_measurements, location_id)
+        if not coordinates:
+            return None
+        population_density, veg_cover = station_data[location_id]
+        return {'location_id': location_id, 'latitude': coordinates['latitude'], 'longitude': coordinates['longitude'],
+                'air_quality': measurements.get('pm25', MISSING),
+                'pollutants': {name: measurements[name] for name in POLLUTANTS if name in measurements},
+                'population_density': population_density, 'veg_cover': veg_cover, 'time': time.time()}
+
+    while True:
+        started = loop.time()
+        for reading in asyncio.as_completed([fetch(location_id) for location_id in location_ids]):
+            reading = await reading
+            if reading is not None:
+                yield reading
+        await asyncio.sleep(max(0.0, poll_interval - (loop.time() - started)))
+
+
+class Pipeline:
+    def __init__(self, source, size: int = 100, debounce: float = DEBOUNCE, executor: Executor = None,
+                 ingest_queue_size: int = INGEST_QUEUE_SIZE, block_size: int = BLOCK_SIZE, tolerance: float = 0.0,
+                 pollutants: bool = False) -> None:
+        """
+        Long-running ingest -> coalesce -> compute -> publish pipeline.
+
+        Readings from the source update a station store. Updates arriving within the debounce
+        window are coalesced into one snapshot. Snapshots are computed in an executor, and while
+        a computation runs only the newest snapshot waits, older ones are superseded. Heatmaps
+        are published to every subscriber's bounded queue, together with a patch holding only the
+        blocks that changed since the previous version (see heatmap_diff.BlockDiffer).
+
+        Parameters:
+        - source: Async iterator of readings (see stub_source and openaq_source).
+        - size (int): Grid size of the heatmaps.
+        - debounce (float): Coalescing window in seconds.
+        - executor (Executor): Executor for the heatmap computations (default: a single thread).
+        - ingest_queue_size (int): Bound of the readings queue.
+        - block_size (int): Rows and columns per block of the patches.
+        - tolerance (float): Largest change of a cell that is left out of the patches.
+        - pollutants (bool): Also use the readings' PM10, NO2 and O3 ('pollutants', see openaq_source).
+          Readings without them count as missing those pollutants.
+        """
+        self.source = source
+        self.size = size
+        self.debounce = debounce
+        self.executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="heatmap")
+        self.ingest_queue = asyncio.Queue(maxsize=ingest_queue_size)
+        self.snapshot_queue = asyncio.Queue(maxsize=1)
+        self.differ = BlockDiffer(block_size, tolerance)
+        self.pollutants = pollutants
+        self.subscribers = []
+        self.stations = {}  # location_id -> latest reading
+        self.version = 0
+        self.stages = {
+            'ingest': StageMetrics('ingest'),
+            'coalesce': StageMetrics('coalesce', self.ingest_queue),
+            'compute': StageMetrics('compute', self.snapshot_queue),
+            'publish': StageMetrics('publish')
+        }
+
+    def subscribe(self, maxsize: int = SUBSCRIBER_QUEUE_SIZE) -> asyncio.Queue:
+        """
+        Registers a consumer. It receives dicts with 'version', 'heatmap', 'bounds', 'n_stations',
+        'age' (seconds from the oldest reading of the snapshot to publication) and 'patch' (from
+        the previous version), and None once the pipeline has stopped. A consumer that lost
+        versions resynchronizes from 'heatmap', e.g. with heatmap_diff.full_patch.
+        """
+        queue = asyncio.Queue(maxsize=maxsize)
+        self.subscribers.append(queue)
+        return queue
+
+    def metrics(self) -> dict:
+        """
+        Per stage: queue depth, processed and dropped items, and mean/max processing time.
+        """
+        summary = {name: stage.summary() for name, stage in self.stages.items()}
+        summary['publish']['subscriber_depths'] = [queue.qsize() for queue in self.subscribers]
+        return summary
+
+    async def _ingest(self) -> None:
+        async for reading in self.source:
+            start = time.perf_counter()
+            await self.ingest_queue.put(reading)  # Blocks the source while the queue is full
+            self.stages['ingest'].record(time.perf_counter() - start)
+        await self.ingest_queue.put(None)
+
+    async def _coalesce(self) -> None:
+        loop = asyncio.get_running_loop()
+        finished = False
+        while not finished:
+            reading = await self.ingest_queue.get()
+            if reading is None:
+                break
+            start = time.perf_counter()
+            oldest = reading['time']
+            self.stations[reading['location_id']] = reading
+            deadline = loop.time() + self.debounce
+            # Collect everything that arrives within the debounce window
+            while (timeout := deadline - loop.time()) > 0:
+                try:
+                    reading = await asyncio.wait_for(self.ingest_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if reading is None:
+                    finished = True
+                    break
+                oldest = min(oldest, reading['time'])
+                self.stations[reading['location_id']] = reading
+
+            if len(self.stations) >= 2:
+                readings = list(self.stations.values())
+                snapshot = {
+                    'coordinates': np.array([[reading['latitude'], reading['longitude']] for reading in readings]),
+                    'data': np.array([[reading['air_quality'], reading['population_density'], reading['veg_cover']]
+                                      for reading in readings], dtype=float),
+                    'oldest': oldest
+                }
+                if self.pollutants:
+                    snapshot['pollutants'] = np.array([pollutant_vector({**reading.get('pollutants', {}), 'pm25': reading['air_quality']})
+                                                       for reading in readings])
+                if self.snapshot_queue.full():
+                    # The waiting snapshot is superseded, but its readings are still the oldest ones in the new one
+                    snapshot['oldest'] = min(oldest, self.snapshot_queue.get_nowait()['oldest'])
+                    self.stages['coalesce'].dropped += 1
+                self.snapshot_queue.put_nowait(snapshot)
+            self.stages['coalesce'].record(time.perf_counter() - start)
+        await self.snapshot_queue.put(None)
+
+    async def _compute(self) -> None:
+        loop = asyncio.get_running_loop()
+        while (snapshot := await self.snapshot_queue.get()) is not None:
+            start = time.perf_counter()
+            heatmap = await loop.run_in_executor(self.executor, compute_snapshot,
+                                                 snapshot['coordinates'], snapshot['data'], self.size,
+                                                 snapshot.get('pollutants'))
+            latitudes, longitudes = snapshot['coordinates'][:, 0], snapshot['coordinates'][:, 1]
+            bounds = {'min_lat': float(latitudes.min()), 'max_lat': float(latitudes.max()),
+                      'min_lon': float(longitudes.min()), 'max_lon': float(longitudes.max())}
+            # Checksumming scans the whole grid, so it stays off the event loop too
+            patch = await loop.run_in_executor(self.executor, self.differ.diff, heatmap, bounds)
+            self.stages['compute'].record(time.perf_counter() - start)
+            self._publish(heatmap, bounds, patch, snapshot)
+        for queue in self.subscribers:
+            _put_latest(queue, None)
+
+    def _publish(self, heatmap: np.ndarray, bounds: dict, patch: dict, snapshot: dict) -> None:
+        start = time.perf_counter()
+        self.version = patch['version']
+        result = {
+            'version': self.version,
+            'heatmap': heatmap,
+            'bounds': bounds,
+            'n_stations': len(snapshot['coordinates']),
+            'age': time.time() - snapshot['oldest'],
+            'patch': patch
+        }
+        for queue in self.subscribers:
+            if _put_latest(queue, result):
+                self.stages['publish'].dropped += 1
+        self.stages['publish'].record(time.perf_counter() - start)
+
+    async def run(self) -> None:
+        """
+        Runs the pipeline until the source is exhausted and everything is published, or until cancelled.
+        """
+        await asyncio.gather(self._ingest(), self._coalesce(), self._compute())
+
+
+if __name__ == "__main__":
+    import sys
+    from heatmap_diff import patch_summary
+
+    # Usage: python pipeline.py [n_readings] -- runs against the local stub source and a slow consumer
+    n_readings = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rng = np.random.default_rng(0)
+    stations = [{'location_id': index, 'latitude': 51.4 + 0.2 * rng.random(), 'longitude': -0.2 + 0.3 * rng.random(),
+                 'air_quality': float(rng.integers(0, 71)), 'population_density': float(rng.integers(0, 151)),
+                 'veg_cover': float(rng.integers(0, 101))} for index in range(20)]
+
+    async def consume(queue: asyncio.Queue) -> None:
+        while (result := await queue.get()) is not None:
+            patch = patch_summary(result['patch'])
+            logging.info(f"Heatmap v{result['version']} of {result['n_stations']} stations, age {result['age']:.2f} s, "
+                         f"{patch['changed_blocks']}/{patch['total_blocks']} blocks changed")
+            await asyncio.sleep(0.5)  # A slow consumer
+
+    async def main() -> None:
+        pipeline = Pipeline(stub_source(stations, interval=0.01, n_readings=n_readings, seed=0), size=300, debounce=0.2)
+        consumer = asyncio.create_task(consume(pipeline.subscribe()))
+        await pipeline.run()
+        await consumer
+        for name, summary in pipeline.metrics().items():
+            print(f"{name:>8}: {summary}")
+
+    asyncio.run(main())
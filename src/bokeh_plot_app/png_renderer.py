@@ -0,0 +1,192 @@
+import binascii
+import os
+import struct
+import zlib
+import numpy as np
+
+INFERNO_HEX = (
+    '00000401000501010601010802010a02020c02020e03021004031204031405041706041907051b08051d09061f0a0722'
+    '0b07240c08260d08290e092b10092d110a30120a32140b34150b37160b39180c3c190c3e1b0c411c0c431e0c451f0c48'
+    '210c4a230c4c240c4f260c51280b53290b552b0b572d0b592f0a5b310a5c320a5e340a5f3609613809623909633b0964'
+    '3d09653e0966400a67420a68440a68450a69470b6a490b6a4a0c6b4c0c6b4d0d6c4f0d6c510e6c520e6d540f6d550f6d'
+    '57106e59106e5a116e5c126e5d126e5f136e61136e62146e64156e65156e67166e69166e6a176e6c186e6d186e6f196e'
+    '71196e721a6e741a6e751b6e771c6d781c6d7a1d6d7c1d6d7d1e6d7f1e6c801f6c82206c84206b85216b87216b88226a'
+    '8a226a8c23698d23698f24699025689225689326679526679727669827669a28659b29649d29649f2a63a02a63a22b62'
+    'a32c61a52c60a62d60a82e5fa92e5eab2f5ead305dae305cb0315bb1325ab3325ab43359b63458b73557b93556ba3655'
+    'bc3754bd3853bf3952c03a51c13a50c33b4fc43c4ec63d4dc73e4cc83f4bca404acb4149cc4248ce4347cf4446d04545'
+    'd24644d34743d44842d54a41d74b3fd84c3ed94d3dda4e3cdb503bdd513ade5238df5337e05536e15635e25734e35933'
+    'e45a31e55c30e65d2fe75e2ee8602de9612bea632aeb6429eb6628ec6726ed6925ee6a24ef6c23ef6e21f06f20f1711f'
+    'f1731df2741cf3761bf37819f47918f57b17f57d15f67e14f68013f78212f78410f8850ff8870ef8890cf98b0bf98c0a'
+    'f98e09fa9008fa9207fa9407fb9606fb9706fb9906fb9b06fb9d07fc9f07fca108fca309fca50afca60cfca80dfcaa0f'
+    'fcac11fcae12fcb014fcb216fcb418fbb61afbb81dfbba1ffbbc21fbbe23fac026fac228fac42afac62df9c72ff9c932'
+    'f9cb35f8cd37f8cf3af7d13df7d340f6d543f6d746f5d949f5db4cf4dd4ff4df53f4e156f3e35af3e55df2e661f2e865'
+    'f2ea69f1ec6df1ed71f1ef75f1f179f2f27df2f482f3f586f3f68af4f88ef5f992f6fa96f8fb9af9fc9dfafda1fcffa4'
+)
+"""matplotlib's 'inferno' colormap as 256 packed RGB hex triplets, so rendering needs no matplotlib."""
+
+HOT_ANCHORS = {
+    'red': ([0, 0.365079, 1], [0.0416, 1, 1]),
+    'green': ([0, 0.365079, 0.746032, 1], [0, 0, 1, 1]),
+    'blue': ([0, 0.746032, 1], [0, 0, 1]),
+}
+"""Piecewise linear definition of matplotlib's 'hot' colormap."""
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def colormap_lut(name: str = 'inferno') -> np.ndarray:
+    """
+    Builds a 256-entry lookup table for a colormap.
+
+    Parameters:
+    - name (str): 'inferno' or 'hot'.
+
+    Returns:
+    - np.ndarray: A (256, 4) uint8 array of RGBA colors (fully opaque).
+    """
+    lut = np.full((256, 4), 255, dtype=np.uint8)
+    if name == 'inferno':
+        lut[:, :3] = np.frombuffer(bytes.fromhex(''.join(INFERNO_HEX)), dtype=np.uint8).reshape(256, 3)
+    elif name == 'hot':
+        positions = np.linspace(0, 1, 256)
+        for channel, (x, y) in enumerate(HOT_ANCHORS.values()):
+            lut[:, channel] = np.round(np.interp(positions, x, y) * 255)
+    else:
+        raise ValueError(f"Unknown colormap {name!r}, expected 'inferno' or 'hot'.")
+    return lut
+
+
+_LUTS = {name: colormap_lut(name) for name in ('inferno', 'hot')}
+
+
+def render_rgba(heatmap: np.ndarray, cmap: str = 'inferno', vmin: float = None, vmax: float = None,
+                alpha: int = 255, origin: str = 'lower', pixels_per_cell: int = 1) -> np.ndarray:
+    """
+    Maps a heatmap through a colormap lookup table into an RGBA image.
+
+    Parameters:
+    - heatmap (np.ndarray): 2D array of values. NaN cells become fully transparent.
+    - cmap (str): Name of the colormap, 'inferno' or 'hot'.
+    - vmin, vmax (float): Value range mapped onto the colormap (default: the range of the heatmap).
+    - alpha (int): Opacity (0-255) of the colored cells.
+    - origin (str): 'lower' puts row 0 of the heatmap at the bottom of the image (like plt.imshow
+      with origin='lower', as used for latitude rows), 'upper' puts it at the top.
+    - pixels_per_cell (int): Integer upscaling factor, every cell becomes a square of this many pixels.
+
+    Returns:
+    - np.ndarray: A (rows * pixels_per_cell, columns * pixels_per_cell, 4) uint8 array.
+    """
+    heatmap = np.asarray(heatmap, dtype=float)
+    if origin == 'lower':
+        heatmap = heatmap[::-1]
+    finite = np.isfinite(heatmap)
+    all_finite = finite.all()
+    if vmin is None:
+        vmin = float(heatmap.min() if all_finite else heatmap[finite].min(initial=0.0))
+    if vmax is None:
+        vmax = float(heatmap.max() if all_finite else heatmap[finite].max(initial=1.0))
+    scale = 255 / (vmax - vmin) if vmax > vmin else 0.0
+
+    # Scale into [0, 255] in a single float buffer, then look up all four channels at once as uint32
+    scaled = np.subtract(heatmap, vmin)
+    scaled *= scale
+    np.clip(scaled, 0, 255, out=scaled)
+    if not all_finite:
+        scaled[~finite] = 0
+    lut = _LUTS[cmap].copy()
+    lut[:, 3] = alpha
+    indices = scaled.astype(np.uint8)
+    if pixels_per_cell > 1:
+        indices = np.repeat(np.repeat(indices, pixels_per_cell, axis=0), pixels_per_cell, axis=1)
+        finite = np.repeat(np.repeat(finite, pixels_per_cell, axis=0), pixels_per_cell, axis=1)
+    rgba = lut.view(np.uint32).ravel()[indices].view(np.uint8).reshape(indices.shape + (4,))
+    if not all_finite:
+        rgba[~finite, 3] = 0
+    return rgba
+
+
+def draw_markers(rgba: np.ndarray, rows: np.ndarray, columns: np.ndarray, radius: int = 4,
+                 color: tuple[int, int, int, int] = (0, 128, 0, 255),
+                 edge_color: tuple[int, int, int, int] = (0, 0, 0, 255)) -> np.ndarray:
+    """
+    Draws filled circular markers with a one pixel edge onto an RGBA image, in place.
+
+    Parameters:
+    - rgba (np.ndarray): Image as returned by render_rgba.
+    - rows, columns (np.ndarray): Pixel coordinates of the marker centres (row 0 is the top of the image).
+    - radius (int): Marker radius in pixels.
+    - color, edge_color (tuple[int, int, int, int]): RGBA fill and edge colors.
+
+    Returns:
+    - np.ndarray: The same image, for chaining.
+    """
+    d_row, d_col = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+    distance_squared = (d_row ** 2 + d_col ** 2).ravel()
+    inside = distance_squared <= radius ** 2
+    d_row, d_col = d_row.ravel()[inside], d_col.ravel()[inside]
+    is_edge = distance_squared[inside] > (radius - 1) ** 2
+
+    pixel_rows = np.rint(np.asarray(rows)).astype(int)[:, None] + d_row[None, :]
+    pixel_cols = np.rint(np.asarray(columns)).astype(int)[:, None] + d_col[None, :]
+    colors = np.where(np.broadcast_to(is_edge, pixel_rows.shape)[..., None], edge_color, color).astype(np.uint8)
+    visible = (pixel_rows >= 0) & (pixel_rows < rgba.shape[0]) & (pixel_cols >= 0) & (pixel_cols < rgba.shape[1])
+    rgba[pixel_rows[visible], pixel_cols[visible]] = colors[visible]
+    return rgba
+
+
+def _chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', binascii.crc32(chunk_type + data))
+
+
+def encode_png(rgba: np.ndarray, compression_level: int = 1) -> bytes:
+    """
+    Encodes an RGBA (or single channel grayscale) uint8 image as PNG, using only zlib and NumPy.
+
+    Parameters:
+    - rgba (np.ndarray): A (rows, columns, 4) or (rows, columns) uint8 array.
+    - compression_level (int): zlib level from 0 to 9. Low levels are much faster, and heatmaps
+      compress well anyway.
+
+    Returns:
+    - bytes: The PNG file contents.
+    """
+    rgba = np.ascontiguousarray(rgba, dtype=np.uint8)
+    height, width = rgba.shape[:2]
+    color_type = 6 if rgba.ndim == 3 else 0  # RGBA or grayscale
+    # Every scanline starts with its filter type, 0 (None)
+    scanlines = np.zeros((height, 1 + rgba[0].nbytes), dtype=np.uint8)
+    scanlines[:, 1:] = rgba.reshape(height, -1)
+
+    header = struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0)
+    return (PNG_SIGNATURE
+            + _chunk(b'IHDR', header)
+            + _chunk(b'IDAT', zlib.compress(scanlines.tobytes(), compression_level))
+            + _chunk(b'IEND', b''))
+
+
+def write_png(path: str, rgba: np.ndarray, compression_level: int = 1) -> None:
+    """
+    Writes an image to a PNG file, atomically replacing any existing file.
+    """
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'wb') as file:
+        file.write(encode_png(rgba, compression_level))
+    os.replace(temporary_path, path)
+
+
+def export_tiles(rgba: np.ndarray, directory: str, tile_size: int = 256, compression_level: int = 1) -> list[str]:
+    """
+    Cuts an image into square tiles and writes each as directory/{tile_row}_{tile_column}.png.
+    Tiles on the right and bottom edges may be smaller than tile_size.
+
+    Returns:
+    - list[str]: The paths of the written tiles.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for tile_row, top in enumerate(range(0, rgba.shape[0], tile_size)):
+        for tile_col, left in enumerate(range(0, rgba.shape[1], tile_size)):
+            path = os.path.join(directory, f"{tile_row}_{tile_col}.png")
+            write_png(path, rgba[top:top + tile_size, left:left + tile_size], compression_level)
+            paths.append(path)
+    return paths
@@ -0,0 +1,290 @@
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+from mapApi import Map
+from heatmap_utils_api import (compute_need_for_action, label_names, label_raster, recommendation_raster,
+                               recommendation_table, RECOMMENDATION_VARIABLES, UNDEFINED_CODE)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+MAX_BATCH_POINTS = 4096
+"""A micro-batch is evaluated as soon as it holds this many points..."""
+MAX_BATCH_WAIT = 0.002
+"""...or when this many seconds have passed since its first request arrived."""
+LATENCY_WINDOW = 10000
+"""Number of most recent request latencies kept for the percentiles."""
+
+
+class LatencyTracker:
+    def __init__(self, window: int = LATENCY_WINDOW) -> None:
+        """
+        Keeps the latencies of the most recent requests and the sizes of the evaluated batches.
+        """
+        self._latencies = deque(maxlen=window)
+        self._batch_sizes = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.n_requests = 0
+        self.n_points = 0
+        self.n_batches = 0
+
+    def record_request(self, seconds: float, n_points: int) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+            self.n_requests += 1
+            self.n_points += n_points
+
+    def record_batch(self, n_points: int) -> None:
+        with self._lock:
+            self._batch_sizes.append(n_points)
+            self.n_batches += 1
+
+    def summary(self) -> dict:
+        """
+        Request and batch counters, with p50/p99 latency in milliseconds and the mean batch size.
+        """
+        with self._lock:
+            latencies = np.array(self._latencies)
+            batch_sizes = np.array(self._batch_sizes)
+            summary = {'requests': self.n_requests, 'points': self.n_points, 'batches': self.n_batches}
+        summary['p50_ms'] = float(np.percentile(latencies, 50) * 1000) if len(latencies) else None
+        summary['p99_ms'] = float(np.percentile(latencies, 99) * 1000) if len(latencies) else None
+        summary['mean_batch_points'] = float(batch_sizes.mean()) if len(batch_sizes) else None
+        return summary
+
+
+class MicroBatcher:
+    def __init__(self, map_obj: Map, max_batch_points: int = MAX_BATCH_POINTS, max_batch_wait: float = MAX_BATCH_WAIT,
+                 tracker: LatencyTracker = None) -> None:
+        """
+        Collects concurrent point queries into micro-batches, evaluated by one background thread
+        with a single vectorized interpolation and inference call per batch.
+
+        Parameters:
+        - map_obj (Map): The map to query. Kept warm for the lifetime of the batcher.
+        - max_batch_points (int): Evaluate a batch once it holds this many points.
+        - max_batch_wait (float): Evaluate a batch at the latest this many seconds after its first request.
+        - tracker (LatencyTracker): Receives the batch sizes.
+        """
+        self.map_obj = map_obj
+        self.max_batch_points = max_batch_points
+        self.max_batch_wait = max_batch_wait
+        self.tracker = tracker or LatencyTracker()
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, locations: np.ndarray) -> Future:
+        """
+        Queues (latitude, longitude) rows for evaluation.
+
+        Returns:
+        - Future: Resolves to the list of results of query_points, in the order of the locations.
+        """
+        future = Future()
+        self._requests.put((np.asarray(locations, dtype=float).reshape(-1, 2), future))
+        return future
+
+    def close(self) -> None:
+        self._requests.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            batch = [request]
+            n_points = len(request[0])
+            deadline = time.perf_counter() + self.max_batch_wait
+            # Keep collecting until the batch is full or the first request has waited long enough
+            while n_points < self.max_batch_points:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    self._requests.put(None)  # Stop after this batch
+                    break
+                batch.append(request)
+                n_points += len(request[0])
+            self._evaluate(batch)
+
+    def _evaluate(self, batch: list[tuple[np.ndarray, Future]]) -> None:
+        locations = np.concatenate([locations for locations, _ in batch])
+        self.tracker.record_batch(len(locations))
+        try:
+            results = query_points(self.map_obj, locations)
+        except Exception as e:
+            logging.error(f"Error evaluating a batch of {len(locations)} points: {e}")
+            if len(batch) > 1:
+                # Isolate the offending request: the others of the batch are evaluated on their own
+                for request in batch:
+                    self._evaluate([request])
+            else:
+                batch[0][1].set_exception(e)
+            return
+        start = 0
+        for locations, future in batch:
+            future.set_result(results[start:start + len(locations)])
+            start += len(locations)
+
+
+def query_points(map_obj: Map, locations: np.ndarray) -> list[dict]:
+    """
+    Evaluates 'need_for_action', the fuzzy labels and the recommendation at many locations.
+
+    Parameters:
+    - map_obj (Map): The map to query.
+    - locations (np.ndarray): Array of shape (n, 2) with (latitude, longitude) rows.
+
+    Returns:
+    - list[dict]: One result per location.
+    """
+    if len(locations) == 0:
+        return []
+    data = map_obj.get_data_batch(locations)
+    need_action = compute_need_for_action(data[:, 0], data[:, 1], data[:, 2])
+
+    # Labels and recommendations as code arrays, looked up in small tables instead of per point
+    values = (data[:, 0], data[:, 1], data[:, 2], need_action)
+    codes = [label_raster(value, variable) for variable, value in zip(RECOMMENDATION_VARIABLES, values)]
+    recommendations = recommendation_raster(*codes)
+    texts, _ = recommendation_table()
+    label_keys = ('air_quality_label', 'population_density_label', 'veg_cover_label', 'need_for_action_label')
+    # Indexed by code; UNDEFINED_CODE is the last entry
+    names = [label_names(variable) + ['Undefined'] * (UNDEFINED_CODE + 1 - len(label_names(variable)))
+             for variable in RECOMMENDATION_VARIABLES]
+
+    columns = zip(locations[:, 0].tolist(), locations[:, 1].tolist(), need_action.tolist(), data[:, 0].tolist(),
+                  data[:, 1].tolist(), data[:, 2].tolist(), *(code.tolist() for code in codes), recommendations.tolist())
+    return [{
+        'latitude': latitude,
+        'longitude': longitude,
+        'need_for_action': nfa,
+        'air_quality': aq,
+        'population_density': pd,
+        'veg_cover': vc,
+        **{key: labels[code] for key, labels, code in zip(label_keys, names, label_codes)},
+        'recommendation': texts[recommendation]
+    } for latitude, longitude, nfa, aq, pd, vc, *label_codes, recommendation in columns]
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    GET  /query?lat=..&lon=..                      single point
+    POST /query {"lat": .., "lon": ..}             single point
+    POST /query {"points": [[lat, lon], ...]}      bulk
+    GET  /metrics                                  latency percentiles and counters
+    """
+    batcher: MicroBatcher = None
+
+    def log_message(self, format, *args) -> None:
+        pass  # Per-request logging would dominate the latency
+
+    def _send_json(self, status: int, payload) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _answer(self, request: dict) -> None:
+        start = time.perf_counter()
+        try:
+            if 'points' in request:
+                locations, single = np.asarray(request['points'], dtype=float).reshape(-1, 2), False
+            else:
+                locations, single = np.array([[float(request['lat']), float(request['lon'])]]), True
+        except (KeyError, TypeError, ValueError) as e:
+            self._send_json(400, {'error': f"Expected lat/lon or points: {e}"})
+            return
+        valid = (np.isfinite(locations).all(axis=1) & (np.abs(locations[:, 0]) <= 90) & (np.abs(locations[:, 1]) <= 180))
+        if not valid.all():
+            self._send_json(400, {'error': f"Coordinates must be finite, with |lat| <= 90 and |lon| <= 180: "
+                                           f"{locations[~valid][:5].tolist()}"})
+            return
+        try:
+            results = self.batcher.submit(locations).result()
+        except Exception as e:
+            self._send_json(500, {'error': f"{type(e).__name__}: {e}"})
+            return
+        self.batcher.tracker.record_request(time.perf_counter() - start, len(locations))
+        self._send_json(200, results[0] if single else results)
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        if url.path == '/metrics':
+            self._send_json(200, self.batcher.tracker.summary())
+        elif url.path == '/query':
+            self._answer({key: values[0] for key, values in parse_qs(url.query).items()})
+        else:
+            self._send_json(404, {'error': f"Unknown path {url.path}"})
+
+    def do_POST(self) -> None:
+        if urlparse(self.path).path != '/query':
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except json.JSONDecodeError as e:
+            self._send_json(400, {'error': f"Invalid JSON: {e}"})
+            return
+        self._answer(request)
+
+
+class QueryServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # The http.server default of 5 resets connections under bursts of clients
+
+
+def make_server(map_obj: Map, host: str = '127.0.0.1', port: int = 8765, **batcher_kwargs) -> QueryServer:
+    """
+    Builds the query server. Call serve_forever() on the result to start it, and shutdown() plus
+    server.batcher.close() to stop it.
+
+    Parameters:
+    - map_obj (Map): The map to answer queries for.
+    - host (str): Interface to listen on.
+    - port (int): Port to listen on (0 picks a free port).
+    - batcher_kwargs: Passed on to MicroBatcher.
+    """
+    batcher = MicroBatcher(map_obj, **batcher_kwargs)
+    handler = type('BoundQueryHandler', (QueryHandler,), {'batcher': batcher})
+    server = QueryServer((host, port), handler)
+    server.batcher = batcher
+    return server
+
+
+if __name__ == "__main__":
+    import random
+    import sys
+    from mapApi import Station
+
+    # Usage: python query_service.py [port] [location_id ...]
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    location_ids = [int(loc_id) for loc_id in sys.argv[2:]] or [
+        3057947, 225719, 3057946, 3057945, 3057948,
+        225713, 225723, 155, 225848, 225767,
+        225802, 1235983, 3079185, 225755
+    ]
+    stations = [Station(location_id=loc_id, population_density=random.randint(10, 80), veg_cover=random.randint(1, 80))
+                for loc_id in location_ids]
+    server = make_server(Map(np.array(stations)), port=port)
+    logging.info(f"Serving need_for_action queries on http://127.0.0.1:{server.server_port}/query")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+        server.batcher.close()
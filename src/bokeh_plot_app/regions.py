@@ -0,0 +1,217 @@
+import json
+import logging
+import os
+import time
+import traceback
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from mapApi import Map, Station
+from heatmap_utils_api import compute_heatmap
+from hotspots import find_hotspots, describe_hotspots
+from png_renderer import render_rgba, write_png
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_REGION = {
+    'size': 100,
+    'n_hotspots': 5,
+    'hotspot_threshold': 60,
+    'seed': None
+}
+"""Settings used for every region that does not override them (in the config's 'defaults' or per region)."""
+MAX_ATTEMPTS = 2
+"""A region whose own worker process died is retried in a fresh pool this many times in total."""
+
+
+def load_config(path: str) -> list[dict]:
+    """
+    Loads a region config: a JSON object with a 'regions' list and optional 'defaults'.
+
+    Each region has a unique 'name' and either 'location_ids' (OpenAQ locations, fetched in the
+    worker) or 'stations' (objects with latitude, longitude, air_quality, population_density and
+    veg_cover). For location ids, 'station_data' can map an id to its [population_density, veg_cover];
+    ids without an entry get random values, drawn from the region's 'seed'.
+
+    Returns:
+    - list[dict]: The regions, with the defaults filled in.
+    """
+    with open(path) as file:
+        config = json.load(file)
+    defaults = {**DEFAULT_REGION, **config.get('defaults', {})}
+    regions = [{**defaults, **region} for region in config['regions']]
+    names = [region['name'] for region in regions]
+    assert len(set(names)) == len(names), f"Region names must be unique, got {names}"
+    return regions
+
+
+def build_stations(region: dict) -> tuple[list[Station], list[dict]]:
+    """
+    Builds the station store of a region.
+
+    Returns:
+    - tuple[list[Station], list[dict]]: The stations, and the location ids that could not be used with the reason.
+    """
+    if 'stations' in region:
+        return [Station.from_values(**station) for station in region['stations']], []
+
+    rng = np.random.default_rng(region['seed'])
+    station_data = region.get('station_data', {})
+    stations, skipped = [], []
+    for loc_id in region['location_ids']:
+        # Same ranges as the placeholder values in main.py
+        population_density, veg_cover = station_data.get(str(loc_id), (rng.integers(10, 81), rng.integers(1, 81)))
+        try:
+            station = Station(location_id=loc_id, population_density=population_density, veg_cover=veg_cover)
+        except Exception as e:
+            skipped.append({'location_id': loc_id, 'reason': f"{type(e).__name__}: {e}"})
+            continue
+        if station.latitude == 0.0 and station.longitude == 0.0:
+            skipped.append({'location_id': loc_id, 'reason': "No coordinates returned by OpenAQ"})
+            continue
+        stations.append(station)
+    return stations, skipped
+
+
+def run_region(region: dict, output_directory: str) -> dict:
+    """
+    Processes one region end to end: station store, spatial index, heatmap and outputs.
+    Never raises; failures are reported in the returned record with the stage they happened in.
+
+    Outputs, in output_directory/<name>/: heatmap.npy, heatmap.png and region.json.
+
+    Returns:
+    - dict: 'name', 'status' ('ok' or 'failed'), per-stage 'timings' in seconds and, on failure,
+      'stage', 'error' and 'traceback'.
+    """
+    record = {'name': region['name'], 'status': 'ok', 'pid': os.getpid(), 'timings': {}}
+    stage, start = 'stations', time.perf_counter()
+    try:
+        stations, skipped = build_stations(region)
+        record['n_stations'], record['skipped_stations'] = len(stations), skipped
+        if len(stations) < 2:
+            raise ValueError(f"Region needs at least 2 usable stations, got {len(stations)}")
+        record['timings'][stage] = time.perf_counter() - start
+
+        stage, start = 'index', time.perf_counter()
+        map_obj = Map(np.array(stations), size=region['size'])
+        record['bounds'] = {'min_lat': map_obj.min_lat, 'max_lat': map_obj.max_lat,
+                            'min_lon': map_obj.min_lon, 'max_lon': map_obj.max_lon}
+        record['timings'][stage] = time.perf_counter() - start
+
+        stage, start = 'heatmap', time.perf_counter()
+        heatmap = compute_heatmap(map_obj)
+        hotspots = describe_hotspots(find_hotspots(heatmap, k=region['n_hotspots'], min_separation=region['size'] / 10,
+                                                   threshold=region['hotspot_threshold']), map_obj)
+        record['heatmap_stats'] = {'mean': float(heatmap.mean()), 'max': float(heatmap.max()),
+                                   'cells_above_threshold': int((heatmap >= region['hotspot_threshold']).sum())}
+        record['timings'][stage] = time.perf_counter() - start
+
+        stage, start = 'outputs', time.perf_counter()
+        directory = os.path.join(output_directory, region['name'])
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'heatmap.npy'), heatmap)
+        write_png(os.path.join(directory, 'heatmap.png'), render_rgba(heatmap, cmap='hot', vmin=0, vmax=100))
+        with open(os.path.join(directory, 'region.json'), 'w') as file:
+            json.dump({**record, 'hotspots': hotspots}, file, indent=2, default=float)
+        record['timings'][stage] = time.perf_counter() - start
+    except Exception as e:
+        record['timings'][stage] = time.perf_counter() - start
+        record.update(status='failed', stage=stage, error=f"{type(e).__name__}: {e}", traceback=traceback.format_exc())
+    return record
+
+
+def _log_record(record: dict) -> None:
+    if record['status'] == 'ok':
+        logging.info(f"Region {record['name']}: {record['n_stations']} stations in {sum(record['timings'].values()):.2f} s")
+    else:
+        logging.error(f"Region {record['name']} failed during {record['stage']}: {record['error']}")
+
+
+def run_region_isolated(region: dict, output_directory: str) -> dict:
+    """
+    Runs one region in a single-worker pool of its own, so that a dying worker process can only be
+    blamed on this region. It is retried in a fresh pool up to MAX_ATTEMPTS times in total.
+
+    Returns:
+    - dict: The record of run_region, or a failed record with stage 'worker'.
+    """
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            try:
+                return executor.submit(run_region, region, output_directory).result()
+            except BrokenProcessPool as e:
+                error = e
+                logging.warning(f"Region {region['name']}: worker process died on its own (attempt {attempt}/{MAX_ATTEMPTS})")
+    return {'name': region['name'], 'status': 'failed', 'stage': 'worker',
+            'error': f"Worker process died {MAX_ATTEMPTS} times: {error}", 'timings': {}}
+
+
+def run_regions(regions: list[dict], output_directory: str, max_workers: int = None) -> dict:
+    """
+    Runs all regions in parallel over a process pool, one region per task, and writes the
+    combined summary to output_directory/summary.json.
+
+    An exception in a region only fails that region. If a worker process dies (e.g. killed for
+    running out of memory), the whole pool breaks and every unfinished region with it, so those
+    regions are only suspects: each is rerun in a single-worker pool of its own (see
+    run_region_isolated), where only the region that really kills its worker fails.
+
+    Parameters:
+    - regions (list[dict]): Regions, as returned by load_config.
+    - output_directory (str): Directory for the per-region outputs and the summary.
+    - max_workers (int): Size of the process pool, and number of suspects rerun at once (default:
+      number of CPUs, at most the number of regions).
+
+    Returns:
+    - dict: The summary, with the per-region records, the failures and the total wall time.
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    max_workers = min(max_workers or os.cpu_count() or 1, len(regions)) or 1
+    start = time.perf_counter()
+    records, suspects = {}, []
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run_region, region, output_directory): region for region in regions}
+        for future in as_completed(futures):
+            region = futures[future]
+            try:
+                records[region['name']] = future.result()
+            except BrokenProcessPool:
+                suspects.append(region)
+            else:
+                _log_record(records[region['name']])
+
+    if suspects:
+        logging.warning(f"A worker process died; rerunning {len(suspects)} unfinished regions one per pool")
+        # Threads only wait for their single-worker pools
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for record in executor.map(lambda region: run_region_isolated(region, output_directory), suspects):
+                records[record['name']] = record
+                _log_record(record)
+
+    ordered = [records[region['name']] for region in regions]
+    summary = {
+        'wall_seconds': time.perf_counter() - start,
+        'n_regions': len(regions),
+        'n_failed': sum(record['status'] != 'ok' for record in ordered),
+        'regions': ordered,
+        'failures': [{key: record[key] for key in ('name', 'stage', 'error')} for record in ordered if record['status'] != 'ok']
+    }
+    with open(os.path.join(output_directory, 'summary.json'), 'w') as file:
+        json.dump(summary, file, indent=2, default=float)
+    return summary
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Usage: python regions.py regions.json [output_directory]
+    summary = run_regions(load_config(sys.argv[1]), sys.argv[2] if len(sys.argv) > 2 else 'region_outputs')
+    print(f"{summary['n_regions'] - summary['n_failed']}/{summary['n_regions']} regions done in {summary['wall_seconds']:.2f} s")
+    for record in summary['regions']:
+        timings = ", ".join(f"{stage} {seconds:.2f} s" for stage, seconds in record['timings'].items())
+        print(f"  {record['name']:<20} {record['status']:<7} {timings}")
+    for failure in summary['failures']:
+        print(f"  FAILED {failure['name']} during {failure['stage']}: {failure['error']}")
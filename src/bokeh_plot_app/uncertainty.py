@@ -0,0 +1,126 @@
+import logging
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from mapApi import Map
+from heatmap_utils_api import compute_need_for_action, get_grid_locations
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_SIGMA = (5.0, 15.0, 15.0)
+"""Default standard deviation of the (air_quality, population_density, veg_cover) station data.
+Air quality follows typical PM2.5 sensor noise, the others reflect that they are estimates."""
+POINTS_PER_CHUNK = 1 << 20
+"""Upper bound on samples x grid cells interpolated and inferred together, which bounds memory use."""
+PARALLEL_SAMPLES = 256
+"""From this many samples on, the chunks are spread over a process pool."""
+
+
+def perturb_station_data(data: np.ndarray, n_samples: int, sigma: tuple[float, float, float],
+                         rng: np.random.Generator) -> np.ndarray:
+    """
+    Draws n_samples perturbed copies of the station data at once.
+
+    Parameters:
+    - data (np.ndarray): Station data of shape (n_stations, 3).
+    - n_samples (int): Number of perturbed copies.
+    - sigma (tuple[float, float, float]): Standard deviation of the Gaussian noise per channel.
+    - rng (np.random.Generator): Source of randomness.
+
+    Returns:
+    - np.ndarray: Array of shape (n_samples, n_stations, 3). Negative values are clipped to 0,
+      and missing data (-1) is left untouched.
+    """
+    noise = rng.normal(size=(n_samples,) + data.shape) * np.asarray(sigma, dtype=float)
+    samples = np.maximum(data[None, :, :] + noise, 0)
+    return np.where(data[None, :, :] == -1, -1, samples)
+
+
+def _accumulate(data: np.ndarray, indices: np.ndarray, weights: np.ndarray, n_samples: int,
+                sigma: tuple[float, float, float], threshold: float, seed: np.random.SeedSequence,
+                samples_per_chunk: int) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Runs n_samples Monte Carlo samples. Returns the unperturbed heatmap and, per cell, the sum and
+    sum of squares of the deviations from it and the exceedance count. Used both in-process and in
+    pool workers.
+    """
+    rng = np.random.default_rng(seed)
+    n_cells = len(indices)
+    total = np.zeros(n_cells)
+    total_squared = np.zeros(n_cells)
+    exceed = np.zeros(n_cells, dtype=np.int64)
+    # Deviations are taken relative to the unperturbed heatmap, which keeps the variance numerically stable
+    base = compute_need_for_action(*np.einsum('nk,nkc->nc', weights, data[indices]).T)
+
+    for start in range(0, n_samples, samples_per_chunk):
+        chunk = min(samples_per_chunk, n_samples - start)
+        samples = perturb_station_data(data, chunk, sigma, rng)
+        # (chunk, n_cells, 3): the interpolation weights are shared by all samples
+        interpolated = np.zeros((chunk, n_cells, data.shape[1]))
+        for k in range(indices.shape[1]):
+            interpolated += weights[None, :, k, None] * samples[:, indices[:, k]]
+        need_action = compute_need_for_action(*np.moveaxis(interpolated, -1, 0))
+        deviation = need_action - base
+        total += deviation.sum(axis=0)
+        total_squared += (deviation ** 2).sum(axis=0)
+        exceed += (need_action >= threshold).sum(axis=0)
+
+    return base, total, total_squared, exceed
+
+
+def uncertainty_maps(map_obj: Map, n_samples: int = 100, sigma: tuple[float, float, float] = DEFAULT_SIGMA,
+                     threshold: float = 60, seed: int = None, samples_per_chunk: int = None,
+                     max_workers: int = None) -> dict[str, np.ndarray]:
+    """
+    Monte Carlo estimate of how the station uncertainty propagates into the heatmap.
+
+    Every sample perturbs the station data, interpolates it onto the grid and runs the fuzzy
+    inference, with all samples of a chunk processed as one batch. Only running sums are kept,
+    so memory depends on the chunk size and not on n_samples. From PARALLEL_SAMPLES samples on,
+    chunks are distributed over a process pool.
+
+    Parameters:
+    - map_obj (Map): The map object containing stations and data.
+    - n_samples (int): Number of Monte Carlo samples (M).
+    - sigma (tuple[float, float, float]): Standard deviation of the (air_quality, population_density, veg_cover) noise.
+    - threshold (float): 'need_for_action' level for the exceedance probability.
+    - seed (int): Seed for reproducible sampling.
+    - samples_per_chunk (int): Number of samples processed as one batch (default: bounded by POINTS_PER_CHUNK).
+    - max_workers (int): Size of the process pool (default: number of CPUs).
+
+    Returns:
+    - dict[str, np.ndarray]: (size, size) grids 'mean', 'std' and 'exceedance_probability'.
+    """
+    indices, weights = map_obj.get_interpolation_weights(get_grid_locations(map_obj).reshape(-1, 2))
+    data = np.asarray(map_obj.data, dtype=float)
+    seed_sequence = np.random.SeedSequence(seed)
+    if samples_per_chunk is None:
+        samples_per_chunk = max(1, POINTS_PER_CHUNK // len(indices))
+
+    if n_samples >= PARALLEL_SAMPLES:
+        max_workers = max_workers or os.cpu_count() or 1
+        # A few tasks per worker keeps the pool balanced
+        n_tasks = min(4 * max_workers, -(-n_samples // samples_per_chunk))
+        task_samples = np.diff(np.linspace(0, n_samples, n_tasks + 1).astype(int))
+        seeds = seed_sequence.spawn(n_tasks)
+        logging.info(f"Running {n_samples} samples as {n_tasks} tasks on {max_workers} processes.")
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_accumulate, *zip(*[
+                (data, indices, weights, int(m), sigma, threshold, task_seed, samples_per_chunk)
+                for m, task_seed in zip(task_samples, seeds)
+            ])))
+        base = results[0][0]
+        total, total_squared, exceed = (sum(result[i] for result in results) for i in (1, 2, 3))
+    else:
+        base, total, total_squared, exceed = _accumulate(data, indices, weights, n_samples, sigma,
+                                                         threshold, seed_sequence, samples_per_chunk)
+
+    mean_deviation = total / n_samples
+    variance = np.maximum(total_squared / n_samples - mean_deviation ** 2, 0) * n_samples / max(n_samples - 1, 1)
+    shape = (map_obj.size, map_obj.size)
+    return {
+        'mean': (base + mean_deviation).reshape(shape),
+        'std': np.sqrt(variance).reshape(shape),
+        'exceedance_probability': (exceed / n_samples).reshape(shape)
+    }
@@ -0,0 +1,159 @@
+import numpy as np
+from mapApi import Map
+from heatmap_utils_api import compute_need_for_action, interpolate_grid, MAX_VC
+
+CELLS_PER_BATCH = 1 << 18
+"""Upper bound on the number of affected cells evaluated in one batch of candidates."""
+
+
+def disk_offsets(radius: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Row and column offsets of all grid cells within radius (in cells) of a centre cell.
+    """
+    r = int(np.floor(radius))
+    d_row, d_col = np.mgrid[-r:r + 1, -r:r + 1]
+    inside = d_row ** 2 + d_col ** 2 <= radius ** 2
+    return d_row[inside], d_col[inside]
+
+
+class WhatIfEngine:
+    def __init__(self, air_pollution: np.ndarray, population_density: np.ndarray, veg_cover: np.ndarray,
+                 need_for_action: np.ndarray = None) -> None:
+        """
+        Evaluates candidate green-area interventions against a set of interpolated base fields.
+
+        The base fields are computed once, and every candidate only recomputes the cells
+        inside its radius. Candidates are evaluated in batches through the vectorized
+        fuzzy inference engine.
+
+        Parameters:
+        - air_pollution (np.ndarray): Interpolated air pollution grid (µg/m³).
+        - population_density (np.ndarray): Interpolated population density grid (inhabitants/ha).
+        - veg_cover (np.ndarray): Interpolated vegetation cover grid (%).
+        - need_for_action (np.ndarray): Base 'need_for_action' grid. Computed if not given.
+        """
+        self.air_pollution = np.asarray(air_pollution, dtype=float)
+        self.population_density = np.asarray(population_density, dtype=float)
+        self.veg_cover = np.array(veg_cover, dtype=float)  # Copied, as apply() updates it in place
+        self.shape = self.veg_cover.shape
+
+        if need_for_action is None:
+            need_for_action = compute_need_for_action(self.air_pollution, self.population_density, self.veg_cover)
+        self.need_for_action = np.array(need_for_action, dtype=float)
+
+        # Cells without any data are never affected by an intervention
+        self.valid = ~((self.air_pollution == -1) & (self.population_density == -1) & (self.veg_cover == -1))
+        self._offsets = {}
+
+    @classmethod
+    def from_map(cls, map_obj: Map) -> 'WhatIfEngine':
+        """
+        Builds the engine from the interpolated fields of a map.
+        """
+        return cls(*interpolate_grid(map_obj))
+
+    def __str__(self) -> str:
+        return (f"WhatIfEngine on a {self.shape[0]}x{self.shape[1]} grid, "
+                f"total need for action = {self.need_for_action.sum():.2f}")
+
+    def _get_offsets(self, radius: float) -> tuple[np.ndarray, np.ndarray]:
+        if radius not in self._offsets:
+            self._offsets[radius] = disk_offsets(radius)
+        return self._offsets[radius]
+
+    def affected_cells(self, locations: np.ndarray, radius: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Flat indices of the valid cells within radius of each location.
+
+        Parameters:
+        - locations (np.ndarray): Array of shape (n, 2) with (row, column) grid locations.
+        - radius (float): Radius of the interventions, in cells.
+
+        Returns:
+        - tuple[np.ndarray, np.ndarray]: (candidate index, flat cell index) for every affected cell.
+        """
+        locations = np.asarray(locations).reshape(-1, 2)
+        d_row, d_col = self._get_offsets(radius)
+        rows = np.rint(locations[:, 0]).astype(int)[:, None] + d_row[None, :]
+        cols = np.rint(locations[:, 1]).astype(int)[:, None] + d_col[None, :]
+        candidates = np.broadcast_to(np.arange(len(locations))[:, None], rows.shape)
+
+        inside = (rows >= 0) & (rows < self.shape[0]) & (cols >= 0) & (cols < self.shape[1])
+        rows, cols, candidates = rows[inside], cols[inside], candidates[inside]
+        cells = rows * self.shape[1] + cols
+
+        valid = self.valid.ravel()[cells]
+        return candidates[valid], cells[valid]
+
+    def _evaluate_cells(self, candidates: np.ndarray, cells: np.ndarray, added_veg_cover: np.ndarray) -> np.ndarray:
+        """
+        Change in 'need_for_action' for each (candidate, cell) pair.
+        """
+        new_veg_cover = np.minimum(self.veg_cover.ravel()[cells] + added_veg_cover[candidates], MAX_VC - 1)
+        new_need_action = compute_need_for_action(self.air_pollution.ravel()[cells],
+                                                  self.population_density.ravel()[cells],
+                                                  new_veg_cover)
+        return new_need_action - self.need_for_action.ravel()[cells]
+
+    def evaluate(self, locations: np.ndarray, radii: np.ndarray, added_veg_cover: np.ndarray,
+                 cells_per_batch: int = CELLS_PER_BATCH) -> dict[str, np.ndarray]:
+        """
+        Evaluates many candidate interventions without modifying the base fields.
+
+        Parameters:
+        - locations (np.ndarray): Array of shape (n, 2) with (row, column) grid locations.
+        - radii (np.ndarray): Radius of each intervention in cells, or one radius for all.
+        - added_veg_cover (np.ndarray): Added vegetation cover (%) of each intervention, or one value for all.
+        - cells_per_batch (int): Approximate number of affected cells pushed through inference at once.
+
+        Returns:
+        - dict[str, np.ndarray]: Per candidate
+            'delta_total': change in total 'need_for_action' (negative is an improvement),
+            'delta_weighted': change in population-weighted 'need_for_action',
+            'n_cells': number of affected cells.
+        """
+        locations = np.asarray(locations, dtype=float).reshape(-1, 2)
+        n_candidates = len(locations)
+        radii = np.broadcast_to(np.asarray(radii, dtype=float), (n_candidates,))
+        added_veg_cover = np.broadcast_to(np.asarray(added_veg_cover, dtype=float), (n_candidates,))
+
+        delta_total = np.zeros(n_candidates)
+        delta_weighted = np.zeros(n_candidates)
+        n_cells = np.zeros(n_candidates, dtype=int)
+
+        # Candidates sharing a radius share their stencil, so they are batched together
+        for radius in np.unique(radii):
+            group = np.flatnonzero(radii == radius)
+            stencil_size = len(self._get_offsets(radius)[0])
+            batch_size = max(1, cells_per_batch // stencil_size)
+
+            for start in range(0, len(group), batch_size):
+                batch = group[start:start + batch_size]
+                candidates, cells = self.affected_cells(locations[batch], radius)
+                delta = self._evaluate_cells(candidates, cells, added_veg_cover[batch])
+                weights = self.population_density.ravel()[cells]
+
+                delta_total[batch] = np.bincount(candidates, weights=delta, minlength=len(batch))
+                delta_weighted[batch] = np.bincount(candidates, weights=delta * weights, minlength=len(batch))
+                n_cells[batch] = np.bincount(candidates, minlength=len(batch))
+
+        return {'delta_total': delta_total, 'delta_weighted': delta_weighted, 'n_cells': n_cells}
+
+    def apply(self, location: tuple[float, float], radius: float, added_veg_cover: float) -> float:
+        """
+        Applies a single intervention to the base fields, recomputing only the affected cells.
+
+        Parameters:
+        - location (tuple[float, float]): The (row, column) grid location.
+        - radius (float): Radius of the intervention in cells.
+        - added_veg_cover (float): Added vegetation cover (%).
+
+        Returns:
+        - float: The change in total 'need_for_action'.
+        """
+        candidates, cells = self.affected_cells(np.array([location]), radius)
+        delta = self._evaluate_cells(candidates, cells, np.array([added_veg_cover], dtype=float))
+
+        self.veg_cover.ravel()[cells] = np.minimum(self.veg_cover.ravel()[cells] + added_veg_cover, MAX_VC - 1)
+        self.need_for_action.ravel()[cells] += delta
+        return float(delta.sum())
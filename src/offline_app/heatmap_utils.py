@@ -1,3 +1,5 @@
+import copy
+import threading
 import numpy as np
 import skfuzzy as fuzz
 from skfuzzy import control as ctrl
@@ -90,19 +92,31 @@ ctrl_sys = ctrl.ControlSystem([
     rule1, rule2, rule3, rule4, rule5, rule6 
 ])
 
-simulation = ctrl.ControlSystemSimulation(ctrl_sys)
+_sessions = threading.local()
 
-def run_simulation(query_location: tuple[int, int], map: Map, sim = simulation):
+def get_simulation() -> ctrl.ControlSystemSimulation:
+    """
+    The calling thread's simulation of ctrl_sys, created on first use. skfuzzy keeps simulation
+    state on the rule and term objects, so threads other than the main one simulate a deep copy.
+    """
+    if not hasattr(_sessions, 'simulation'):
+        system = ctrl_sys if threading.current_thread() is threading.main_thread() else copy.deepcopy(ctrl_sys)
+        _sessions.simulation = ctrl.ControlSystemSimulation(system)
+    return _sessions.simulation
+
+def run_simulation(query_location: tuple[int, int], map: Map, sim = None):
     """
     Run simulation, given query location on the given map.
     
     Parameters:
     - query_location (tuple[float, float]): The (x, y) location on the map grid (float-based).
     - map_obj (Map): The map object containing stations and data.
+    - sim (ctrl.ControlSystemSimulation): Simulation to use (default: the calling thread's, see get_simulation).
     
     Returns:
     - float: Simulated 'need_for_action' value.
     """
+    sim = sim or get_simulation()
     air_pollution, population_density, veg_cover = map.get_data(query_location)
     sim.input['veg_cover'] = veg_cover                      # Vegetation Cover (%)
     sim.input['air_pollution'] = air_pollution              # µg/m³
@@ -111,9 +125,11 @@ def run_simulation(query_location: tuple[int, int], map: Map, sim = simulation):
     return sim.output['need_for_action']
 
 
-def generate_random_stations(n_stations: int, map_size: int, max_ap: int = MAX_AP, max_pd: int = MAX_PD, max_vc: int = MAX_VC) -> np.ndarray[Station]:
+def generate_random_stations(n_stations: int, map_size: int, max_ap: int = MAX_AP, max_pd: int = MAX_PD, max_vc: int = MAX_VC,
+                             distribution: str = 'uniform', seed=None) -> np.ndarray[Station]:
     """
     Generates an array of n_stations stations, placed randomly (but all with unique locations) on the map with random data.
+    For large scenarios, use scenarios.generate_station_set directly to skip creating Station objects.
 
     Parameters:
         n_stations:
@@ -126,29 +142,21 @@ def generate_random_stations(n_stations: int, map_size: int, max_ap: int = MAX_A
             Maximum value for randomly drawn population density data. Should be less than 151.
         max_vc:
             Maximum value for randomly drawn vegetation cover data. Should be less than 101.
+        distribution:
+            Spatial distribution of the stations, one of scenarios.DISTRIBUTIONS
+        seed:
+            Seed for reproducible stations
     
     Returns:
         An np.array of stations
     """    
-    assert max_ap <= MAX_AP, f"max_ap can not be >{MAX_AP}"
-    assert max_pd <= MAX_PD, f"max_pd can not be >{MAX_PD}"
-    assert max_vc <= MAX_VC, f"max_vc can not be >{MAX_VC}"
-
-    # Random values for stations
-    random_locations = generate_unique_random_locations(n_locations=n_stations, map_size=map_size)
-    random_aq = np.random.randint(low=0, high=max_ap, size=n_stations)
-    random_pd = np.random.randint(low=0, high=max_pd, size=n_stations)
-    random_vc = np.random.randint(low=0, high=max_vc, size=n_stations)
-    # Initiate random stations
-    stations = [Station(random_locations[i], random_aq[i], random_pd[i], random_vc[i]) for i in range(n_stations)]
-    return np.array(stations)
-
-def generate_unique_random_locations(n_locations: int, map_size: int) -> list[tuple[int, int]]:
+    from scenarios import generate_station_set  # scenarios imports the limits from this module
+    return generate_station_set(n_stations, map_size, distribution=distribution, seed=seed,
+                                max_ap=max_ap, max_pd=max_pd, max_vc=max_vc).to_stations()
+
+def generate_unique_random_locations(n_locations: int, map_size: int, seed=None) -> list[tuple[int, int]]:
         """
         Generates a list of n_locations unique locations where x,y < map_size
         """
-        assert n_locations <= map_size**2, f"The map is too small to have this many unique locations!\n({n_locations=}, {map_size=})"
-        unique_locations = set()
-        while len(unique_locations) < n_locations:
-            unique_locations.add((np.random.randint(0, map_size), np.random.randint(0, map_size)))
-        return list(unique_locations)
\ No newline at end of file
+        from scenarios import sample_unique_locations
+        return [(int(x), int(y)) for x, y in sample_unique_locations(n_locations, map_size, seed=seed)]
\ No newline at end of file
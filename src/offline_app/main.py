@@ -1,30 +1,55 @@
+import os
+import sys
 import matplotlib.pyplot as plt
 import numpy as np
 from map import Map
-from heatmap_utils import run_simulation, generate_random_stations
-from tqdm import tqdm
+from heatmap_utils import run_simulation, generate_random_stations, ctrl_sys
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# The heatmap cache and checkpointing are deliberately shared with the bokeh app rather than copied into this app.
+# The path is appended, so this app's own modules (map, station, heatmap_utils) still take precedence
+sys.path.append(os.path.join(APP_DIR, '..', 'bokeh_plot_app'))
+from heatmap_cache import HeatmapCache, fuzzy_config_fingerprint  # noqa: E402
+from checkpoint import run_checkpointed  # noqa: E402
 
 if __name__ == "__main__":
     # Size of map, and number of stations on the map
     MAP_SIZE, N_STATIONS = 50, 50
     # NB: Significantly affects computation time - Output is computed for MAP_SIZE^2 locations
+    # Seed of the stations (python main.py [seed]). The same stations give the same checkpoint key,
+    # so an interrupted run resumes when started again
+    SEED = int(sys.argv[1]) if len(sys.argv) > 1 else 0
 
-# Initiate map
-stations = generate_random_stations(n_stations=N_STATIONS, map_size=MAP_SIZE)
-map = Map(stations, size=MAP_SIZE)
+    # Initiate map
+    stations = generate_random_stations(n_stations=N_STATIONS, map_size=MAP_SIZE, seed=SEED)
+    map = Map(stations, size=MAP_SIZE)
 
-# Compute heatmap
-heatmap = np.empty((map.size, map.size))
-for i in tqdm(range(map.size)):
-    for j in range(map.size):
-        heatmap[i,j] = run_simulation((i,j), map=map)
+    # Compute heatmap, unless this exact station snapshot was computed before (re-running with the same seed hits the cache)
+    heatmap_cache = HeatmapCache(os.path.join(APP_DIR, '.heatmap_cache'))
+    cache_key = HeatmapCache.make_key(
+        coordinates=np.array([station.location for station in stations]),
+        data=np.array([station.data for station in stations]),
+        grid_spec={'size': map.size},
+        fuzzy_config=fuzzy_config_fingerprint(ctrl_sys)
+    )
+    cached = heatmap_cache.get(cache_key)
+    if cached is not None:
+        heatmap = cached[0]['heatmap']
+    else:
+        # Rows are computed and checkpointed in bands, so an interrupted run resumes where it stopped
+        def compute_band(start, stop):
+            return np.array([[run_simulation((i,j), map=map) for j in range(map.size)] for i in range(start, stop)])
+        heatmap = run_checkpointed(cache_key, (map.size, map.size), compute_band,
+                                   directory=os.path.join(APP_DIR, '.heatmap_checkpoints'))
+        heatmap_cache.put(cache_key, {'heatmap': heatmap})
+    print(heatmap_cache)
 
-# Plot heatmap figure
-plt.imshow(heatmap, cmap='hot', interpolation='bicubic')
-plt.colorbar(label='Need for action')
-plt.title('Need for green areas', pad=10)
-plt.xlabel("West <----> East")
-plt.ylabel("South <----> North")
-plt.scatter([x for x,y in map.data.keys()], [y for x,y in map.data.keys()], color='g', marker='o', label="Stations")
-plt.legend()
-plt.show()
\ No newline at end of file
+    # Plot heatmap figure
+    plt.imshow(heatmap, cmap='hot', interpolation='bicubic')
+    plt.colorbar(label='Need for action')
+    plt.title('Need for green areas', pad=10)
+    plt.xlabel("West <----> East")
+    plt.ylabel("South <----> North")
+    plt.scatter([x for x,y in map.data.keys()], [y for x,y in map.data.keys()], color='g', marker='o', label="Stations")
+    plt.legend()
+    plt.show()
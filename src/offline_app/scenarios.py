@@ -0,0 +1,158 @@
+import numpy as np
+from map import Station
+from heatmap_utils import MAX_AP, MAX_PD, MAX_VC
+
+DISTRIBUTIONS = ('uniform', 'clustered', 'gradient', 'collinear')
+"""Spatial distributions of the generated stations:
+'uniform' anywhere on the map, 'clustered' around a few random centres, 'gradient' dense in the
+city centre and sparser towards the edges, 'collinear' on a few straight lines of cells, which
+forces Map.get_data to widen its search for a valid triangle."""
+MAX_SAMPLING_ROUNDS = 50
+"""Number of oversampling rounds before giving up on finding enough unique cells."""
+
+
+class StationSet:
+    def __init__(self, locations: np.ndarray, data: np.ndarray) -> None:
+        """
+        Array-backed set of stations, cheap enough to hold millions of stations.
+
+        Parameters:
+            locations:
+                Array of shape (n, 2) with the unique (x, y) grid cells of the stations.
+            data:
+                Array of shape (n, 3) with the (air_quality, population_density, veg_cover) of the stations.
+        """
+        assert len(locations) == len(data), f"Got {len(locations)} locations but {len(data)} data rows."
+        self.locations = locations
+        self.data = data
+
+    def __len__(self) -> int:
+        return len(self.locations)
+
+    def __str__(self) -> str:
+        return f"StationSet with {len(self)} stations spanning {self.locations.min(axis=0)} to {self.locations.max(axis=0)}."
+
+    def to_stations(self) -> np.ndarray:
+        """
+        Converts the set to an array of Station objects, as used by Map.
+        """
+        return np.array([Station((int(x), int(y)), *values) for (x, y), values in zip(self.locations, self.data)])
+
+
+def _line_cells(map_size: int, rng: np.random.Generator, n_lines: int) -> np.ndarray:
+    # All cells of n_lines random rows, columns or diagonals, so the cells are exactly collinear
+    directions = np.array([[1, 0], [0, 1], [1, 1], [1, -1]])
+    line_directions = directions[rng.integers(0, len(directions), size=n_lines)]
+    line_starts = rng.integers(0, map_size, size=(n_lines, 2))
+    steps = np.arange(-map_size, map_size)[None, :, None]
+    cells = (line_starts[:, None] + steps * line_directions[:, None]).reshape(-1, 2)
+    cells = cells[np.all((cells >= 0) & (cells < map_size), axis=1)]
+    return np.unique(cells[:, 0] * map_size + cells[:, 1])
+
+
+def sample_unique_locations(n_locations: int, map_size: int, distribution: str = 'uniform', seed=None,
+                            n_clusters: int = 5, cluster_spread: float = 0.05, n_lines: int = 3) -> np.ndarray:
+    """
+    Samples n_locations unique grid cells where x, y < map_size, without replacement.
+
+    The uniform and collinear distributions sample directly from their cells without replacement.
+    The clustered and gradient distributions oversample in vectorized rounds and keep the first
+    occurrence of every cell, so the cost grows with n_locations and not with the size of the map.
+
+    Parameters:
+        n_locations:
+            Number of locations to sample.
+        map_size:
+            Length of map along one axis.
+        distribution:
+            One of DISTRIBUTIONS.
+        seed:
+            Seed (or np.random.Generator) for reproducible scenarios.
+        n_clusters, cluster_spread:
+            'clustered': number of cluster centres, and their standard deviation relative to map_size.
+        n_lines:
+            'collinear': number of lines the stations are placed on.
+
+    Returns:
+        An array of shape (n_locations, 2) with the (x, y) locations.
+    """
+    assert distribution in DISTRIBUTIONS, f"distribution must be one of {DISTRIBUTIONS}, not {distribution!r}"
+    assert n_locations <= map_size**2, f"The map is too small to have this many unique locations!\n({n_locations=}, {map_size=})"
+    rng = np.random.default_rng(seed)
+
+    if distribution == 'uniform':
+        linear = rng.choice(map_size**2, size=n_locations, replace=False)
+    elif distribution == 'collinear':
+        cells = _line_cells(map_size, rng, n_lines)
+        if len(cells) < n_locations:
+            raise ValueError(f"{n_lines} lines only hold {len(cells)} cells, too few for {n_locations} stations. Use more lines.")
+        linear = rng.choice(cells, size=n_locations, replace=False)
+    else:
+        if distribution == 'clustered':
+            centres = rng.uniform(0, map_size, size=(n_clusters, 2))
+            scale = cluster_spread * map_size
+        else:
+            centres = np.full((1, 2), map_size / 2)
+            scale = map_size / 4
+
+        linear = np.empty(0, dtype=np.int64)
+        for _ in range(MAX_SAMPLING_ROUNDS):
+            if len(linear) >= n_locations:
+                break
+            n_draws = 2 * (n_locations - len(linear)) + 64
+            points = centres[rng.integers(0, len(centres), size=n_draws)] + rng.normal(scale=scale, size=(n_draws, 2))
+            cells = np.floor(points).astype(np.int64)
+            cells = cells[np.all((cells >= 0) & (cells < map_size), axis=1)]
+            # Keep the first occurrence of every cell, in drawing order so the sample stays random
+            candidates = np.concatenate([linear, cells[:, 0] * map_size + cells[:, 1]])
+            _, first = np.unique(candidates, return_index=True)
+            linear = candidates[np.sort(first)]
+        if len(linear) < n_locations:
+            raise ValueError(f"Found only {len(linear)} unique cells for {n_locations} '{distribution}' stations "
+                             f"on a {map_size}x{map_size} map. Use a larger map or a wider distribution.")
+        linear = linear[:n_locations]
+
+    return np.stack(np.divmod(linear, map_size), axis=1).astype(np.int64)
+
+
+def generate_station_set(n_stations: int, map_size: int, distribution: str = 'uniform', seed=None,
+                         max_ap: int = MAX_AP, max_pd: int = MAX_PD, max_vc: int = MAX_VC, **distribution_kwargs) -> StationSet:
+    """
+    Generates a scenario of n_stations stations with unique locations and random data.
+
+    Parameters:
+        n_stations:
+            Number of stations to generate.
+        map_size:
+            Length of map along one axis.
+        distribution:
+            Spatial distribution of the stations, one of DISTRIBUTIONS.
+        seed:
+            Seed for reproducible scenarios. The same seed always gives the same scenario.
+        max_ap, max_pd, max_vc:
+            Maximum values for the randomly drawn air pollution, population density and vegetation cover data.
+        distribution_kwargs:
+            Passed on to sample_unique_locations.
+
+    Returns:
+        A StationSet.
+    """
+    assert max_ap <= MAX_AP, f"max_ap can not be >{MAX_AP}"
+    assert max_pd <= MAX_PD, f"max_pd can not be >{MAX_PD}"
+    assert max_vc <= MAX_VC, f"max_vc can not be >{MAX_VC}"
+
+    # Separate streams for locations and data, so changing the distribution keeps the data draws
+    location_rng, data_rng = [np.random.default_rng(child) for child in np.random.SeedSequence(seed).spawn(2)]
+    locations = sample_unique_locations(n_stations, map_size, distribution, seed=location_rng, **distribution_kwargs)
+    data = data_rng.integers(low=0, high=[max_ap, max_pd, max_vc], size=(n_stations, 3)).astype(float)
+    return StationSet(locations, data)
+
+
+if __name__ == "__main__":
+    import time
+
+    for distribution in DISTRIBUTIONS:
+        start = time.perf_counter()
+        n_stations = 20_000 if distribution == 'collinear' else 1_000_000
+        station_set = generate_station_set(n_stations, map_size=10_000, distribution=distribution, seed=0)
+        print(f"{distribution:>9}: {time.perf_counter() - start:.2f} s, {station_set}")
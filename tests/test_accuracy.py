@@ -0,0 +1,13 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'bokeh_plot_app'))
+
+from accuracy import run_suite  # noqa: E402
+
+
+def test_engines_match_the_references():
+    report = run_suite(n_samples=2000, max_workers=2)
+    failed = [f"{kind} {name}: max error {result['max_abs_error']:.3g} > {result['tolerance']:.3g}"
+              for kind in ('inference', 'interpolation') for name, result in report[kind].items() if not result['passed']]
+    assert report['passed'], "; ".join(failed)
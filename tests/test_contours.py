@@ -0,0 +1,25 @@
+import os
+import sys
+import numpy as np
+from scipy import ndimage
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'bokeh_plot_app'))
+
+from contours import zone_polygons  # noqa: E402
+
+
+def test_cells_exactly_at_the_level():
+    # Cells equal to the level collapse some rings to zero area; every component still gets its one outer ring
+    grid = np.random.default_rng(0).choice([0.0, 50.0, 100.0], size=(30, 30))
+    polygons = zone_polygons(grid, {'medium': 50.0}, min_area=0)
+    assert len(polygons) == ndimage.label(grid >= 50.0)[1]
+    assert all(polygon['area_cells'] >= 0 for polygon in polygons)
+
+
+def test_polygon_with_a_hole():
+    grid = np.zeros((9, 9))
+    grid[1:8, 1:8] = 100.0
+    grid[3:6, 3:6] = 0.0
+    [polygon] = zone_polygons(grid, {'high': 50.0}, min_area=1)
+    assert len(polygon['rings']) == 2
+    assert polygon['n_cells'] == 40
@@ -0,0 +1,117 @@
+import multiprocessing
+import os
+import secrets
+import queue
+import signal
+import sys
+import threading
+import time
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'bokeh_plot_app'))
+
+from mapApi import Map, Station  # noqa: E402
+from heatmap_utils_api import compute_heatmap  # noqa: E402
+from distributed import TileManager, run_coordinator, run_worker  # noqa: E402
+import bettair  # noqa: E402
+
+TIMEOUT = 120.0
+
+
+def _wait_for(condition, message: str) -> None:
+    deadline = time.monotonic() + TIMEOUT
+    while not condition():
+        assert time.monotonic() < deadline, message
+        time.sleep(0.05)
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGSTOP'), reason="Needs POSIX signals to freeze a worker")
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")  # The manager's server thread ends with SystemExit
+def test_tiles_of_a_killed_worker_are_requeued(tmp_path):
+    rng = np.random.default_rng(0)
+    coordinates = np.array([51.4, -0.2]) + rng.random((30, 2)) * [0.2, 0.3]
+    data = rng.random((30, 3)) * [70, 150, 100]
+    map_obj = Map(np.array([Station.from_values(latitude, longitude, *values)
+                            for (latitude, longitude), values in zip(coordinates, data)]), size=128)
+
+    addresses, results, authkey = queue.Queue(), {}, secrets.token_bytes(16)
+    coordinator = threading.Thread(target=lambda: results.update(heatmap=run_coordinator(
+        map_obj, str(tmp_path / 'heatmap.npy'), authkey, address=('127.0.0.1', 0), tile_size=16, lease_timeout=1.0,
+        progress_interval=TIMEOUT, on_listening=addresses.put)), daemon=True)
+    coordinator.start()
+    address = addresses.get(timeout=TIMEOUT)
+
+    context = multiprocessing.get_context('spawn')
+    doomed = context.Process(target=run_worker, args=(address, authkey), kwargs={'worker_id': 'doomed'})
+    workers = [context.Process(target=run_worker, args=(address, authkey), kwargs={'worker_id': f"worker-{index}"}) for index in range(2)]
+    try:
+        doomed.start()
+        manager = TileManager(address=address, authkey=authkey)
+        manager.connect()
+        tile_queue = manager.get_queue()
+
+        # Freeze the first worker until it is caught holding a lease, then kill it
+        def frozen_with_lease() -> bool:
+            os.kill(doomed.pid, signal.SIGSTOP)
+            # A submit the worker sent just before it stopped may still release its lease
+            time.sleep(0.5)
+            progress = tile_queue.progress()
+            assert progress['done'] < progress['tiles'], "The first worker finished before it could be killed"
+            if progress['leased']:
+                return True
+            os.kill(doomed.pid, signal.SIGCONT)
+            return False
+
+        _wait_for(frozen_with_lease, "The first worker never leased a tile")
+        doomed.kill()
+        doomed.join()
+        _wait_for(lambda: tile_queue.progress()['requeued'] > 0, "The killed worker's tile was not re-queued")
+
+        for worker in workers:
+            worker.start()
+        coordinator.join(TIMEOUT)
+        assert not coordinator.is_alive(), "The coordinator did not finish"
+        for worker in workers:
+            worker.join(TIMEOUT)
+            assert worker.exitcode == 0
+    finally:
+        for process in [doomed, *workers]:
+            if process.is_alive():
+                process.kill()
+
+    np.testing.assert_allclose(results['heatmap'], compute_heatmap(map_obj), atol=1e-9)
+
+
+def test_cli_requires_an_authkey(monkeypatch):
+    monkeypatch.delenv('BETTAIR_AUTHKEY', raising=False)
+    with pytest.raises(SystemExit, match='BETTAIR_AUTHKEY'):
+        bettair.main(['work', '127.0.0.1:50000'])
+    assert bettair.build_parser().parse_args(['coordinate', 'stations.json']).host == '127.0.0.1'
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")  # The manager's server thread ends with SystemExit
+def test_workers_use_the_shipped_pollutants(tmp_path):
+    rng = np.random.default_rng(1)
+    map_obj = Map(np.array([Station.from_values(51.4 + 0.2 * rng.random(), -0.2 + 0.3 * rng.random(), *values,
+                                                pollutants={'pm10': float(rng.integers(0, 201)), 'no2': float(rng.integers(0, 401))})
+                            for values in rng.random((20, 3)) * [70, 150, 100]]), size=48)
+
+    addresses, results, authkey = queue.Queue(), {}, secrets.token_bytes(16)
+    coordinator = threading.Thread(target=lambda: results.update(heatmap=run_coordinator(
+        map_obj, str(tmp_path / 'heatmap.npy'), authkey, address=('127.0.0.1', 0), tile_size=16,
+        progress_interval=TIMEOUT, on_listening=addresses.put, pollutants=True)), daemon=True)
+    coordinator.start()
+    # In a process of its own: registering the worker's side of TileManager here would replace the coordinator's
+    worker = multiprocessing.get_context('spawn').Process(target=run_worker, args=(addresses.get(timeout=TIMEOUT), authkey))
+    worker.start()
+    try:
+        coordinator.join(TIMEOUT)
+        assert not coordinator.is_alive(), "The coordinator did not finish"
+        worker.join(TIMEOUT)
+        assert worker.exitcode == 0
+    finally:
+        if worker.is_alive():
+            worker.kill()
+
+    np.testing.assert_allclose(results['heatmap'], compute_heatmap(map_obj, pollutants=True), atol=1e-9)
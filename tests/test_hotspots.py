@@ -0,0 +1,25 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'bokeh_plot_app'))
+
+from hotspots import find_hotspots  # noqa: E402
+
+
+def test_no_hotspots_requested():
+    heatmap = np.random.default_rng(0).random((50, 50))
+    assert find_hotspots(heatmap, k=0) == []
+    assert find_hotspots(heatmap, k=-1) == []
+
+
+def test_plateau_hotspots_are_separated():
+    heatmap = np.zeros((30, 30))
+    heatmap[5:15, 5:15] = 80.0
+    heatmap[20, 25] = 90.0
+    hotspots = find_hotspots(heatmap, k=3, min_separation=5, threshold=50)
+    assert hotspots[0] == {'row': 20, 'column': 25, 'score': 90.0}
+    assert len(hotspots) == 3
+    for index, first in enumerate(hotspots):
+        for second in hotspots[index + 1:]:
+            assert (first['row'] - second['row']) ** 2 + (first['column'] - second['column']) ** 2 >= 25
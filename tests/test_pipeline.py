@@ -0,0 +1,46 @@
+import asyncio
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'bokeh_plot_app'))
+
+from mapApi import Map, Station  # noqa: E402
+from heatmap_utils_api import compute_heatmap  # noqa: E402
+from pipeline import Pipeline, stub_source  # noqa: E402
+
+
+def _stations(n_stations: int = 12) -> list[dict]:
+    rng = np.random.default_rng(0)
+    return [{'location_id': index, 'latitude': 51.4 + 0.2 * rng.random(), 'longitude': -0.2 + 0.3 * rng.random(),
+             'air_quality': float(rng.integers(0, 71)), 'population_density': float(rng.integers(50, 151)),
+             'veg_cover': float(rng.integers(0, 101)),
+             'pollutants': {'pm10': float(rng.integers(0, 201)), 'no2': float(rng.integers(0, 401))}}
+            for index in range(n_stations)]
+
+
+def _last_heatmap(stations: list[dict], pollutants: bool) -> np.ndarray:
+    async def run() -> np.ndarray:
+        # noise=0 keeps the readings as given, so the result is the heatmap of the stations themselves
+        pipeline = Pipeline(stub_source(stations, interval=0.0, noise=0.0, n_readings=len(stations)), size=40,
+                            debounce=0.5, pollutants=pollutants)
+        queue = pipeline.subscribe(maxsize=len(stations))
+        await pipeline.run()
+        results = []
+        while (result := queue.get_nowait()) is not None:
+            results.append(result)
+        return results[-1]['heatmap']
+
+    return asyncio.run(run())
+
+
+def test_pipeline_uses_the_pollutants_when_asked():
+    stations = _stations()
+    map_obj = Map(np.array([Station.from_values(station['latitude'], station['longitude'], station['air_quality'],
+                                                station['population_density'], station['veg_cover'],
+                                                pollutants=station['pollutants']) for station in stations]), size=40)
+
+    with_pollutants = _last_heatmap(stations, pollutants=True)
+    np.testing.assert_allclose(with_pollutants, compute_heatmap(map_obj, pollutants=True), atol=1e-9)
+    np.testing.assert_allclose(_last_heatmap(stations, pollutants=False), compute_heatmap(map_obj), atol=1e-9)
+    assert not np.allclose(with_pollutants, compute_heatmap(map_obj))